@@ -0,0 +1,83 @@
+import os
+from typing import List, Optional
+
+from llama_index.core import QueryBundle
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.settings import Settings
+from llama_index.core.vector_stores.types import VectorStoreQueryMode
+
+
+class AdaptiveTopKPostprocessor(BaseNodePostprocessor):
+    """
+    Cut an over-fetched candidate pool down to the chunks that are worth sending to the LLM.
+
+    The pool is cut at the first large drop in the score curve (the "knee"), when a chunk
+    falls too far below the best score, or when the token budget of the context is reached,
+    whichever comes first. At least `min_k` and at most `max_k` nodes are kept.
+
+    The score cuts assume one score scale. Hybrid and sparse results mix or use BM25
+    ranks, so outside the dense mode (`query_mode` "default") the pool is only cut by
+    the token budget, in retrieval order.
+    """
+
+    min_k: int = 1
+    max_k: int = 8
+    gap_ratio: float = 0.25
+    relative_floor: float = 0.75
+    token_budget: int = 1500
+    query_mode: str = "default"
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "AdaptiveTopKPostprocessor"
+
+    @classmethod
+    def from_env(cls, query_mode: str = "default") -> "AdaptiveTopKPostprocessor":
+        return cls(
+            min_k=int(os.getenv("TOP_K_MIN", 1)),
+            max_k=int(os.getenv("TOP_K_MAX", 8)),
+            gap_ratio=float(os.getenv("TOP_K_GAP_RATIO", 0.25)),
+            relative_floor=float(os.getenv("TOP_K_RELATIVE_FLOOR", 0.75)),
+            token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500)),
+            query_mode=VectorStoreQueryMode(query_mode).value,
+        )
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if not nodes:
+            return nodes
+
+        dense = self.query_mode == "default"
+        if dense:
+            ranked = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)
+        else:
+            ranked = list(nodes)
+        pool = ranked[: self.max_k]
+        scores = [n.score or 0.0 for n in pool]
+        top = scores[0]
+        # Normalise gaps by the spread of the whole pool, so the cut does not depend on
+        # the absolute scale of the scores (cosine similarity vs. BM25 rank).
+        # A flat pool (all chunks about equally relevant) must not be cut by tiny gaps.
+        spread = max(top - scores[-1], abs(top) * 0.1) or 1.0
+
+        tokenizer = Settings.tokenizer
+        kept: List[NodeWithScore] = []
+        used_tokens = 0
+        for i, node in enumerate(pool):
+            if dense and i >= self.min_k:
+                gap = (scores[i - 1] - scores[i]) / spread
+                if gap >= self.gap_ratio:
+                    break
+                if top > 0 and scores[i] < top * self.relative_floor:
+                    break
+            tokens = len(tokenizer(node.node.get_content(metadata_mode=MetadataMode.LLM)))
+            if i >= self.min_k and used_tokens + tokens > self.token_budget:
+                break
+            used_tokens += tokens
+            kept.append(node)
+
+        return kept
@@ -0,0 +1,383 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from llama_index.core import QueryBundle
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+from llama_index.core.llms.llm import ToolSelection
+from llama_index.core.schema import NodeWithScore
+
+from src.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Session of the request being served, used for fairness in nested limiters
+current_session: ContextVar[str] = ContextVar("current_session", default="default")
+
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class AdmissionRejected(Exception):
+    """The request cannot be queued or waited too long; retry after `retry_after` seconds."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class FairLimiter:
+    """
+    Concurrency limit with a bounded wait queue served round-robin across sessions.
+
+    A session that submits many requests only gets its turn once every other waiting
+    session had one, so a single client cannot starve the others.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        max_queue: Optional[int] = None,
+        max_queue_per_session: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_session = max_queue_per_session
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future[None]]]" = OrderedDict()
+        # Moving average of how long a slot is held, used for Retry-After
+        self._hold_time = 1.0
+        self.wait_time = REGISTRY.histogram(
+            f"chateduca_{name}_queue_wait_seconds",
+            f"Time spent waiting for a {name} slot",
+        )
+        self.queue_depth = REGISTRY.histogram(
+            f"chateduca_{name}_queue_depth",
+            f"Requests already waiting for a {name} slot on arrival",
+            buckets=QUEUE_DEPTH_BUCKETS,
+        )
+        self.rejections = REGISTRY.counter(
+            f"chateduca_{name}_rejected_total",
+            f"Requests rejected by the {name} limiter",
+            labelnames=("reason",),
+        )
+        REGISTRY.gauge(f"chateduca_{name}_active", f"Busy {name} slots", lambda: self.active)
+        REGISTRY.gauge(
+            f"chateduca_{name}_waiting", f"Requests queued for a {name} slot", lambda: self.waiting
+        )
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self._hold_time * (self.waiting + 1) / self.concurrency))
+
+    def _reject(self, status_code: int, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        self.rejections.inc(reason=reason)
+        logger.warning(f"{self.name}: rejected request ({reason})")
+        return AdmissionRejected(status_code, reason, self.retry_after())
+
+    async def acquire(self, session_id: Optional[str] = None) -> float:
+        """
+        Wait for a slot.
+
+        Returns:
+            The acquisition time, to be passed back to `release`.
+
+        Raises:
+            AdmissionRejected: 429 when the session already has too many queued requests,
+                503 when the whole queue is full or the queue timeout expires.
+        """
+        session_id = session_id or current_session.get()
+        start = time.perf_counter()
+        self.queue_depth.observe(self.waiting)
+        if self.active < self.concurrency and self.waiting == 0:
+            self.active += 1
+            self.wait_time.observe(0.0)
+            return start
+
+        if self.max_queue is not None and self.waiting >= self.max_queue:
+            raise self._reject(503, "queue_full")
+        queue = self._queues.setdefault(session_id, deque())
+        if (
+            self.max_queue_per_session is not None
+            and len(queue) >= self.max_queue_per_session
+        ):
+            raise self._reject(429, "session_queue_full")
+
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was granted while timing out, give it back
+                self.release()
+            else:
+                future.cancel()
+                self._remove(session_id, future)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(503, "queue_timeout")
+            raise
+        acquired = time.perf_counter()
+        self.wait_time.observe(acquired - start)
+        return acquired
+
+    def _remove(self, session_id: str, future: "asyncio.Future[None]") -> None:
+        queue = self._queues.get(session_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[session_id]
+
+    def release(self, acquired_at: Optional[float] = None) -> None:
+        if acquired_at is not None:
+            held = time.perf_counter() - acquired_at
+            self._hold_time = 0.9 * self._hold_time + 0.1 * held
+        self.active -= 1
+        # Hand the slot to the next session in round-robin order
+        while self._queues and self.active < self.concurrency:
+            session_id, queue = self._queues.popitem(last=False)
+            future = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self._queues[session_id] = queue
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "wait_time_seconds": self.wait_time.snapshot(),
+            "queue_depth": self.queue_depth.snapshot(),
+        }
+
+
+class ConcurrencyGovernor:
+    """
+    Separate limits for admitted requests (workflow runs), for the LLM calls they make
+    and for retrievals against the vector store.
+
+    One workflow run can make several LLM calls at once (agent turns, one synthesis per
+    parallel tool call), so the upstream rate limit is governed per call by `llm`
+    (see `LimitedLLM`), while `requests` bounds the queue and rejects what cannot wait.
+    """
+
+    def __init__(self, requests: FairLimiter, llm: FairLimiter, retrieval: FairLimiter) -> None:
+        self.requests = requests
+        self.llm = llm
+        self.retrieval = retrieval
+
+    @classmethod
+    def from_env(cls) -> "ConcurrencyGovernor":
+        return cls(
+            requests=FairLimiter(
+                "requests",
+                concurrency=int(os.getenv("MAX_CONCURRENT_REQUESTS", 16)),
+                max_queue=int(os.getenv("ADMISSION_QUEUE_SIZE", 64)),
+                max_queue_per_session=int(os.getenv("ADMISSION_QUEUE_PER_SESSION", 4)),
+                queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 15)),
+            ),
+            # LLM calls and retrievals happen inside admitted requests, so they wait
+            # instead of failing
+            llm=FairLimiter("llm", concurrency=int(os.getenv("MAX_CONCURRENT_LLM", 8))),
+            retrieval=FairLimiter(
+                "retrieval",
+                concurrency=int(os.getenv("MAX_CONCURRENT_RETRIEVALS", 16)),
+            ),
+        )
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests.snapshot(),
+            "llm": self.llm.snapshot(),
+            "retrieval": self.retrieval.snapshot(),
+        }
+
+
+_governor: Optional[ConcurrencyGovernor] = None
+
+
+def get_governor() -> ConcurrencyGovernor:
+    global _governor
+    if _governor is None:
+        _governor = ConcurrencyGovernor.from_env()
+    return _governor
+
+
+class LimitedRetriever(BaseRetriever):
+    """Wrap a retriever so async retrievals go through the governor's retrieval limit."""
+
+    def __init__(self, retriever: BaseRetriever) -> None:
+        self._retriever = retriever
+        super().__init__(
+            callback_manager=retriever.callback_manager,
+            verbose=retriever._verbose,
+        )
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._retriever.retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        limiter = get_governor().retrieval
+        acquired_at = await limiter.acquire()
+        try:
+            return await self._retriever.aretrieve(query_bundle)
+        finally:
+            limiter.release(acquired_at)
+
+
+class LimitedLLM(FunctionCallingLLM):
+    """
+    Wrap an LLM so its async calls go through the governor's LLM limit.
+
+    A streamed call holds its slot until the stream is consumed or closed. Sync calls
+    are not limited (the limiter is asyncio-based); the server only makes async calls.
+    """
+
+    llm: FunctionCallingLLM = Field(description="The LLM whose calls are limited.")
+
+    def __init__(self, llm: FunctionCallingLLM, **kwargs: Any) -> None:
+        super().__init__(llm=llm, callback_manager=llm.callback_manager, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LimitedLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self.llm.metadata
+
+    # Tool calling is prepared and parsed by the wrapped LLM
+
+    def _prepare_chat_with_tools(
+        self,
+        tools: Sequence[Any],
+        user_msg: Optional[Any] = None,
+        chat_history: Optional[List[ChatMessage]] = None,
+        verbose: bool = False,
+        allow_parallel_tool_calls: bool = False,
+        tool_required: bool = False,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        return self.llm._prepare_chat_with_tools_compat(
+            tools,
+            user_msg=user_msg,
+            chat_history=chat_history,
+            verbose=verbose,
+            allow_parallel_tool_calls=allow_parallel_tool_calls,
+            tool_required=tool_required,
+            **kwargs,
+        )
+
+    def _validate_chat_with_tools_response(
+        self,
+        response: ChatResponse,
+        tools: Sequence[Any],
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> ChatResponse:
+        return self.llm._validate_chat_with_tools_response(
+            response, tools, allow_parallel_tool_calls=allow_parallel_tool_calls, **kwargs
+        )
+
+    def get_tool_calls_from_response(
+        self, response: ChatResponse, error_on_no_tool_call: bool = True, **kwargs: Any
+    ) -> List[ToolSelection]:
+        return self.llm.get_tool_calls_from_response(
+            response, error_on_no_tool_call=error_on_no_tool_call, **kwargs
+        )
+
+    # Limited async calls
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        limiter = get_governor().llm
+        acquired_at = await limiter.acquire()
+        try:
+            return await self.llm.achat(messages, **kwargs)
+        finally:
+            limiter.release(acquired_at)
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        async def gen() -> ChatResponseAsyncGen:
+            # Acquired on the first read, so a stream that is never read holds no slot
+            limiter = get_governor().llm
+            acquired_at = await limiter.acquire()
+            try:
+                async for chunk in await self.llm.astream_chat(messages, **kwargs):
+                    yield chunk
+            finally:
+                limiter.release(acquired_at)
+
+        return gen()
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        limiter = get_governor().llm
+        acquired_at = await limiter.acquire()
+        try:
+            return await self.llm.acomplete(prompt, formatted=formatted, **kwargs)
+        finally:
+            limiter.release(acquired_at)
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        async def gen() -> CompletionResponseAsyncGen:
+            limiter = get_governor().llm
+            acquired_at = await limiter.acquire()
+            try:
+                stream = await self.llm.astream_complete(prompt, formatted=formatted, **kwargs)
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                limiter.release(acquired_at)
+
+        return gen()
+
+    # Sync calls
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return self.llm.chat(messages, **kwargs)
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        return self.llm.stream_chat(messages, **kwargs)
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return self.llm.complete(prompt, formatted=formatted, **kwargs)
+
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        return self.llm.stream_complete(prompt, formatted=formatted, **kwargs)
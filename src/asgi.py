@@ -0,0 +1,144 @@
+"""
+Fast-starting ASGI entry point: uvicorn src.asgi:app
+
+Only the standard library and dotenv are imported here, so the server accepts connections
+right away. The real app (SERVE_APP, default src.dev:app) is imported in a
+thread and started in the background, including its warmup.
+
+/health answers as soon as the process is up ("starting" until the app is started) and
+returns 503 with the error if the app failed to load, so a liveness probe restarts the
+process. /ready, the readiness probe, answers 200 only once the app is started; other
+requests get 503 with Retry-After until then.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+async def _send_json(send: Any, status: int, body: dict, headers: Optional[list] = None) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), *(headers or [])],
+        }
+    )
+    await send({"type": "http.response.body", "body": json.dumps(body).encode()})
+
+
+class LazyApp:
+    """Import and start the wrapped app in the background, answering health checks meanwhile."""
+
+    def __init__(self, app_path: str) -> None:
+        self.app_path = app_path
+        self.app: Any = None
+        self.phase = "starting"
+        self.error: Optional[str] = None
+        self.started = time.perf_counter()
+        self._ready = asyncio.Event()
+        self._lifespan_receive: Optional[asyncio.Queue] = None
+        self._lifespan_done: Optional[asyncio.Queue] = None
+        self._load_task: Optional[asyncio.Task] = None
+        self._lifespan_task: Optional[asyncio.Task] = None
+
+    async def _load(self) -> None:
+        from uvicorn.importer import import_from_string
+
+        try:
+            self.phase = "importing"
+            self.app = await asyncio.to_thread(import_from_string, self.app_path)
+            logger.info(f"Imported {self.app_path} in {time.perf_counter() - self.started:.2f}s")
+
+            # Run the app's own lifespan (workflow creation and warmup)
+            self.phase = "warming_up"
+            self._lifespan_receive = asyncio.Queue()
+            self._lifespan_done = asyncio.Queue()
+            await self._lifespan_receive.put({"type": "lifespan.startup"})
+            self._lifespan_task = asyncio.create_task(
+                self.app(
+                    {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}},
+                    self._lifespan_receive.get,
+                    self._lifespan_done.put,
+                )
+            )
+            message = await self._lifespan_done.get()
+            if message["type"] == "lifespan.startup.failed":
+                raise RuntimeError(message.get("message") or "startup failed")
+        except Exception as e:
+            self.phase = "failed"
+            self.error = str(e)
+            logger.error(f"Could not start {self.app_path}: {e}", exc_info=True)
+            return
+        self.phase = "ready"
+        self._ready.set()
+        logger.info(f"Ready after {time.perf_counter() - self.started:.2f}s")
+
+    async def _lifespan(self, receive: Any, send: Any) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._load_task = asyncio.create_task(self._load())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._load_task is not None and not self._load_task.done():
+                    self._load_task.cancel()
+                if self._ready.is_set():
+                    await self._lifespan_receive.put({"type": "lifespan.shutdown"})
+                    await self._lifespan_done.get()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        path = scope.get("path", "")
+        if scope["type"] == "http" and path == "/health":
+            if self.phase == "failed":
+                await _send_json(
+                    send, 503, {"status": "failed", "phase": self.phase, "error": self.error}
+                )
+                return
+            state = "healthy" if self._ready.is_set() else "starting"
+            await _send_json(send, 200, {"status": state, "phase": self.phase})
+            return
+        if scope["type"] == "http" and path == "/ready":
+            status = 200 if self._ready.is_set() else 503
+            await _send_json(send, status, {"phase": self.phase, "error": self.error})
+            return
+        if not self._ready.is_set():
+            if scope["type"] == "http":
+                if self.phase == "failed":
+                    body = {"error": f"Server failed to start: {self.error}", "phase": self.phase}
+                    headers = []
+                else:
+                    body = {"error": "Server starting, try again later", "phase": self.phase}
+                    headers = [(b"retry-after", b"1")]
+                await _send_json(send, 503, body, headers=headers)
+            return
+        await self.app(scope, receive, send)
+
+
+app = LazyApp(os.getenv("SERVE_APP", "src.dev:app"))
+
+
+def main():
+    """Run the fast-starting server"""
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run("src.asgi:app", host="0.0.0.0", port=8000, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
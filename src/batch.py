@@ -0,0 +1,165 @@
+"""
+Answer a list of questions at once, for reports and offline evaluations.
+
+The query embeddings of all questions are computed up front in full-size batches,
+then each question runs through the workflow (retrieval and synthesis) with at most
+BATCH_CONCURRENCY questions in flight. Results are yielded in completion order, each
+tagged with the index of its question. Every question is answered without chat
+history.
+
+Run with: uv run batch questions.json > answers.ndjson
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, AsyncIterator, List, Optional
+
+from llama_index.core.settings import Settings
+
+from src.admission import AdmissionRejected, current_session, get_governor
+from src.batching import BatchingEmbedding
+
+logger = logging.getLogger(__name__)
+
+
+async def _run_admitted(workflow: Any, question: str, session_id: str) -> Any:
+    governor = get_governor()
+    current_session.set(session_id)
+    while True:
+        try:
+            acquired_at = await governor.requests.acquire(session_id)
+            break
+        except AdmissionRejected as e:
+            # A batch waits for its turn instead of failing its questions
+            await asyncio.sleep(e.retry_after)
+    try:
+        return await workflow.run(user_msg=question)
+    finally:
+        governor.requests.release(acquired_at)
+
+
+async def answer_batch(
+    workflow: Any,
+    questions: List[str],
+    concurrency: Optional[int] = None,
+    session_id: str = "batch",
+) -> AsyncIterator[dict]:
+    """
+    Answer `questions`, yielding one result per question as soon as it is ready.
+
+    Args:
+        workflow: The RoutedWorkflow to run each question through.
+        questions: The questions, answered independently of each other.
+        concurrency: Questions in flight at once, defaults to BATCH_CONCURRENCY.
+        session_id: Fairness key for the LLM limiter, so a batch shares the slots
+            with interactive sessions instead of taking all of them.
+
+    Yields:
+        Dicts with `index`, `question`, `response`, `sources` and `elapsed_ms`,
+        or `index`, `question` and `error` when the question failed.
+    """
+    if concurrency is None:
+        concurrency = int(os.getenv("BATCH_CONCURRENCY", 8))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    embed_model = Settings.embed_model
+    batching = embed_model if isinstance(embed_model, BatchingEmbedding) else None
+    if batching is not None:
+        try:
+            await batching.prime(questions)
+        except Exception as e:
+            # Each question will embed its own query instead
+            logger.warning(f"Could not pre-embed the batch: {e}")
+
+    async def answer(index: int, question: str) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await _run_admitted(workflow, question, session_id)
+            except Exception as e:
+                logger.error(f"Batch question {index} failed: {e}")
+                return {"index": index, "question": question, "error": str(e)}
+            return {
+                "index": index,
+                "question": question,
+                "response": str(result.response),
+                "sources": getattr(result, "sources", []),
+                "elapsed_ms": round((time.perf_counter() - start) * 1000),
+            }
+
+    tasks = [asyncio.ensure_future(answer(i, q)) for i, q in enumerate(questions)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        if batching is not None:
+            batching.forget(questions)
+
+
+def read_questions(path: str) -> List[str]:
+    """Read a JSON list of questions, or one question per line."""
+    with open(path, encoding="utf-8") if path != "-" else sys.stdin as f:
+        content = f.read()
+    if content.lstrip().startswith("["):
+        return [str(q) for q in json.loads(content)]
+    return [line.strip() for line in content.splitlines() if line.strip()]
+
+
+async def run_batch(path: str, output: Optional[str], concurrency: Optional[int]) -> None:
+    from src.workflow import create_workflow
+
+    questions = read_questions(path)
+    workflow = await asyncio.to_thread(create_workflow)
+    out = open(output, "w", encoding="utf-8") if output else sys.stdout
+    start = time.perf_counter()
+    failed = 0
+    try:
+        async for result in answer_batch(workflow, questions, concurrency):
+            failed += "error" in result
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if output:
+            out.close()
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Answered {len(questions)} questions ({failed} failed) in {elapsed:.1f}s "
+        f"({len(questions) / max(elapsed, 1e-9):.2f} questions/s)"
+    )
+
+
+def main():
+    """Answer a file of questions and write the results as NDJSON"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        stream=sys.stderr,
+    )
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("questions", help="JSON list or one question per line ('-' for stdin)")
+    parser.add_argument("-o", "--output", help="NDJSON file to write, stdout by default")
+    parser.add_argument(
+        "-c", "--concurrency", type=int, help="Questions in flight (BATCH_CONCURRENCY)"
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Replay LLM answers to identical prompts from disk (LLM_CACHE), for evaluations",
+    )
+    args = parser.parse_args()
+    if args.cache:
+        os.environ["LLM_CACHE"] = "true"
+    asyncio.run(run_batch(args.questions, args.output, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
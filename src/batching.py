@@ -0,0 +1,174 @@
+import asyncio
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+
+class _LoopBatch:
+    """Queries waiting for the next batched request, in one event loop."""
+
+    def __init__(self) -> None:
+        self.pending: List[Tuple[str, "asyncio.Future[List[float]]"]] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.tasks: Set["asyncio.Task[None]"] = set()
+
+
+class BatchingEmbedding(BaseEmbedding):
+    """
+    Coalesce concurrent async query embeddings into a single batched request.
+
+    Queries that arrive within `max_wait_ms` of each other (e.g. several tool calls of
+    the same agent step) share one call to the wrapped model. Everything else, including
+    the text embeddings of the ingestion pipeline, is delegated unchanged.
+
+    Queries known in advance (a batch of questions) can be embedded in full-size
+    batches with `prime`; their later query embeddings are then answered locally.
+
+    A batch is one text-embeddings request only when the model embeds queries and texts
+    alike (`symmetric`, detected from the query and text engines of OpenAIEmbedding);
+    otherwise the queries of a batch are embedded as queries, concurrently. Pending
+    queries are kept per event loop, a flush never crosses loops.
+    """
+
+    embed_model: BaseEmbedding = Field(description="The embedding model to batch for.")
+    max_wait_ms: float = Field(default=5.0)
+    max_batch: int = Field(default=32)
+    symmetric: Optional[bool] = Field(
+        default=None,
+        description="Whether query and text embeddings are the same, None to detect it.",
+    )
+
+    _batches: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopBatch]" = (
+        PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+    )
+    _primed: Dict[str, List[float]] = PrivateAttr(default_factory=dict)
+    # Primed queries are shared by concurrent batches: each `prime` holds a reference
+    # until its `forget`, and a vector is dropped when no batch holds it anymore
+    _primed_refs: Dict[str, int] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, embed_model: BaseEmbedding, **kwargs: Any) -> None:
+        super().__init__(
+            embed_model=embed_model,
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs,
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchingEmbedding"
+
+    def _is_symmetric(self) -> bool:
+        if self.symmetric is not None:
+            return self.symmetric
+        query_engine = getattr(self.embed_model, "_query_engine", None)
+        return query_engine is not None and query_engine == getattr(
+            self.embed_model, "_text_engine", None
+        )
+
+    async def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        if self._is_symmetric():
+            # One request for the whole batch
+            return await self.embed_model._aget_text_embeddings(queries)
+        # Asymmetric models embed queries differently from documents
+        return list(
+            await asyncio.gather(
+                *(self.embed_model._aget_query_embedding(query) for query in queries)
+            )
+        )
+
+    def _flush(self, state: _LoopBatch) -> None:
+        if state.flush_handle is not None:
+            state.flush_handle.cancel()
+            state.flush_handle = None
+        batch, state.pending = state.pending, []
+        if batch:
+            # Keep a reference, the event loop only holds weak references to tasks
+            task = asyncio.ensure_future(self._embed_batch(batch))
+            state.tasks.add(task)
+            task.add_done_callback(state.tasks.discard)
+
+    async def _embed_batch(
+        self, batch: List[Tuple[str, "asyncio.Future[List[float]]"]]
+    ) -> None:
+        try:
+            embeddings = await self._embed_queries([query for query, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    async def prime(self, queries: List[str]) -> None:
+        """
+        Embed queries ahead of time, `embed_batch_size` per request.
+
+        Args:
+            queries: Texts that will be embedded as queries soon, e.g. the questions
+                of a batch. Call `forget` with the same texts when they are done,
+                even if this call failed.
+        """
+        unique = list(dict.fromkeys(queries))
+        for query in unique:
+            self._primed_refs[query] = self._primed_refs.get(query, 0) + 1
+        missing = [q for q in unique if q not in self._primed]
+        batches = [
+            missing[i : i + self.embed_batch_size]
+            for i in range(0, len(missing), self.embed_batch_size)
+        ]
+        results = await asyncio.gather(*(self._embed_queries(batch) for batch in batches))
+        for batch, embeddings in zip(batches, results):
+            self._primed.update(
+                (query, embedding)
+                for query, embedding in zip(batch, embeddings)
+                # Already forgotten by a batch that ended meanwhile
+                if query in self._primed_refs
+            )
+
+    def forget(self, queries: Iterable[str]) -> None:
+        """Release the references taken by `prime` on these queries."""
+        for query in dict.fromkeys(queries):
+            refs = self._primed_refs.get(query, 0) - 1
+            if refs > 0:
+                self._primed_refs[query] = refs
+            else:
+                self._primed_refs.pop(query, None)
+                self._primed.pop(query, None)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        primed = self._primed.get(query)
+        if primed is not None:
+            return primed
+        loop = asyncio.get_running_loop()
+        state = self._batches.get(loop)
+        if state is None:
+            state = self._batches[loop] = _LoopBatch()
+        future: "asyncio.Future[List[float]]" = loop.create_future()
+        state.pending.append((query, future))
+        if len(state.pending) >= self.max_batch:
+            self._flush(state)
+        elif state.flush_handle is None:
+            state.flush_handle = loop.call_later(
+                self.max_wait_ms / 1000, self._flush, state
+            )
+        return await future
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.embed_model._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.embed_model._get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_model._get_text_embeddings(texts)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await self.embed_model._aget_text_embedding(text)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self.embed_model._aget_text_embeddings(texts)
@@ -0,0 +1,154 @@
+"""
+Chunking throughput, and the effect of the chunk size on retrieval and prompt size.
+Run with: python -m src.benchmarks.chunking [--chunk-sizes 256,512,1024] [--workers 4]
+
+Reads the documents of DATA_DIR (or --data-dir) with the ingestion readers and splits
+them at every chunk size with SentenceSplitter and with src.chunking.CachedSentenceSplitter
+(one process and --workers processes). The report gives the chunks per second of each
+and whether the cached splitter produced exactly the chunks of SentenceSplitter.
+
+Unless --no-retrieval is given, the chunks of each size are embedded with the embedding
+model of the settings (OPENAI_API_KEY, or OPENAI_API_BASE pointing at another server)
+and searched by exact cosine similarity. Queries are sentences drawn from the corpus;
+a query is answered when one of its top-k chunks contains the sentence. The report gives
+the hit rate, the MRR and the average prompt tokens of the top-k chunks as the LLM sees
+them, as JSON (stdout and --output). Embedding the corpus once per chunk size has a cost.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.node_parser.text.utils import split_by_sentence_tokenizer
+from llama_index.core.schema import BaseNode, Document, MetadataMode
+from llama_index.core.settings import Settings
+
+from src.benchmarks.loadtest import git_commit
+from src.benchmarks.retrieval import int_list
+from src.chunking import CHUNK_OVERLAP, get_node_parser
+
+
+def sample_queries(documents: List[Document], count: int, seed: int = 0) -> List[str]:
+    """Sentences of at least 8 words, drawn from random documents."""
+    rng = random.Random(seed)
+    split_sentences = split_by_sentence_tokenizer()
+    queries: List[str] = []
+    for _ in range(count * 20):
+        if len(queries) == count:
+            break
+        document = rng.choice(documents)
+        sentences = [
+            s.strip() for s in split_sentences(document.text) if len(s.split()) >= 8
+        ]
+        if sentences:
+            sentence = rng.choice(sentences)
+            if sentence not in queries:
+                queries.append(sentence)
+    return queries
+
+
+def time_splitter(splitter, documents: List[Document]) -> tuple:
+    start = time.perf_counter()
+    nodes = splitter.get_nodes_from_documents(documents)
+    return nodes, time.perf_counter() - start
+
+
+def measure_retrieval(nodes: List[BaseNode], queries: List[str], top_k: int) -> dict:
+    embed_model = Settings.embed_model
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    vectors = np.array(embed_model.get_text_embedding_batch(texts))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = np.array([embed_model.get_query_embedding(q) for q in queries])
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    ranking = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :top_k]
+
+    hits, reciprocal_ranks, prompt_tokens = [], [], []
+    for query, top in zip(queries, ranking):
+        contents = [nodes[i].get_content(metadata_mode=MetadataMode.NONE) for i in top]
+        rank = next((r + 1 for r, text in enumerate(contents) if query in text), None)
+        hits.append(rank is not None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        prompt_tokens.append(
+            sum(
+                len(Settings.tokenizer(nodes[i].get_content(metadata_mode=MetadataMode.LLM)))
+                for i in top
+            )
+        )
+    return {
+        "hit_rate": round(float(np.mean(hits)), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "avg_prompt_tokens": round(float(np.mean(prompt_tokens)), 1),
+    }
+
+
+def main():
+    """Compare the chunkers and the chunk sizes and print the results as JSON"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--data-dir", help="Corpus to chunk, defaults to DATA_DIR")
+    parser.add_argument("--chunk-sizes", type=int_list, default=[256, 512, 1024])
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=int(os.getenv("TOP_K", 2)))
+    parser.add_argument("--no-retrieval", action="store_true", help="Only time the chunkers")
+    parser.add_argument("--output", help="Write the report to this file as well")
+    args = parser.parse_args()
+    if args.data_dir:
+        os.environ["DATA_DIR"] = args.data_dir
+
+    from src.utils.loaders import get_file_documents
+
+    documents = get_file_documents()
+    if not documents:
+        parser.error("No documents to chunk")
+    queries = []
+    if not args.no_retrieval:
+        from src.settings import init_settings
+
+        init_settings()
+        queries = sample_queries(documents, args.queries)
+
+    results = []
+    for chunk_size in args.chunk_sizes:
+        kwargs = {"chunk_size": chunk_size, "chunk_overlap": args.chunk_overlap}
+        reference, reference_s = time_splitter(SentenceSplitter(**kwargs), documents)
+        result = {
+            "chunk_size": chunk_size,
+            "chunks": len(reference),
+            "chunks_per_s": {"sentence_splitter": round(len(reference) / reference_s, 1)},
+            "identical": True,
+        }
+        expected = [node.get_content(metadata_mode=MetadataMode.NONE) for node in reference]
+        for name, workers in (("cached", 1), (f"cached_{args.workers}_workers", args.workers)):
+            nodes, elapsed = time_splitter(get_node_parser(workers=workers, **kwargs), documents)
+            result["chunks_per_s"][name] = round(len(nodes) / elapsed, 1)
+            texts = [node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes]
+            result["identical"] = result["identical"] and texts == expected
+        if queries:
+            result.update(measure_retrieval(reference, queries, args.top_k))
+        results.append(result)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "documents": len(documents),
+        "queries": len(queries),
+        "top_k": args.top_k,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare the context size sent to the LLM by the static and adaptive top-k modes.
+Run with: python -m src.benchmarks.context_tokens [queries.json]
+
+Only retrieval runs (no synthesis), so the cost is one embedding call and one
+database query per question.
+"""
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import List
+
+from dotenv import load_dotenv
+from llama_index.core import QueryBundle
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.settings import Settings
+
+from src.adaptive import AdaptiveTopKPostprocessor
+from src.index import get_index
+from src.settings import init_settings
+
+DEFAULT_QUERIES = Path(__file__).with_name("queries.json")
+
+
+def count_tokens(nodes: List[NodeWithScore]) -> int:
+    return sum(
+        len(Settings.tokenizer(n.node.get_content(metadata_mode=MetadataMode.LLM)))
+        for n in nodes
+    )
+
+
+async def run(queries: List[str]) -> dict:
+    index = get_index()
+    static_k = int(os.getenv("TOP_K", 2))
+    pool_k = int(os.getenv("TOP_K_CANDIDATES", 10))
+    retriever = index.as_retriever(similarity_top_k=pool_k)
+    adaptive = AdaptiveTopKPostprocessor.from_env()
+
+    static_tokens, adaptive_tokens, adaptive_nodes = [], [], []
+    for query in queries:
+        bundle = QueryBundle(query_str=query)
+        # The static top-k result is a prefix of the candidate pool,
+        # so both modes can be measured from a single round-trip.
+        pool = await retriever.aretrieve(bundle)
+        kept = adaptive.postprocess_nodes(list(pool), query_bundle=bundle)
+        static_tokens.append(count_tokens(pool[:static_k]))
+        adaptive_tokens.append(count_tokens(kept))
+        adaptive_nodes.append(len(kept))
+
+    n = len(queries) or 1
+    return {
+        "queries": len(queries),
+        "static_top_k": static_k,
+        "candidate_pool": pool_k,
+        "avg_context_tokens_static": sum(static_tokens) / n,
+        "avg_context_tokens_adaptive": sum(adaptive_tokens) / n,
+        "avg_nodes_adaptive": sum(adaptive_nodes) / n,
+    }
+
+
+def main():
+    load_dotenv()
+    init_settings()
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_QUERIES
+    queries = json.loads(path.read_text(encoding="utf-8"))
+    print(json.dumps(asyncio.run(run(queries)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
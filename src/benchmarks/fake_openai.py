@@ -0,0 +1,210 @@
+"""
+Local stand-in for the OpenAI API, used by the load tests.
+Run with: python -m src.benchmarks.fake_openai [--port 9100] [--latency-ms 300] ...
+
+Serves /v1/embeddings and /v1/chat/completions (plain and streamed) with a configurable
+time to first token, token rate and error rate, so the capacity of the app can be
+measured without spending quota. Embeddings are deterministic pseudo-random unit
+vectors of the requested dimension. When tools are offered and the conversation has no
+tool result yet, the model calls the first tool with the user's message, like the real
+agent does; otherwise it answers with `answer_tokens` tokens.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from typing import List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "o a de que para com uma os no se na por mais as dos como mas ao ele das "
+    "aluno escola ensino aprendizagem curso disciplina avaliação professor conteúdo"
+).split()
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _tool_call(body: dict) -> dict:
+    """A call of the first tool with the last user message, or None."""
+    tools = body.get("tools") or []
+    messages = body.get("messages") or []
+    if not tools or any(m.get("role") == "tool" for m in messages):
+        return None
+    function = tools[0]["function"]
+    required = function.get("parameters", {}).get("required") or ["input"]
+    question = next(
+        (m.get("content") for m in reversed(messages) if m.get("role") == "user"), ""
+    )
+    if isinstance(question, list):
+        question = " ".join(part.get("text", "") for part in question)
+    return {
+        "id": f"call_{uuid.uuid4().hex[:24]}",
+        "type": "function",
+        "function": {"name": function["name"], "arguments": json.dumps({required[0]: question})},
+    }
+
+
+def create_app(
+    latency_ms: float = 300.0,
+    tokens_per_s: float = 80.0,
+    answer_tokens: int = 120,
+    error_rate: float = 0.0,
+    embed_latency_ms: float = 20.0,
+) -> FastAPI:
+    """
+    Build the fake API.
+
+    Args:
+        latency_ms: Time to the first token of a chat completion.
+        tokens_per_s: Generation speed after the first token.
+        answer_tokens: Length of every answer.
+        error_rate: Fraction of requests answered with 429 or 503.
+        embed_latency_ms: Duration of an embeddings request.
+    """
+    app = FastAPI(title="Fake OpenAI")
+
+    def maybe_error() -> JSONResponse:
+        if random.random() >= error_rate:
+            return None
+        status = random.choice((429, 503))
+        return JSONResponse(
+            status_code=status,
+            content={"error": {"message": "fake error", "type": "server_error"}},
+            headers={"retry-after": "0"},
+        )
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        error = maybe_error()
+        if error is not None:
+            return error
+        await asyncio.sleep(embed_latency_ms / 1000)
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dim = int(body.get("dimensions") or 1536)
+        return {
+            "object": "list",
+            "model": body["model"],
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(str(text), dim)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        error = maybe_error()
+        if error is not None:
+            return error
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        tool_call = _tool_call(body)
+        tokens = [] if tool_call else [random.choice(WORDS) + " " for _ in range(answer_tokens)]
+        usage = {
+            "prompt_tokens": sum(len(str(m.get("content") or "")) // 4 for m in body["messages"]),
+            "completion_tokens": len(tokens) or 20,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        def chunk(delta: dict, finish_reason: str = None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency_ms / 1000 + len(tokens) / tokens_per_s)
+            message = {"role": "assistant", "content": "".join(tokens) or None}
+            if tool_call:
+                message["tool_calls"] = [tool_call]
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": "tool_calls" if tool_call else "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+
+        async def stream():
+            await asyncio.sleep(latency_ms / 1000)
+            if tool_call:
+                yield chunk({"role": "assistant", "tool_calls": [{"index": 0, **tool_call}]})
+                yield chunk({}, "tool_calls")
+            else:
+                yield chunk({"role": "assistant", "content": ""})
+                for token in tokens:
+                    yield chunk({"content": token})
+                    await asyncio.sleep(1 / tokens_per_s)
+                yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body["model"],
+                    "choices": [],
+                    "usage": usage,
+                }
+                yield f"data: {json.dumps(data)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Time to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=80.0, help="Generation speed")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Tokens per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 429/503")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+
+
+def main():
+    """Run the fake OpenAI API"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    app = create_app(
+        latency_ms=args.latency_ms,
+        tokens_per_s=args.tokens_per_s,
+        answer_tokens=args.answer_tokens,
+        error_rate=args.error_rate,
+        embed_latency_ms=args.embed_latency_ms,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
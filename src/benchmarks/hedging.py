@@ -0,0 +1,150 @@
+"""
+Compare embedding latency with and without hedged requests.
+Run with: python -m src.benchmarks.hedging [requests]
+
+Starts a local stub of the OpenAI embeddings endpoint that answers in SLOW_S for a
+SLOW_RATE fraction of the requests and in FAST_S otherwise, then embeds queries
+through OpenAIEmbedding with the shared client, hedging off and on.
+
+Exits with status 1 unless every request succeeded (the stub's 503s were retried),
+hedges were sent and won, and hedging lowered the p99 latency.
+"""
+import asyncio
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.requests import ClientDisconnect
+from llama_index.embeddings.openai import OpenAIEmbedding
+
+from src.http_client import HTTP_HEDGES, HTTP_RETRIES, create_async_http_client
+
+FAST_S = 0.02
+SLOW_S = 0.5
+SLOW_RATE = 0.05
+ERROR_RATE = 0.02
+CONCURRENCY = 8
+
+stub = FastAPI()
+
+
+@stub.post("/v1/embeddings")
+async def embeddings(request: Request):
+    try:
+        body = await request.json()
+    except ClientDisconnect:
+        # The losing copy of a hedged request
+        return JSONResponse(status_code=499, content={})
+    if random.random() < ERROR_RATE:
+        return JSONResponse(status_code=503, content={"error": {"message": "unavailable"}})
+    await asyncio.sleep(SLOW_S if random.random() < SLOW_RATE else FAST_S)
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    return {
+        "object": "list",
+        "model": body["model"],
+        "data": [
+            {"object": "embedding", "index": i, "embedding": [0.1] * 8}
+            for i in range(len(inputs))
+        ],
+        "usage": {"prompt_tokens": 1, "total_tokens": 1},
+    }
+
+
+def start_stub() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(stub, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(api_base: str, total: int, hedging: bool) -> dict:
+    embed_model = OpenAIEmbedding(
+        api_key="stub",
+        api_base=api_base,
+        async_http_client=create_async_http_client(hedging=hedging),
+        max_retries=0,
+    )
+    latencies: List[float] = []
+    failures = 0
+    queue = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal failures
+        for i in queue:
+            start = time.perf_counter()
+            try:
+                await embed_model.aget_query_embedding(f"pergunta {i}")
+            except Exception:
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return {
+        "failures": failures,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+    }
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    api_base = start_stub()
+    without = asyncio.run(run(api_base, total, hedging=False))
+    retries = sum(HTTP_RETRIES._values.values())
+    with_hedging = asyncio.run(run(api_base, total, hedging=True))
+    hedges_sent = HTTP_HEDGES.value(result="sent")
+    hedges_won = HTTP_HEDGES.value(result="won")
+    checks = {
+        "no_failures": without["failures"] == 0 and with_hedging["failures"] == 0,
+        "errors_retried": retries > 0,
+        "hedges_sent": hedges_sent > 0,
+        "hedges_won": 0 < hedges_won <= hedges_sent,
+        "p99_lowered": with_hedging["p99_ms"] < without["p99_ms"],
+    }
+    print(
+        json.dumps(
+            {
+                "requests": total,
+                "stub": {
+                    "fast_s": FAST_S,
+                    "slow_s": SLOW_S,
+                    "slow_rate": SLOW_RATE,
+                    "error_rate": ERROR_RATE,
+                },
+                "without_hedging": without,
+                "with_hedging": with_hedging,
+                "retries": retries,
+                "hedges_sent": hedges_sent,
+                "hedges_won": hedges_won,
+                "checks": checks,
+            },
+            indent=2,
+        )
+    )
+    failed = [name for name, ok in checks.items() if not ok]
+    if failed:
+        print(f"Failed checks: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
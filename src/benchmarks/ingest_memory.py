@@ -0,0 +1,148 @@
+"""
+Peak memory of `generate` as the corpus grows.
+Run with: python -m src.benchmarks.ingest_memory [--files 50,200] [--file-kb 200]
+
+Writes synthetic text corpora of each size, then indexes each one in a fresh process
+with streaming and full ingestion, against src.benchmarks.fake_openai and the
+pgvector_boletins table of --database in the local ParadeDB. The peak RSS of every run
+is reported as JSON. Exits with status 1 when the peak RSS of streaming ingestion on the
+largest corpus exceeds --max-growth times the one on the smallest, so it can run as a
+regression check.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from sqlalchemy import create_engine, text
+
+from src.benchmarks import fake_openai
+from src.benchmarks.loadtest import ensure_database, free_port, git_commit, wait_for
+
+
+def write_corpus(data_dir: Path, files: int, file_kb: int) -> float:
+    rng = random.Random(files)
+    data_dir.mkdir(parents=True)
+    for i in range(files):
+        words = []
+        size = 0
+        while size < file_kb * 1024:
+            word = rng.choice(fake_openai.WORDS)
+            words.append(word)
+            size += len(word.encode("utf-8")) + 1
+        (data_dir / f"doc_{i:05d}.txt").write_text(" ".join(words), encoding="utf-8")
+    return files * file_kb / 1024
+
+
+def drop_table(database: str) -> None:
+    url = (
+        f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{database}"
+    )
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS paradedb.data_pgvector_boletins"))
+    engine.dispose()
+
+
+def child(streaming: bool) -> None:
+    from src.generate import generate_index
+
+    start = time.perf_counter()
+    generate_index(streaming=streaming)
+    print(
+        json.dumps(
+            {
+                "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "elapsed_s": round(time.perf_counter() - start, 2),
+            }
+        )
+    )
+
+
+def main():
+    """Measure the peak memory of streaming and full ingestion"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--database", default="chateduca_bench")
+    parser.add_argument("--files", type=lambda v: [int(n) for n in v.split(",")], default=[50, 200])
+    parser.add_argument("--file-kb", type=int, default=200)
+    parser.add_argument("--modes", type=lambda v: v.split(","), default=["streaming", "full"])
+    parser.add_argument("--max-growth", type=float, default=1.25)
+    parser.add_argument("--output", help="Write the report to this file as well")
+    parser.add_argument("--child", choices=["streaming", "full"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child == "streaming")
+        return
+
+    ensure_database(args.database)
+    port = free_port()
+    fake = subprocess.Popen(
+        [
+            sys.executable, "-m", "src.benchmarks.fake_openai",
+            "--port", str(port), "--embed-latency-ms", "5",
+        ]
+    )
+    runs: List[dict] = []
+    try:
+        wait_for(f"http://127.0.0.1:{port}/health", 30, fake)
+        with tempfile.TemporaryDirectory(prefix="chateduca-ingest-") as workdir:
+            for files in sorted(args.files):
+                data_dir = Path(workdir) / f"data_{files}"
+                corpus_mb = write_corpus(data_dir, files, args.file_kb)
+                for mode in args.modes:
+                    drop_table(args.database)
+                    env = {
+                        **os.environ,
+                        "OPENAI_API_KEY": "fake",
+                        "OPENAI_API_BASE": f"http://127.0.0.1:{port}/v1",
+                        "DB_DATABASE": args.database,
+                        "DATA_DIR": str(data_dir),
+                        "STORAGE_DIR": str(Path(workdir) / f"storage_{files}_{mode}"),
+                    }
+                    result = subprocess.run(
+                        [sys.executable, "-m", "src.benchmarks.ingest_memory", "--child", mode],
+                        env=env,
+                        capture_output=True,
+                        text=True,
+                    )
+                    if result.returncode != 0:
+                        sys.stderr.write(result.stderr)
+                        raise RuntimeError(f"Ingestion of {files} files ({mode}) failed")
+                    measured = json.loads(result.stdout.strip().splitlines()[-1])
+                    runs.append({"mode": mode, "files": files, "corpus_mb": corpus_mb, **measured})
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    streaming = [run for run in runs if run["mode"] == "streaming"]
+    growth = (
+        streaming[-1]["max_rss_mb"] / streaming[0]["max_rss_mb"] if len(streaming) > 1 else None
+    )
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "runs": runs,
+        "streaming_rss_growth": round(growth, 3) if growth else None,
+        "max_growth": args.max_growth,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    if growth is not None and growth > args.max_growth:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
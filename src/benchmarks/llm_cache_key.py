@@ -0,0 +1,50 @@
+"""
+Check that the LLM cache key tracks the model behind the wrappers.
+Run with: python -m src.benchmarks.llm_cache_key
+
+Builds CachedLLM over LimitedLLM(OpenAI) as settings.py does and computes the key of
+the same chat for different models and temperatures. Exits with status 1 if two
+different configurations share a key, or if the LimitedLLM wrapper changes the key.
+"""
+import json
+import sys
+import tempfile
+
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.llms.openai import OpenAI
+
+from src.admission import LimitedLLM
+from src.llm_cache import CachedLLM, DiskCache
+
+MESSAGES = [ChatMessage(role="user", content="Quando começa o período de matrículas?")]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = DiskCache(f"{tmp}/llm_cache.sqlite")
+
+        def key(model: str, temperature: float = 0.1, limited: bool = True) -> str:
+            llm = OpenAI(model=model, temperature=temperature, api_key="unused")
+            wrapped = LimitedLLM(llm) if limited else llm
+            return CachedLLM(wrapped, cache)._chat_key(MESSAGES, {})
+
+        keys = {
+            "gpt-4o-mini": key("gpt-4o-mini"),
+            "gpt-4o": key("gpt-4o"),
+            "gpt-4o-mini, temperature 0.7": key("gpt-4o-mini", temperature=0.7),
+            "gpt-4o-mini, no LimitedLLM": key("gpt-4o-mini", limited=False),
+        }
+    print(json.dumps(keys, indent=2))
+    failed = []
+    if len({keys["gpt-4o-mini"], keys["gpt-4o"], keys["gpt-4o-mini, temperature 0.7"]}) < 3:
+        failed.append("different models or temperatures share a cache key")
+    if keys["gpt-4o-mini"] != keys["gpt-4o-mini, no LimitedLLM"]:
+        failed.append("the LimitedLLM wrapper changes the cache key")
+    for reason in failed:
+        print(reason, file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
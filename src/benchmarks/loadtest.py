@@ -0,0 +1,340 @@
+"""
+Load test of the chat API against a local fake OpenAI and a local ParadeDB.
+Run with: python -m src.benchmarks.loadtest [--concurrency 16] [--requests 500] ...
+
+Starts src.benchmarks.fake_openai and the app (through src.serve, SERVE_WORKERS=--workers)
+pointed at it and at the DB_DATABASE given by --database, optionally indexes a synthetic
+corpus there first (--index), then drives /chat and /chat/streaming from `concurrency`
+async clients. Each request uses its own session and a unique suffix on the question, so
+it is neither answered from history nor coalesced with the same first question of another
+session (src/singleflight.py). With --url, an already running server is load tested instead.
+
+Prints (or writes to --output) a JSON report: throughput, p50/p95/p99 latency, time to
+first token of the streamed answers and error rates per endpoint, plus the commit and
+the settings, so reports of different releases can be compared.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from src.benchmarks import fake_openai
+
+DEFAULT_QUERIES = Path(__file__).with_name("queries.json")
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float, process: Optional[subprocess.Popen] = None) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with status {process.returncode} before {url}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def ensure_database(name: str) -> None:
+    """Create the load test database next to the configured one if it is missing."""
+    from sqlalchemy import create_engine, text
+
+    url = (
+        f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/postgres"
+    )
+    engine = create_engine(url, isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": name}
+        ).scalar()
+        if not exists:
+            conn.execute(text(f'CREATE DATABASE "{name}"'))
+    engine.dispose()
+
+
+def write_corpus(data_dir: Path, documents: int) -> None:
+    """Synthetic documents about the benchmark questions, for --index."""
+    queries = json.loads(DEFAULT_QUERIES.read_text(encoding="utf-8"))
+    data_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(0)
+    for i in range(documents):
+        topic = queries[i % len(queries)]
+        sentences = [
+            f"{topic} " + " ".join(rng.choice(fake_openai.WORDS) for _ in range(30)) + "."
+            for _ in range(20)
+        ]
+        (data_dir / f"doc_{i:04d}.txt").write_text("\n".join(sentences), encoding="utf-8")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Results:
+    """Latencies, times to first token and outcomes of one endpoint."""
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.outcomes: Counter = Counter()
+
+    def report(self, elapsed: float) -> dict:
+        total = sum(self.outcomes.values())
+        errors = total - self.outcomes["ok"]
+
+        def summary(values: List[float]) -> Optional[dict]:
+            if not values:
+                return None
+            return {f"p{q}": round(percentile(values, q / 100), 4) for q in (50, 95, 99)}
+
+        return {
+            "requests": total,
+            "errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "outcomes": dict(self.outcomes),
+            "throughput_rps": round(self.outcomes["ok"] / elapsed, 2),
+            "latency_s": summary(self.latencies),
+            "ttft_s": summary(self.ttfts),
+        }
+
+
+async def send_chat(http: httpx.AsyncClient, url: str, payload: dict, results: Results) -> None:
+    start = time.perf_counter()
+    response = await http.post(f"{url}/chat", json=payload)
+    if response.status_code != 200:
+        results.outcomes[str(response.status_code)] += 1
+        return
+    if "error" in response.json():
+        results.outcomes["app_error"] += 1
+        return
+    results.latencies.append(time.perf_counter() - start)
+    results.outcomes["ok"] += 1
+
+
+async def send_streaming(
+    http: httpx.AsyncClient, url: str, payload: dict, results: Results
+) -> None:
+    start = time.perf_counter()
+    first_token = None
+    outcome = "incomplete"
+    async with http.stream("POST", f"{url}/chat/streaming", json=payload) as response:
+        if response.status_code != 200:
+            results.outcomes[str(response.status_code)] += 1
+            return
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if event.get("type") == "chunk" and first_token is None:
+                first_token = time.perf_counter() - start
+            elif event.get("type") == "error":
+                outcome = "app_error"
+            elif event.get("type") == "done" and outcome == "incomplete":
+                outcome = "ok"
+    results.outcomes[outcome] += 1
+    if outcome == "ok":
+        results.latencies.append(time.perf_counter() - start)
+        if first_token is not None:
+            results.ttfts.append(first_token)
+
+
+async def run_load(
+    url: str, concurrency: int, total: int, streaming_ratio: float, timeout: float
+) -> dict:
+    queries = json.loads(DEFAULT_QUERIES.read_text(encoding="utf-8"))
+    results: Dict[str, Results] = {"/chat": Results(), "/chat/streaming": Results()}
+    counter = iter(range(total))
+    rng = random.Random(0)
+
+    async def client(http: httpx.AsyncClient) -> None:
+        for i in counter:
+            nonce = uuid.uuid4().hex
+            payload = {
+                "message": f"{queries[i % len(queries)]} (ref {nonce[:8]})",
+                "session_id": f"load-{nonce}",
+            }
+            streaming = rng.random() < streaming_ratio
+            endpoint = "/chat/streaming" if streaming else "/chat"
+            try:
+                if streaming:
+                    await send_streaming(http, url, payload, results[endpoint])
+                else:
+                    await send_chat(http, url, payload, results[endpoint])
+            except httpx.HTTPError as e:
+                results[endpoint].outcomes[type(e).__name__] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    overall = Results()
+    for endpoint_results in results.values():
+        overall.latencies += endpoint_results.latencies
+        overall.ttfts += endpoint_results.ttfts
+        overall.outcomes += endpoint_results.outcomes
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "total": overall.report(elapsed),
+        "endpoints": {
+            endpoint: endpoint_results.report(elapsed)
+            for endpoint, endpoint_results in results.items()
+            if endpoint_results.outcomes
+        },
+    }
+
+
+def start_stack(args: argparse.Namespace, workdir: Path) -> tuple:
+    """Start the fake OpenAI API and the app; returns (url, processes)."""
+    fake_port, app_port = free_port(), free_port()
+    fake = subprocess.Popen(
+        [
+            sys.executable, "-m", "src.benchmarks.fake_openai",
+            "--port", str(fake_port),
+            "--latency-ms", str(args.latency_ms),
+            "--tokens-per-s", str(args.tokens_per_s),
+            "--answer-tokens", str(args.answer_tokens),
+            "--error-rate", str(args.error_rate),
+            "--embed-latency-ms", str(args.embed_latency_ms),
+        ]
+    )
+    processes = [fake]
+    wait_for(f"http://127.0.0.1:{fake_port}/health", 30, fake)
+
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_API_BASE": f"http://127.0.0.1:{fake_port}/v1",
+        "DB_DATABASE": args.database,
+        "STORAGE_DIR": str(workdir / "storage"),
+        "LLM_CACHE": "false",
+        "TRACE_EXPORT": "false",
+    }
+    ensure_database(args.database)
+    if args.index:
+        data_dir = workdir / "data"
+        write_corpus(data_dir, args.documents)
+        subprocess.run(
+            [sys.executable, "-m", "src.generate"],
+            env={**env, "DATA_DIR": str(data_dir)},
+            check=True,
+        )
+
+    app = subprocess.Popen(
+        [sys.executable, "-m", "src.serve"],
+        env={
+            **env,
+            "SERVE_APP": args.app,
+            "SERVE_HOST": "127.0.0.1",
+            "SERVE_PORT": str(app_port),
+            "SERVE_WORKERS": str(args.workers),
+        },
+    )
+    processes.append(app)
+    url = f"http://127.0.0.1:{app_port}"
+    wait_for(f"{url}/ready", args.startup_timeout, app)
+    return url, processes
+
+
+def main():
+    """Load test the chat API and print a JSON report"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--url", help="Load test this running server instead of starting one")
+    parser.add_argument("--app", default="src.dev:app", help="SERVE_APP of the started server")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--database", default="chateduca_loadtest", help="DB_DATABASE to use")
+    parser.add_argument("--index", action="store_true", help="Index a synthetic corpus first")
+    parser.add_argument("--documents", type=int, default=200, help="Documents for --index")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument(
+        "--streaming-ratio", type=float, default=0.5, help="Fraction sent to /chat/streaming"
+    )
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="Write the report to this file as well")
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+
+    # src.server only has /chat
+    streaming_ratio = 0.0 if args.app.startswith("src.server") else args.streaming_ratio
+    processes: List[subprocess.Popen] = []
+    with tempfile.TemporaryDirectory(prefix="chateduca-load-") as workdir:
+        try:
+            url = args.url.rstrip("/") if args.url else None
+            if url is None:
+                url, processes = start_stack(args, Path(workdir))
+            report = asyncio.run(
+                run_load(url, args.concurrency, args.requests, streaming_ratio, args.timeout)
+            )
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                try:
+                    process.wait(timeout=60)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {
+            "url": args.url,
+            "app": None if args.url else args.app,
+            "workers": None if args.url else args.workers,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "streaming_ratio": streaming_ratio,
+            "fake_openai": None if args.url else {
+                "latency_ms": args.latency_ms,
+                "tokens_per_s": args.tokens_per_s,
+                "answer_tokens": args.answer_tokens,
+                "error_rate": args.error_rate,
+                "embed_latency_ms": args.embed_latency_ms,
+            },
+        },
+        **report,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Check that several query_index calls of one agent step run concurrently and share
+one embedding request.
+Run with: python -m src.benchmarks.parallel_tools [--max-ratio 1.5]
+
+Uses a scripted function-calling LLM and an in-memory index with injected
+embedding and search latency, so no API key or database is needed. Exits with
+status 1 when 4 tool calls take more than --max-ratio times the wall time of a
+single call, or when their query embeddings take more than one request.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from llama_index.core import Document, Settings, StorageContext, VectorStoreIndex
+from llama_index.core.base.llms.generic_utils import (
+    achat_to_completion_decorator,
+    astream_chat_to_completion_decorator,
+    chat_to_completion_decorator,
+    stream_chat_to_completion_decorator,
+)
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+from llama_index.core.llms.llm import ToolSelection
+from llama_index.core.tools import BaseTool
+from llama_index.core.vector_stores import SimpleVectorStore
+
+from src.batching import BatchingEmbedding
+from src.query import get_query_engine_tool
+from src.workflow import ParallelAgentWorkflow
+
+LLM_LATENCY = 0.1
+EMBED_LATENCY = 0.1
+SEARCH_LATENCY = 0.2
+
+
+class ScriptedLLM(FunctionCallingLLM):
+    """Asks for `num_calls` tool calls in the first turn, then answers."""
+
+    num_calls: int = 1
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(is_chat_model=True, is_function_calling_model=True)
+
+    def _prepare_chat_with_tools(
+        self,
+        tools: Sequence[BaseTool],
+        user_msg: Optional[Union[str, ChatMessage]] = None,
+        chat_history: Optional[List[ChatMessage]] = None,
+        verbose: bool = False,
+        allow_parallel_tool_calls: bool = False,
+        tool_required: bool = False,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        messages = list(chat_history or [])
+        if user_msg is not None:
+            messages.append(ChatMessage(role="user", content=str(user_msg)))
+        return {"messages": messages}
+
+    def get_tool_calls_from_response(
+        self, response: ChatResponse, error_on_no_tool_call: bool = True, **kwargs: Any
+    ) -> List[ToolSelection]:
+        return response.message.additional_kwargs.get("tool_calls", [])
+
+    def _reply(self, messages: Sequence[ChatMessage]) -> ChatMessage:
+        if messages[-1].role == MessageRole.TOOL:
+            return ChatMessage(role="assistant", content="done")
+        calls = [
+            ToolSelection(
+                tool_id=f"call_{i}",
+                tool_name="query_index",
+                tool_kwargs={"input": f"pergunta {i}"},
+            )
+            for i in range(self.num_calls)
+        ]
+        return ChatMessage(
+            role="assistant", content="", additional_kwargs={"tool_calls": calls}
+        )
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        time.sleep(LLM_LATENCY)
+        message = self._reply(messages)
+        return ChatResponse(message=message, delta=message.content)
+
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        response = self.chat(messages, **kwargs)
+
+        def gen() -> ChatResponseGen:
+            yield response
+
+        return gen()
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        await asyncio.sleep(LLM_LATENCY)
+        message = self._reply(messages)
+        return ChatResponse(message=message, delta=message.content)
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        response = await self.achat(messages, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            yield response
+
+        return gen()
+
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        return chat_to_completion_decorator(self.chat)(prompt, **kwargs)
+
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        return stream_chat_to_completion_decorator(self.stream_chat)(prompt, **kwargs)
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        return await achat_to_completion_decorator(self.achat)(prompt, **kwargs)
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        return await astream_chat_to_completion_decorator(self.astream_chat)(
+            prompt, **kwargs
+        )
+
+
+class SlowEmbedding(MockEmbedding):
+    requests: int = 0
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        self.requests += 1
+        await asyncio.sleep(EMBED_LATENCY)
+        return self._get_vector()
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self.requests += 1
+        await asyncio.sleep(EMBED_LATENCY)
+        return [self._get_vector() for _ in texts]
+
+
+class SlowVectorStore(SimpleVectorStore):
+    async def aquery(self, query: Any, **kwargs: Any) -> Any:
+        await asyncio.sleep(SEARCH_LATENCY)
+        return self.query(query, **kwargs)
+
+
+async def run_agent(num_calls: int, embed_model: SlowEmbedding) -> float:
+    # Queries and texts are embedded alike, as with the text-embedding-3 models
+    Settings.embed_model = BatchingEmbedding(embed_model, symmetric=True)
+    index = VectorStoreIndex.from_documents(
+        [Document(text="A média mínima para aprovação é 6.")],
+        storage_context=StorageContext.from_defaults(vector_store=SlowVectorStore()),
+    )
+    tool = get_query_engine_tool(index, llm=MockLLM())
+    agent = ParallelAgentWorkflow.from_tools_or_functions(
+        [tool], llm=ScriptedLLM(num_calls=num_calls)
+    )
+    start = time.perf_counter()
+    # Only the query embeddings of the tool calls, not the indexing of the document
+    embed_model.requests = 0
+    await agent.run(user_msg="Qual a média?")
+    return time.perf_counter() - start
+
+
+def main():
+    """Time 1 and 4 tool calls of one agent step and check they overlap"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=1.5,
+        help="Largest accepted wall time of 4 calls relative to 1 call",
+    )
+    args = parser.parse_args()
+
+    single_embed, parallel_embed = SlowEmbedding(embed_dim=8), SlowEmbedding(embed_dim=8)
+    single = asyncio.run(run_agent(1, single_embed))
+    parallel = asyncio.run(run_agent(4, parallel_embed))
+    report = {
+        "wall_time_1_call_s": round(single, 3),
+        "wall_time_4_calls_s": round(parallel, 3),
+        "ratio": round(parallel / single, 2),
+        "embedding_requests_4_calls": parallel_embed.requests,
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if parallel > args.max_ratio * single:
+        failures.append(
+            f"4 tool calls took {report['ratio']}x the time of one (max {args.max_ratio}x)"
+        )
+    if parallel_embed.requests != 1:
+        failures.append(
+            f"4 tool calls made {parallel_embed.requests} embedding requests instead of 1"
+        )
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
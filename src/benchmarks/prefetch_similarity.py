@@ -0,0 +1,68 @@
+"""
+Check which tool queries reuse the speculative retrieval of the user message.
+Run with: python -m src.benchmarks.prefetch_similarity [min_similarity]
+
+Scores pairs of (user message, tool query) with `query_similarity` and exits with
+status 1 if a rephrasing of the message is not reused, or if a narrower or different
+tool query would be answered with the retrieval of the broader message.
+"""
+import json
+import os
+import sys
+
+from src.prefetch import query_similarity
+
+# (user message, tool query the agent might send, whether the prefetch should be reused)
+CASES = [
+    (
+        "Qual a nota média dos alunos do 9º ano em matemática?",
+        "nota média alunos 9º ano matemática",
+        True,
+    ),
+    (
+        "Quando começa o período de matrículas?",
+        "período de matrículas começa",
+        True,
+    ),
+    (
+        "Quais são as notas de português e de matemática da escola?",
+        "notas escola",
+        False,
+    ),
+    ("Qual a nota média dos alunos do 9º ano em matemática?", "notas", False),
+    (
+        "Qual a nota média dos alunos do 9º ano em matemática?",
+        "frequência dos alunos do 9º ano",
+        False,
+    ),
+]
+
+
+def main():
+    threshold = (
+        float(sys.argv[1])
+        if len(sys.argv) > 1
+        else float(os.getenv("PREFETCH_MIN_SIMILARITY", 0.6))
+    )
+    results = []
+    for message, tool_query, expected in CASES:
+        similarity = query_similarity(message, tool_query)
+        results.append(
+            {
+                "message": message,
+                "tool_query": tool_query,
+                "similarity": round(similarity, 3),
+                "reused": similarity >= threshold,
+                "expected": expected,
+            }
+        )
+    report = {"min_similarity": threshold, "cases": results}
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    failed = [r for r in results if r["reused"] != r["expected"]]
+    if failed:
+        print(f"{len(failed)} of {len(results)} cases failed", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
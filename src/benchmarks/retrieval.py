@@ -0,0 +1,253 @@
+"""
+Recall against latency of the vector store for HNSW, top-k and search mode settings.
+Run with: python -m src.benchmarks.retrieval [--documents 5000] [--hnsw-m 16,32] ...
+
+Loads a synthetic Portuguese corpus with deterministic fake embeddings into the
+--database of the local ParadeDB (DB_HOST/DB_PORT/DB_USER/DB_PASSWORD), one table per
+(hnsw_m, hnsw_ef_construction) pair. Documents are grouped in topics, so their vectors
+have near neighbours as real chunks do. Each query is built from one document: a few
+of its words, and its vector plus noise.
+
+The ground truth is the exact (brute force) cosine top-k of each query vector. For the
+dense, bm25 and hybrid modes and every hnsw_ef_search and top-k, the report gives
+recall@k against that ground truth, the MRR and hit rate of the source document, QPS and
+latency percentiles at --concurrency concurrent queries, as JSON (stdout and --output).
+Hybrid mode returns the union of the dense and BM25 top-k, up to 2k results, all of which
+are scored since all of them reach the LLM.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode
+from sqlalchemy import text
+
+from src.benchmarks.fake_openai import fake_embedding
+from src.benchmarks.loadtest import ensure_database, git_commit, percentile
+from src.vectordb import get_vector_store
+
+DEFAULT_QUERIES = Path(__file__).with_name("queries.json")
+SYLLABLES = (
+    "ba be bi bo bu ca ce ci co cu da de di do du fa fe la le li lo lu ma me mi mo mu "
+    "na ne ni no nu pa pe pi po pu ra re ri ro ru sa se si so su ta te ti to tu va ve vi vo "
+    "ção ns"
+).split()
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+class Corpus:
+    """Synthetic documents, queries and their exact nearest neighbours."""
+
+    def __init__(self, documents: int, queries: int, dim: int, noise: float, seed: int = 0):
+        rng = random.Random(seed)
+        np_rng = np.random.default_rng(seed)
+        topics = json.loads(DEFAULT_QUERIES.read_text(encoding="utf-8"))
+        lexicon = sorted(
+            {"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(5000)}
+        )
+        # Zipf-like word frequencies, as in natural text
+        weights = [1 / (rank + 1) for rank in range(len(lexicon))]
+        centers = np.array([fake_embedding(topic, dim) for topic in topics])
+
+        self.texts: List[str] = []
+        words: List[List[str]] = []
+        vectors = []
+        for i in range(documents):
+            topic = i % len(topics)
+            words.append(rng.choices(lexicon, weights=weights, k=60))
+            self.texts.append(f"{topics[topic]} {' '.join(words[-1])}.")
+            vector = centers[topic] + 0.8 * np_rng.standard_normal(dim) / np.sqrt(dim)
+            vectors.append(vector / np.linalg.norm(vector))
+        self.vectors = np.array(vectors)
+
+        self.sources = [rng.randrange(documents) for _ in range(queries)]
+        self.query_texts = [
+            " ".join(rng.sample(words[source], 4)) for source in self.sources
+        ]
+        query_vectors = self.vectors[self.sources] + noise * np_rng.standard_normal(
+            (queries, dim)
+        ) / np.sqrt(dim)
+        self.query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+        # Exact ranking by cosine similarity (all vectors are unit length)
+        self.exact = np.argsort(-(self.query_vectors @ self.vectors.T), axis=1)[:, :100]
+
+    def nodes(self) -> List[TextNode]:
+        return [
+            TextNode(id_=f"doc-{i}", text=content, embedding=vector.tolist())
+            for i, (content, vector) in enumerate(zip(self.texts, self.vectors))
+        ]
+
+
+def build_store(database: str, dim: int, m: int, ef_construction: int, corpus: Corpus):
+    """(Re)create the table of one HNSW configuration and load the corpus into it."""
+    os.environ["EMBEDDING_DIM"] = str(dim)
+    table_name = f"bench_m{m}_efc{ef_construction}"
+    store = get_vector_store(
+        table_name=table_name,
+        database=database,
+        hnsw_kwargs={
+            "hnsw_m": m,
+            "hnsw_ef_construction": ef_construction,
+            "hnsw_ef_search": 40,
+            "hnsw_dist_method": "vector_cosine_ops",
+        },
+    )
+    store._initialize()
+    with store._engine.begin() as conn:
+        conn.execute(
+            text(
+                f"DROP TABLE IF EXISTS {store.schema_name}.{store._table_class.__tablename__}"
+            )
+        )
+    store._is_initialized = False
+    store._initialize()
+
+    start = time.perf_counter()
+    nodes: List[BaseNode] = list(corpus.nodes())
+    for i in range(0, len(nodes), 500):
+        store.add(nodes[i : i + 500])
+    return store, time.perf_counter() - start
+
+
+async def measure(
+    store,
+    corpus: Corpus,
+    mode: str,
+    top_k: int,
+    ef_search: Optional[int],
+    concurrency: int,
+) -> dict:
+    query_mode = {
+        "dense": VectorStoreQueryMode.DEFAULT,
+        "bm25": VectorStoreQueryMode.SPARSE,
+        "hybrid": VectorStoreQueryMode.HYBRID,
+    }[mode]
+    kwargs = {"hnsw_ef_search": ef_search} if ef_search else {}
+    results: List[Optional[List[str]]] = [None] * len(corpus.sources)
+    latencies: List[float] = []
+    counter = iter(range(len(corpus.sources)))
+
+    async def worker() -> None:
+        for i in counter:
+            query = VectorStoreQuery(
+                query_embedding=corpus.query_vectors[i].tolist(),
+                query_str=corpus.query_texts[i],
+                similarity_top_k=top_k,
+                sparse_top_k=top_k,
+                mode=query_mode,
+            )
+            start = time.perf_counter()
+            result = await store.aquery(query, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            results[i] = result.ids or []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    recalls, reciprocal_ranks, hits = [], [], []
+    for i, ids in enumerate(results):
+        truth = {f"doc-{j}" for j in corpus.exact[i, :top_k]}
+        recalls.append(len(truth.intersection(ids)) / top_k)
+        source = f"doc-{corpus.sources[i]}"
+        rank = ids.index(source) + 1 if source in ids else None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        hits.append(rank is not None)
+    return {
+        "mode": mode,
+        "top_k": top_k,
+        "hnsw_ef_search": ef_search,
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "hit_rate": round(float(np.mean(hits)), 4),
+        "avg_results": round(float(np.mean([len(ids) for ids in results])), 2),
+        "qps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            f"p{q}": round(percentile(latencies, q / 100) * 1000, 2) for q in (50, 95, 99)
+        },
+    }
+
+
+async def sweep(args: argparse.Namespace, corpus: Corpus) -> dict:
+    builds, results = [], []
+    bm25_done = False
+    for m in args.hnsw_m:
+        for ef_construction in args.hnsw_ef_construction:
+            store, build_s = await asyncio.to_thread(
+                build_store, args.database, args.dim, m, ef_construction, corpus
+            )
+            builds.append(
+                {"hnsw_m": m, "hnsw_ef_construction": ef_construction, "build_s": round(build_s, 2)}
+            )
+            for top_k in args.top_k:
+                # BM25 does not depend on the HNSW settings, measure it once
+                if "bm25" in args.modes and not bm25_done:
+                    results.append(
+                        await measure(store, corpus, "bm25", top_k, None, args.concurrency)
+                    )
+                for mode in [mode for mode in args.modes if mode != "bm25"]:
+                    for ef_search in args.hnsw_ef_search:
+                        result = await measure(
+                            store, corpus, mode, top_k, ef_search, args.concurrency
+                        )
+                        results.append(
+                            {"hnsw_m": m, "hnsw_ef_construction": ef_construction, **result}
+                        )
+            bm25_done = True
+            await store.close()
+    return {"builds": builds, "results": results}
+
+
+def main():
+    """Sweep the retrieval settings and print recall and latency as JSON"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--database", default="chateduca_bench", help="Database to load")
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=512, help="Embedding dimension")
+    parser.add_argument("--noise", type=float, default=0.5, help="Query vector noise")
+    parser.add_argument("--hnsw-m", type=int_list, default=[16, 32])
+    parser.add_argument("--hnsw-ef-construction", type=int_list, default=[64, 128])
+    parser.add_argument("--hnsw-ef-search", type=int_list, default=[20, 40, 80, 160])
+    parser.add_argument("--top-k", type=int_list, default=[2, 5, 10])
+    parser.add_argument(
+        "--modes", type=lambda v: v.split(","), default=["dense", "bm25", "hybrid"]
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", help="Write the report to this file as well")
+    args = parser.parse_args()
+
+    ensure_database(args.database)
+    corpus = Corpus(args.documents, args.queries, args.dim, args.noise)
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "corpus": {
+            "documents": args.documents,
+            "queries": args.queries,
+            "dim": args.dim,
+            "noise": args.noise,
+        },
+        **asyncio.run(sweep(args, corpus)),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure import time and time to ready of the API.
+Run with: python -m src.benchmarks.startup
+
+Starts uvicorn twice on a free port, with the app served directly (eager: the port
+opens after the workflow is created and warmed up) and through src.asgi (lazy: the
+port opens at once and the app loads in the background), polling /health and /ready.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import httpx
+
+APP = os.getenv("SERVE_APP", "src.dev:app")
+TIMEOUT = 180
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_time(module: str) -> float:
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def wait_for(url: str, start: float) -> Optional[float]:
+    while time.perf_counter() - start < TIMEOUT:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    return None
+
+
+def measure(app: str) -> dict:
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, "SERVE_APP": APP},
+    )
+    try:
+        health = wait_for(f"http://127.0.0.1:{port}/health", start)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", start)
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        "time_to_health_s": round(health, 2) if health is not None else None,
+        "time_to_ready_s": round(ready, 2) if ready is not None else None,
+    }
+
+
+def main():
+    module = APP.split(":")[0]
+    print(
+        json.dumps(
+            {
+                "app": APP,
+                "import_s": {
+                    module: round(import_time(module), 2),
+                    "src.asgi": round(import_time("src.asgi"), 2),
+                },
+                "eager": measure(APP),
+                "lazy": measure("src.asgi:app"),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
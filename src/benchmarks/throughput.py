@@ -0,0 +1,77 @@
+"""
+Measure the request throughput of a running server.
+Run with: python -m src.benchmarks.throughput [url] [concurrency] [requests]
+
+Sends the benchmark questions to POST /chat from `concurrency` clients, each request
+with its own session and a unique suffix on the question: first questions of different
+sessions would otherwise be coalesced (src/singleflight.py) instead of answered.
+"""
+import asyncio
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import List
+
+import httpx
+
+DEFAULT_QUERIES = Path(__file__).with_name("queries.json")
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(url: str, concurrency: int, total: int) -> dict:
+    queries = json.loads(DEFAULT_QUERIES.read_text(encoding="utf-8"))
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def client(http: httpx.AsyncClient) -> None:
+        nonlocal errors
+        for i in counter:
+            nonce = uuid.uuid4().hex
+            start = time.perf_counter()
+            try:
+                response = await http.post(
+                    f"{url}/chat",
+                    json={
+                        "message": f"{queries[i % len(queries)]} (ref {nonce[:8]})",
+                        "session_id": f"bench-{nonce}",
+                    },
+                )
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(timeout=120) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "requests_per_s": round(len(latencies) / elapsed, 2),
+        "latency_p50_s": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "latency_p95_s": round(percentile(latencies, 0.95), 3) if latencies else None,
+    }
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    total = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    print(json.dumps(asyncio.run(run(url.rstrip("/"), concurrency, total)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
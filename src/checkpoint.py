@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "ingest_checkpoint.json"
+# Batch of `reindex_files` being written, apart from the streaming ingestion's progress
+REINDEX_JOURNAL_FILE = "reindex_journal.json"
+
+
+class IngestionCheckpoint:
+    """
+    Progress of a streaming ingestion, persisted in STORAGE_DIR after every batch.
+
+    A file is recorded as done (with its size, modification time and document ids) once
+    its batch is in the vector store and the docstore was persisted. The document ids of
+    the batch being ingested are recorded before it starts, so a resumed run can remove
+    whatever that batch left in the vector store before ingesting it again.
+    """
+
+    def __init__(self, path: str, data: Optional[dict] = None) -> None:
+        self.path = path
+        self.data = data or {"started": time.time(), "batches": 0, "files": {}, "pending": []}
+
+    @classmethod
+    def load(cls, storage_dir: str, file_name: str = CHECKPOINT_FILE) -> "IngestionCheckpoint":
+        path = os.path.join(storage_dir, file_name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(path, json.load(f))
+        except FileNotFoundError:
+            return cls(path)
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+            return cls(path)
+
+    @classmethod
+    def fresh(cls, storage_dir: str) -> "IngestionCheckpoint":
+        checkpoint = cls(os.path.join(storage_dir, CHECKPOINT_FILE))
+        checkpoint.save()
+        return checkpoint
+
+    @staticmethod
+    def _stat(file_path: str) -> Optional[List[float]]:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Write then rename, a crash never leaves a half-written checkpoint
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    @property
+    def batches(self) -> int:
+        return self.data["batches"]
+
+    @property
+    def pending(self) -> List[str]:
+        return self.data["pending"]
+
+    def is_done(self, file_path: str) -> bool:
+        """Whether the file was ingested and has not changed since."""
+        done = self.data["files"].get(file_path)
+        return done is not None and done["stat"] == self._stat(file_path)
+
+    def done_doc_ids(self) -> Set[str]:
+        return {doc_id for done in self.data["files"].values() for doc_id in done["doc_ids"]}
+
+    def begin_batch(self, doc_ids: Iterable[str]) -> None:
+        self.data["pending"] = list(doc_ids)
+        self.save()
+
+    def complete_batch(self, files: Dict[str, List[str]]) -> None:
+        """
+        Record the files of the batch as done.
+
+        Args:
+            files: Document ids of each file of the batch, by file path.
+        """
+        for file_path, doc_ids in files.items():
+            self.data["files"][file_path] = {"stat": self._stat(file_path), "doc_ids": doc_ids}
+        self.data["pending"] = []
+        self.data["batches"] += 1
+        self.save()
+
+    def clear(self) -> None:
+        """Forget the checkpoint once the ingestion finished."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,154 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Chunk length in tokens, independent of the embedding dimension
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1024))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 20))
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS") or 0) or None
+
+_worker_splitter: Optional[SentenceSplitter] = None
+
+
+def _init_worker(kwargs: Dict[str, Any]) -> None:
+    global _worker_splitter
+    _worker_splitter = CachedSentenceSplitter(workers=1, **kwargs)
+
+
+def _split_documents(nodes: List[BaseNode]) -> List[BaseNode]:
+    return _worker_splitter._parse_nodes(nodes)
+
+
+class CachedSentenceSplitter(SentenceSplitter):
+    """
+    SentenceSplitter that caches token counts and splits large inputs in processes.
+
+    The splitter tokenizes a text, then each of its paragraphs, then the sentences of
+    the paragraphs that are too long, and every document once more for its metadata.
+    Token counts of short texts (metadata, headers, repeated paragraphs and sentences)
+    are cached, so each one is tokenized once. The splitting rules are the ones of
+    SentenceSplitter, and so are the chunks.
+
+    Args:
+        workers: Splitting processes when at least `min_parallel_documents` documents
+            are split at once, defaults to one per CPU.
+        cache_size: Token counts kept in the cache.
+        cache_max_chars: Longer texts are tokenized without caching.
+    """
+
+    workers: int = Field(default=1)
+    min_parallel_documents: int = Field(default=64)
+    documents_per_task: int = Field(default=32)
+    cache_size: int = Field(default=65536)
+    cache_max_chars: int = Field(default=4096)
+
+    _token_count: Callable[[str], int] = PrivateAttr()
+    _chunking_fn: Optional[Callable[[str], List[str]]] = PrivateAttr(default=None)
+    _executor: Optional[ProcessPoolExecutor] = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        min_parallel_documents: int = 64,
+        documents_per_task: int = 32,
+        cache_size: int = 65536,
+        cache_max_chars: int = 4096,
+        chunking_tokenizer_fn: Optional[Callable[[str], List[str]]] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(chunking_tokenizer_fn=chunking_tokenizer_fn, **kwargs)
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel_documents = min_parallel_documents
+        self.documents_per_task = documents_per_task
+        self.cache_size = cache_size
+        self.cache_max_chars = cache_max_chars
+        # Handed to the worker processes, which build their own splitter
+        self._chunking_fn = chunking_tokenizer_fn
+        tokenizer = self._tokenizer
+        self._token_count = lru_cache(maxsize=cache_size)(lambda text: len(tokenizer(text)))
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedSentenceSplitter"
+
+    def _token_size(self, text: str) -> int:
+        if len(text) > self.cache_max_chars:
+            return len(self._tokenizer(text))
+        return self._token_count(text)
+
+    def split_text_metadata_aware(self, text: str, metadata_str: str) -> List[str]:
+        effective_chunk_size = self.chunk_size - self._token_size(metadata_str)
+        if effective_chunk_size < 50:
+            # Raises or warns about the metadata length
+            return super().split_text_metadata_aware(text, metadata_str)
+        return self._split_text(text, chunk_size=effective_chunk_size)
+
+    def _worker_kwargs(self) -> Dict[str, Any]:
+        return {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "separator": self.separator,
+            "paragraph_separator": self.paragraph_separator,
+            "secondary_chunking_regex": self.secondary_chunking_regex,
+            "include_metadata": self.include_metadata,
+            "include_prev_next_rel": self.include_prev_next_rel,
+            "chunking_tokenizer_fn": self._chunking_fn,
+            "cache_size": self.cache_size,
+            "cache_max_chars": self.cache_max_chars,
+        }
+
+    def _parse_nodes(
+        self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any
+    ) -> List[BaseNode]:
+        if self.workers <= 1 or len(nodes) < self.min_parallel_documents:
+            return super()._parse_nodes(nodes, show_progress=show_progress, **kwargs)
+        if self._executor is None:
+            # Kept for the next batches, so the processes start only once
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self._worker_kwargs(),),
+            )
+        tasks = [
+            list(nodes[i : i + self.documents_per_task])
+            for i in range(0, len(nodes), self.documents_per_task)
+        ]
+        # map returns the chunks in document order; relationships, metadata and
+        # character offsets are set afterwards in this process
+        all_nodes: List[BaseNode] = []
+        for chunks in self._executor.map(_split_documents, tasks):
+            all_nodes.extend(chunks)
+        logger.debug(f"Split {len(nodes)} documents into {len(all_nodes)} chunks")
+        return all_nodes
+
+    def __del__(self) -> None:
+        if getattr(self, "_executor", None) is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_node_parser(**kwargs: Any) -> CachedSentenceSplitter:
+    """
+    Chunker of the ingestion, configured by CHUNK_SIZE, CHUNK_OVERLAP and CHUNK_WORKERS.
+
+    Args:
+        kwargs: Overrides of the configuration, e.g. chunk_size for a benchmark.
+    """
+    return CachedSentenceSplitter(
+        **{
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "workers": CHUNK_WORKERS,
+            **kwargs,
+        }
+    )
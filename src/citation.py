@@ -50,7 +50,8 @@ Now, you answer the query with citations:
 class NodeCitationProcessor(BaseNodePostprocessor):
     """
     Add a new field `citation_id` to the metadata of the node by copying the id from the node.
-    Useful for citation construction.
+    Useful for citation construction. Chunks of PDFs also get `citation_page`, the page
+    (or page range) they come from.
     """
 
     def _postprocess_nodes(
@@ -59,7 +60,11 @@ class NodeCitationProcessor(BaseNodePostprocessor):
         query_bundle: Optional[QueryBundle] = None,
     ) -> List[NodeWithScore]:
         for node_score in nodes:
-            node_score.node.metadata["citation_id"] = node_score.node.node_id
+            metadata = node_score.node.metadata
+            metadata["citation_id"] = node_score.node.node_id
+            page = metadata.get("page_range") or metadata.get("page_label")
+            if page:
+                metadata["citation_page"] = page
         return nodes
 
 
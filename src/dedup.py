@@ -0,0 +1,378 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from llama_index.core import QueryBundle
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import (
+    BaseNode,
+    MetadataMode,
+    NodeWithScore,
+    TextNode,
+    TransformComponent,
+)
+from llama_index.core.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+DEDUP_FILE = "dedup.sqlite"
+# Mersenne prime 2^31 - 1, so a * h + b fits in 64 bits
+_PRIME = (1 << 31) - 1
+# Metadata fields that identify where a duplicate chunk came from
+SOURCE_FIELDS = ("file_name", "file_path", "page_label")
+
+
+def dedup_path() -> str:
+    return os.path.join(os.getenv("STORAGE_DIR", "storage"), DEDUP_FILE)
+
+
+class MinHasher:
+    """
+    MinHash signatures of character shingles, whose agreement estimates Jaccard similarity.
+
+    Args:
+        num_perm: Signature length; more permutations give a more precise estimate.
+        shingle_size: Characters per shingle, after lowercasing and collapsing whitespace.
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1) -> None:
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        size = self.shingle_size
+        shingles = {text[i : i + size] for i in range(max(1, len(text) - size + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) % _PRIME for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        permuted = (np.outer(hashes, self._a) + self._b) % _PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+
+class LSHIndex:
+    """Band the signatures, so only chunks sharing a whole band are compared."""
+
+    def __init__(self, bands: int, rows: int) -> None:
+        self.bands = bands
+        self.rows = rows
+        self._buckets: List[Dict[bytes, Set[str]]] = [defaultdict(set) for _ in range(bands)]
+
+    def _keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def insert(self, key: str, signature: np.ndarray) -> None:
+        for bucket, band_key in zip(self._buckets, self._keys(signature)):
+            bucket[band_key].add(key)
+
+    def remove(self, key: str, signature: np.ndarray) -> None:
+        for bucket, band_key in zip(self._buckets, self._keys(signature)):
+            bucket.get(band_key, set()).discard(key)
+
+    def query(self, signature: np.ndarray) -> Set[str]:
+        candidates: Set[str] = set()
+        for bucket, band_key in zip(self._buckets, self._keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+        return candidates
+
+
+class DuplicateRegistry:
+    """
+    SQLite record of the indexed (canonical) chunks and of the duplicates that were
+    not embedded, kept in STORAGE_DIR next to the docstore.
+
+    Duplicates keep their whole serialized node, so one can be embedded in place of its
+    canonical chunk when the document holding that chunk changes or disappears.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS canonical ("
+            "node_id TEXT PRIMARY KEY, ref_doc_id TEXT NOT NULL, signature BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS duplicates ("
+            "node_id TEXT PRIMARY KEY, ref_doc_id TEXT NOT NULL, canonical_id TEXT NOT NULL, "
+            "source TEXT NOT NULL, node TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS canonical_doc ON canonical(ref_doc_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS duplicates_doc ON duplicates(ref_doc_id)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates(canonical_id)"
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Group writes in one transaction instead of committing each of them."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def canonical_signatures(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            rows = self._conn.execute("SELECT node_id, signature FROM canonical").fetchall()
+        return {node_id: np.frombuffer(signature, dtype=np.uint32) for node_id, signature in rows}
+
+    def add_canonical(self, node: BaseNode, signature: np.ndarray) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO canonical (node_id, ref_doc_id, signature) VALUES (?, ?, ?)",
+                (node.node_id, node.ref_doc_id or node.node_id, signature.tobytes()),
+            )
+
+    def add_duplicate(self, node: BaseNode, canonical_id: str) -> None:
+        source = {field: node.metadata[field] for field in SOURCE_FIELDS if field in node.metadata}
+        source["ref_doc_id"] = node.ref_doc_id
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO duplicates "
+                "(node_id, ref_doc_id, canonical_id, source, node) VALUES (?, ?, ?, ?, ?)",
+                (
+                    node.node_id,
+                    node.ref_doc_id or node.node_id,
+                    canonical_id,
+                    json.dumps(source, ensure_ascii=False),
+                    node.to_json(),
+                ),
+            )
+
+    def ref_doc_ids(self) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ref_doc_id FROM canonical UNION SELECT ref_doc_id FROM duplicates"
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def forget_documents(
+        self, ref_doc_ids: Iterable[str]
+    ) -> Tuple[List[str], List[BaseNode]]:
+        """
+        Remove the chunks of documents that are re-ingested or deleted.
+
+        Returns:
+            The ids of the removed canonical chunks, and the duplicates from other
+            documents that pointed to them (no longer represented in the index).
+        """
+        ref_doc_ids = list(set(ref_doc_ids))
+        if not ref_doc_ids:
+            return [], []
+        removed: List[str] = []
+        orphans: List[BaseNode] = []
+        with self._lock:
+            for ref_doc_id in ref_doc_ids:
+                ids = [
+                    row[0]
+                    for row in self._conn.execute(
+                        "SELECT node_id FROM canonical WHERE ref_doc_id = ?", (ref_doc_id,)
+                    )
+                ]
+                removed.extend(ids)
+                self._conn.execute("DELETE FROM canonical WHERE ref_doc_id = ?", (ref_doc_id,))
+                self._conn.execute("DELETE FROM duplicates WHERE ref_doc_id = ?", (ref_doc_id,))
+            for canonical_id in removed:
+                rows = self._conn.execute(
+                    "SELECT node FROM duplicates WHERE canonical_id = ?", (canonical_id,)
+                ).fetchall()
+                orphans.extend(TextNode.from_json(row[0]) for row in rows)
+                self._conn.execute(
+                    "DELETE FROM duplicates WHERE canonical_id = ?", (canonical_id,)
+                )
+        return removed, orphans
+
+    def sources(self, node_ids: Sequence[str]) -> Dict[str, List[dict]]:
+        """Sources of the duplicates of each of the given canonical chunks."""
+        if not node_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in node_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT canonical_id, source FROM duplicates WHERE canonical_id IN ({placeholders})",
+                list(node_ids),
+            ).fetchall()
+        sources: Dict[str, List[dict]] = defaultdict(list)
+        for canonical_id, source in rows:
+            sources[canonical_id].append(json.loads(source))
+        return sources
+
+
+class NearDuplicateFilter(TransformComponent):
+    """
+    Ingestion step between the splitter and the embedding model that drops chunks
+    nearly identical to an already indexed chunk (estimated Jaccard similarity of their
+    character shingles >= `threshold`, found with MinHash and LSH).
+
+    Dropped chunks are recorded in the `DuplicateRegistry` with a back-reference to the
+    kept chunk, so retrieval can still cite their documents (see
+    `DuplicateSourcesPostprocessor`).
+    """
+
+    threshold: float = Field(default=0.9)
+    num_perm: int = Field(default=128)
+    bands: int = Field(default=32)
+    registry_path: str = Field(default_factory=dedup_path)
+
+    _registry: DuplicateRegistry = PrivateAttr()
+    _hasher: MinHasher = PrivateAttr()
+    _lsh: LSHIndex = PrivateAttr()
+    _signatures: Dict[str, np.ndarray] = PrivateAttr()
+    _chunks: int = PrivateAttr(default=0)
+    _duplicates: int = PrivateAttr(default=0)
+    _tokens_saved: int = PrivateAttr(default=0)
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._registry = DuplicateRegistry(self.registry_path)
+        self._hasher = MinHasher(num_perm=self.num_perm)
+        self._lsh = LSHIndex(self.bands, self.num_perm // self.bands)
+        self._signatures = self._registry.canonical_signatures()
+        for node_id, signature in self._signatures.items():
+            self._lsh.insert(node_id, signature)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NearDuplicateFilter"
+
+    @classmethod
+    def from_env(cls) -> "NearDuplicateFilter":
+        return cls(
+            threshold=float(os.getenv("DEDUP_THRESHOLD", 0.9)),
+            num_perm=int(os.getenv("DEDUP_NUM_PERM", 128)),
+            bands=int(os.getenv("DEDUP_BANDS", 32)),
+        )
+
+    def _match(self, signature: np.ndarray) -> Optional[str]:
+        best, best_similarity = None, self.threshold
+        for candidate in self._lsh.query(signature):
+            score = similarity(signature, self._signatures[candidate])
+            if score >= best_similarity:
+                best, best_similarity = candidate, score
+        return best
+
+    def _filter(self, nodes: Sequence[BaseNode], count: bool = True) -> List[BaseNode]:
+        kept: List[BaseNode] = []
+        for node in nodes:
+            self._chunks += count
+            content = node.get_content(metadata_mode=MetadataMode.EMBED)
+            signature = self._hasher.signature(content)
+            canonical_id = self._match(signature)
+            if canonical_id is not None:
+                self._registry.add_duplicate(node, canonical_id)
+                if count:
+                    self._duplicates += 1
+                    self._tokens_saved += len(Settings.tokenizer(content))
+                continue
+            self._registry.add_canonical(node, signature)
+            self._signatures[node.node_id] = signature
+            self._lsh.insert(node.node_id, signature)
+            kept.append(node)
+        return kept
+
+    def documents(self) -> Set[str]:
+        """Ids of the documents with chunks in the registry."""
+        return self._registry.ref_doc_ids()
+
+    def forget(self, ref_doc_ids: Iterable[str]) -> List[BaseNode]:
+        """
+        Forget the chunks of the given documents.
+
+        Returns:
+            Duplicates of other documents that lost their canonical chunk; pass them
+            to `readmit` so that one of them is indexed instead.
+        """
+        with self._registry.transaction():
+            removed, orphans = self._registry.forget_documents(ref_doc_ids)
+        for node_id in removed:
+            signature = self._signatures.pop(node_id, None)
+            if signature is not None:
+                self._lsh.remove(node_id, signature)
+        return orphans
+
+    def readmit(self, orphans: Sequence[BaseNode]) -> List[BaseNode]:
+        """Filter duplicates that lost their canonical chunk, returning the ones to index."""
+        # They were counted when first skipped
+        with self._registry.transaction():
+            return self._filter(orphans, count=False)
+
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs) -> List[BaseNode]:
+        # Ingestion workers share the filter, its LSH index is updated by one at a time
+        with self._registry._lock:
+            # The documents of these chunks are (re-)ingested, their old chunks are gone
+            orphans = self.forget({node.ref_doc_id or node.node_id for node in nodes})
+            kept = self.readmit(orphans)
+            with self._registry.transaction():
+                return [*kept, *self._filter(nodes)]
+
+    def report(self) -> dict:
+        return {
+            "chunks": self._chunks,
+            "duplicates_skipped": self._duplicates,
+            "embedding_tokens_saved": self._tokens_saved,
+        }
+
+
+class DuplicateSourcesPostprocessor(BaseNodePostprocessor):
+    """
+    Add the documents of a retrieved chunk's near-duplicates to its metadata
+    (`duplicate_sources`), so answers can cite every document that contains it.
+    """
+
+    registry_path: str = Field(default_factory=dedup_path)
+
+    _registry: Optional[DuplicateRegistry] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "DuplicateSourcesPostprocessor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if self._registry is None:
+            if not os.path.exists(self.registry_path):
+                return nodes
+            self._registry = DuplicateRegistry(self.registry_path)
+        sources = self._registry.sources([n.node.node_id for n in nodes])
+        for node in nodes:
+            duplicates = sources.get(node.node.node_id)
+            if not duplicates:
+                continue
+            names = sorted(
+                {d.get("file_name") or d.get("ref_doc_id") for d in duplicates}
+                - {node.node.metadata.get("file_name")}
+            )
+            if names:
+                node.node.metadata["duplicate_sources"] = ", ".join(names)
+        return nodes
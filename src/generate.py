@@ -1,14 +1,22 @@
+import argparse
+import fcntl
 import os
 import logging
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 from llama_index.core.ingestion import DocstoreStrategy, IngestionPipeline
-from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import Document, TransformComponent
 from llama_index.core.settings import Settings
 from llama_index.core.storage import StorageContext
 from llama_index.core.storage.docstore import SimpleDocumentStore
 from dotenv import load_dotenv
 
-from src.utils.loaders import get_file_documents
+from src.checkpoint import REINDEX_JOURNAL_FILE, IngestionCheckpoint
+from src.chunking import get_node_parser
+from src.dedup import NearDuplicateFilter
+from src.index import bump_index_generation
+from src.utils.loaders import get_file_documents, iter_file_documents
 from src.vectordb import get_vector_store
 from src.settings import init_settings
 
@@ -18,6 +26,9 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
 STORAGE_DIR = os.getenv("STORAGE_DIR", "storage")
+# Streaming ingestion: documents and MB of text per micro-batch
+INGEST_BATCH_DOCS = int(os.getenv("INGEST_BATCH_DOCS", 64))
+INGEST_BATCH_MB = float(os.getenv("INGEST_BATCH_MB", 16))
 
 def get_doc_store():
     # If the storage directory is there, load the document store from it.
@@ -33,16 +44,26 @@ def get_doc_store():
     return SimpleDocumentStore()
 
 
-def run_pipeline(docstore, vector_store, documents):
+def get_transformations(
+    dedup: Optional[NearDuplicateFilter] = None,
+) -> List[TransformComponent]:
+    transformations: List[TransformComponent] = [
+        get_node_parser(
+            chunk_size=Settings.chunk_size,
+            chunk_overlap=Settings.chunk_overlap,
+            ),
+        ]
+    # Near-duplicate chunks are dropped before they are embedded
+    if dedup is not None:
+        transformations.append(dedup)
+    transformations.append(Settings.embed_model)
+    return transformations
+
+
+def run_pipeline(docstore, vector_store, documents, dedup=None):
 
     pipeline = IngestionPipeline(
-        transformations=[
-            SentenceSplitter(
-                chunk_size=Settings.chunk_size,
-                chunk_overlap=Settings.chunk_overlap,
-                ),
-            Settings.embed_model,
-            ],
+        transformations=get_transformations(dedup),
         docstore=docstore,
         docstore_strategy=DocstoreStrategy.UPSERTS_AND_DELETE,  # type: ignore
         vector_store=vector_store,
@@ -54,6 +75,113 @@ def run_pipeline(docstore, vector_store, documents):
     return nodes
 
 
+def iter_document_batches(
+    max_docs: int = INGEST_BATCH_DOCS,
+    max_mb: float = INGEST_BATCH_MB,
+    skip: Optional[Callable[[str], bool]] = None,
+) -> Iterator[List[Document]]:
+    """
+    Group the lazily read documents into batches of at most `max_docs` documents or
+    `max_mb` MB of text. The documents of a file always end up in the same batch.
+    """
+    batch: List[Document] = []
+    size = 0
+    for documents in iter_file_documents(skip=skip):
+        batch.extend(documents)
+        size += sum(len(document.text) for document in documents)
+        if len(batch) >= max_docs or size >= max_mb * 1024 * 1024:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def run_streaming_pipeline(docstore, vector_store, resume: bool = False, dedup=None):
+    """
+    Chunk, embed and upsert DATA_DIR one micro-batch at a time.
+
+    Memory is bounded by the batch size instead of the corpus size: files are read
+    lazily, the docstore only keeps hashes (the text lives in the vector store), the
+    ingestion cache is off, and the docstore is persisted after every batch.
+    Documents that disappeared from DATA_DIR are deleted at the end.
+
+    Progress is checkpointed after every batch (see `IngestionCheckpoint`). With
+    `resume`, files finished by the interrupted run are not read again, and the
+    chunks of the batch it was ingesting are removed before that batch is redone.
+    """
+    pipeline = IngestionPipeline(
+        transformations=get_transformations(dedup),
+        docstore=docstore,
+        # Each run only sees one batch, deletions are handled after the last one
+        docstore_strategy=DocstoreStrategy.UPSERTS,
+        vector_store=vector_store,
+        disable_cache=True,
+    )
+    docstore_path = os.path.join(STORAGE_DIR, "docstore.json")
+    checkpoint = IngestionCheckpoint.load(STORAGE_DIR)
+    if checkpoint.pending:
+        rollback_batch(checkpoint, docstore, vector_store)
+    if resume:
+        logger.info(
+            f"Resuming after {checkpoint.batches} batches "
+            f"({len(checkpoint.data['files'])} files done)"
+        )
+    else:
+        checkpoint = IngestionCheckpoint.fresh(STORAGE_DIR)
+
+    seen = checkpoint.done_doc_ids()
+    total_nodes = 0
+    for documents in iter_document_batches(skip=checkpoint.is_done):
+        files: Dict[str, List[str]] = {}
+        for document in documents:
+            file_path = document.metadata.get("file_path", document.doc_id)
+            files.setdefault(file_path, []).append(document.doc_id)
+        seen.update(document.doc_id for document in documents)
+
+        checkpoint.begin_batch(document.doc_id for document in documents)
+        nodes = pipeline.run(documents=documents, store_doc_text=False)
+        total_nodes += len(nodes)
+        docstore.persist(docstore_path)
+        checkpoint.complete_batch(files)
+        logger.info(
+            f"Batch {checkpoint.batches}: {len(documents)} documents, {len(nodes)} new chunks"
+        )
+
+    removed = set(docstore.get_all_document_hashes().values()) - seen
+    for ref_doc_id in removed:
+        docstore.delete_document(ref_doc_id, raise_error=False)
+        vector_store.delete(ref_doc_id)
+    if removed:
+        logger.info(f"Deleted {len(removed)} documents no longer in DATA_DIR")
+    return total_nodes
+
+
+def rollback_batch(checkpoint: IngestionCheckpoint, docstore, vector_store) -> None:
+    """
+    Remove the documents of an interrupted batch, which may be partly in the vector
+    store but not in the persisted docstore, so they are ingested again.
+    """
+    for ref_doc_id in checkpoint.pending:
+        vector_store.delete(ref_doc_id)
+        docstore.delete_document(ref_doc_id, raise_error=False)
+    docstore.persist(os.path.join(STORAGE_DIR, "docstore.json"))
+    logger.info(f"Rolled back {len(checkpoint.pending)} documents of the interrupted batch")
+    checkpoint.begin_batch([])
+
+
+def reconcile_duplicates(dedup: NearDuplicateFilter, docstore, vector_store) -> None:
+    """
+    Index a replacement for the skipped duplicates whose kept chunk belonged to a
+    document that is no longer indexed.
+    """
+    current = set(docstore.get_all_document_hashes().values())
+    orphans = dedup.forget(dedup.documents() - current)
+    kept = dedup.readmit(orphans)
+    if kept:
+        vector_store.add(Settings.embed_model(kept))
+        logger.info(f"Indexed {len(kept)} chunks that replace chunks of deleted documents")
+
+
 def persist_storage(docstore, vector_store):
     storage_context = StorageContext.from_defaults(
         docstore=docstore,
@@ -62,22 +190,239 @@ def persist_storage(docstore, vector_store):
     storage_context.persist(STORAGE_DIR)
 
 
-def generate_index():
+def file_of(doc_id: str) -> str:
+    """Path of the file a document id was built from (ids are `<path>_part_<n>`)."""
+    path, separator, part = doc_id.rpartition("_part_")
+    return path if separator and part.isdigit() else doc_id
+
+
+class IndexLock:
+    """
+    Exclusive access to the docstore and the vector store of STORAGE_DIR, shared by the
+    threads of a process and, through a lock on STORAGE_DIR/index.lock, by the processes
+    writing them (`generate`, `generate --watch`, the ingestion workers of the server).
+
+    `doc_store()` returns the persisted docstore, reloaded when another process wrote
+    it since this lock last read or persisted it.
+    """
+
+    def __init__(self) -> None:
+        self.path = os.path.join(STORAGE_DIR, "index.lock")
+        self._lock = threading.Lock()
+        self._file = None
+        self._docstore: Optional[SimpleDocumentStore] = None
+        self._docstore_stat: Optional[Tuple[int, int, int]] = None
+
+    def __enter__(self) -> "IndexLock":
+        self._lock.acquire()
+        try:
+            if self._file is None:
+                os.makedirs(STORAGE_DIR, exist_ok=True)
+                self._file = open(self.path, "w")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._lock.release()
+
+    @staticmethod
+    def _stat() -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(os.path.join(STORAGE_DIR, "docstore.json"))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def doc_store(self) -> SimpleDocumentStore:
+        """The current docstore, only to be used while holding the lock."""
+        stat = self._stat()
+        if self._docstore is None or stat != self._docstore_stat:
+            self._docstore = get_doc_store()
+            self._docstore_stat = stat
+        return self._docstore
+
+    def persist(self, vector_store) -> None:
+        """Persist the docstore returned by `doc_store()`, while holding the lock."""
+        persist_storage(self._docstore, vector_store)
+        self._docstore_stat = self._stat()
+
+
+def reindex_files(
+    paths: Set[str],
+    vector_store,
+    dedup: Optional[NearDuplicateFilter] = None,
+    lock: Optional[IndexLock] = None,
+) -> bool:
+    """
+    Re-ingest the given files: documents of added or modified files are upserted,
+    and documents of deleted files (or parts a modified file no longer has) are removed.
+
+    Reading, chunking and embedding run without `lock`; only the reads and writes of
+    the docstore and the vector store hold it, so concurrent callers overlap their slow
+    parts. The docstore is read from disk under the lock, so writes of other processes
+    are never overwritten. The batch is journaled apart from the checkpoint of a
+    streaming ingestion, and rolled back by the next run if it was interrupted.
+
+    Args:
+        paths: Absolute paths of the files.
+        lock: Shared by the threads of a process that re-index files.
+
+    Returns:
+        Whether the index changed.
+    """
+    lock = lock or IndexLock()
+    documents = [
+        document
+        for file_documents in iter_file_documents(
+            skip=lambda path: os.path.abspath(path) not in paths
+        )
+        for document in file_documents
+    ]
+    with lock:
+        docstore = lock.doc_store()
+        indexed = {
+            doc_id
+            for doc_id in docstore.get_all_document_hashes().values()
+            if os.path.abspath(file_of(doc_id)) in paths
+        }
+        changed = [
+            document
+            for document in documents
+            if docstore.get_document_hash(document.doc_id) != document.hash
+        ]
+    # Same steps as the ingestion pipeline, without its docstore and vector store
+    pipeline = IngestionPipeline(transformations=get_transformations(dedup), disable_cache=True)
+    nodes = pipeline.run(documents=changed) if changed else []
+
+    with lock:
+        docstore = lock.doc_store()
+        journal = IngestionCheckpoint.load(STORAGE_DIR, REINDEX_JOURNAL_FILE)
+        if journal.pending:
+            rollback_batch(journal, docstore, vector_store)
+        # A crash before the docstore is persisted is rolled back by the next run
+        journal.begin_batch(document.doc_id for document in changed)
+        for document in changed:
+            vector_store.delete(document.doc_id)
+        if nodes:
+            vector_store.add(nodes)
+        for document in changed:
+            docstore.set_document_hash(document.doc_id, document.hash)
+        removed = indexed - {document.doc_id for document in documents}
+        for ref_doc_id in removed:
+            docstore.delete_document(ref_doc_id, raise_error=False)
+            vector_store.delete(ref_doc_id)
+        if dedup is not None:
+            reconcile_duplicates(dedup, docstore, vector_store)
+        lock.persist(vector_store)
+        journal.clear()
+
+    logger.info(
+        f"Re-indexed {len(paths)} files: {len(changed)} of {len(documents)} documents "
+        f"changed, {len(nodes)} new chunks, {len(removed)} documents removed"
+    )
+    return bool(changed or removed)
+
+
+def generate_index(streaming: bool = False, resume: bool = False):
+    """
+    Index DATA_DIR into the vector store.
+
+    Args:
+        streaming: Read and ingest the files in bounded micro-batches instead of
+            loading the whole corpus first (peak memory independent of its size).
+        resume: Continue an interrupted streaming ingestion from its checkpoint.
+    """
     init_settings()
     logger.info("Generate index for the provided data")
 
-    # Get the stores and documents or create new ones
-    documents = get_file_documents()
-    docstore = get_doc_store()
-    vector_store = get_vector_store()
+    # Other writers of the docstore wait until the index is generated
+    with IndexLock():
+        # Get the stores and create new ones
+        docstore = get_doc_store()
+        vector_store = get_vector_store()
+        journal = IngestionCheckpoint.load(STORAGE_DIR, REINDEX_JOURNAL_FILE)
+        if journal.pending:
+            rollback_batch(journal, docstore, vector_store)
+
+        dedup = None
+        if os.getenv("INGEST_DEDUP", "false").lower() == "true":
+            dedup = NearDuplicateFilter.from_env()
+
+        # Run the ingestion pipeline
+        if streaming or resume:
+            run_streaming_pipeline(docstore, vector_store, resume=resume, dedup=dedup)
+        else:
+            documents = get_file_documents()
+            _ = run_pipeline(docstore, vector_store, documents, dedup=dedup)
+        if dedup is not None:
+            reconcile_duplicates(dedup, docstore, vector_store)
+            report = dedup.report()
+            logger.info(
+                f"Near-duplicates: skipped {report['duplicates_skipped']} of {report['chunks']} "
+                f"chunks, saving about {report['embedding_tokens_saved']} embedding tokens"
+            )
+
+        persist_storage(docstore, vector_store)
+        generation = bump_index_generation()
+        if streaming or resume:
+            IngestionCheckpoint.load(STORAGE_DIR).clear()
+
+    logger.info(f"Finished generating the index (generation {generation})")
+
+
+def main():
+    """Index the documents of DATA_DIR, or export or import a snapshot of the index"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        default=os.getenv("INGEST_STREAMING", "false").lower() == "true",
+        help="Ingest in bounded micro-batches (INGEST_STREAMING)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted streaming ingestion from its checkpoint",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and re-index the files of DATA_DIR that change",
+    )
+    commands = parser.add_subparsers(dest="command")
+    export_parser = commands.add_parser(
+        "export", help="Write the vector store rows and the docstore to a snapshot"
+    )
+    export_parser.add_argument("directory", help="Snapshot directory to create")
+    export_parser.add_argument(
+        "--float16", action="store_true", help="Store the embeddings in half precision"
+    )
+    import_parser = commands.add_parser(
+        "import", help="Replace the vector store rows and the docstore with a snapshot"
+    )
+    import_parser.add_argument("directory", help="Snapshot directory")
+    args = parser.parse_args()
+    if args.command == "export":
+        from src.snapshot import export_snapshot
 
-    # Run the ingestion pipeline
-    _ = run_pipeline(docstore, vector_store, documents)
+        export_snapshot(args.directory, float16=args.float16)
+        return
+    if args.command == "import":
+        from src.snapshot import import_snapshot
 
-    persist_storage(docstore, vector_store)
+        import_snapshot(args.directory)
+        return
+    if args.watch:
+        from src.watch import watch_data_dir
 
-    logger.info("Finished generating the index")
+        watch_data_dir()
+        return
+    generate_index(streaming=args.streaming, resume=args.resume)
 
 
 if __name__ == "__main__":
-    generate_index()
\ No newline at end of file
+    main()
\ No newline at end of file
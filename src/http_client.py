@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+import httpx
+
+from src.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+HTTP_RETRIES = REGISTRY.counter(
+    "chateduca_http_retries_total", "Upstream HTTP requests retried", labelnames=("reason",)
+)
+HTTP_HEDGES = REGISTRY.counter(
+    "chateduca_http_hedges_total",
+    "Hedged embedding requests sent, and how many of them answered first",
+    labelnames=("result",),
+)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, honouring Retry-After.
+
+    Args:
+        retries: Retries after the first attempt.
+        backoff: Base delay in seconds, doubled at each attempt.
+        max_backoff: Upper bound of a single delay.
+    """
+
+    def __init__(self, retries: int = 3, backoff: float = 0.5, max_backoff: float = 8.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except (TypeError, ValueError):
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def retry_reason(
+        self, response: Optional[httpx.Response], error: Optional[Exception]
+    ) -> Optional[str]:
+        if isinstance(error, httpx.TransportError):
+            return type(error).__name__
+        if response is not None and response.status_code in RETRY_STATUS_CODES:
+            return str(response.status_code)
+        return None
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """Retry connection errors, timeouts and retryable statuses before the response is returned."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, policy: RetryPolicy) -> None:
+        self.transport = transport
+        self.policy = policy
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                error = e
+            reason = self.policy.retry_reason(response, error)
+            if reason is None or attempt >= self.policy.retries:
+                if error is not None:
+                    raise error
+                return response
+            HTTP_RETRIES.inc(reason=reason)
+            delay = self.policy.delay(attempt, response)
+            if response is not None:
+                await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class RetryTransport(httpx.BaseTransport):
+    """Synchronous counterpart of AsyncRetryTransport, used by the ingestion pipeline."""
+
+    def __init__(self, transport: httpx.BaseTransport, policy: RetryPolicy) -> None:
+        self.transport = transport
+        self.policy = policy
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                error = e
+            reason = self.policy.retry_reason(response, error)
+            if reason is None or attempt >= self.policy.retries:
+                if error is not None:
+                    raise error
+                return response
+            HTTP_RETRIES.inc(reason=reason)
+            delay = self.policy.delay(attempt, response)
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class HedgingTransport(httpx.AsyncBaseTransport):
+    """
+    Send a duplicate of an idempotent request when the first one is slower than usual.
+
+    Only requests whose path ends with one of `paths` (by default the embeddings
+    endpoint) are hedged. The delay is the `quantile` of the recent latencies of those
+    requests; until `min_samples` latencies are known, nothing is hedged.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        paths: tuple = ("/embeddings",),
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        window: int = 500,
+    ) -> None:
+        self.transport = transport
+        self.paths = paths
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=window)
+
+    def hedge_delay(self) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    async def _timed(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        if response.status_code < 400:
+            self._latencies.append(time.perf_counter() - start)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        delay = self.hedge_delay() if request.url.path.endswith(self.paths) else None
+        if delay is None:
+            if request.url.path.endswith(self.paths):
+                return await self._timed(request)
+            return await self.transport.handle_async_request(request)
+
+        await request.aread()
+        primary = asyncio.ensure_future(self._timed(request))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        HTTP_HEDGES.inc(result="sent")
+        hedge_request = httpx.Request(
+            request.method,
+            request.url,
+            headers=request.headers,
+            content=request.content,
+            extensions=request.extensions,
+        )
+        hedge = asyncio.ensure_future(self._timed(hedge_request))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.exception() is None]
+            if not succeeded:
+                error = next(iter(done)).exception()
+                continue
+            winner = succeeded[0]
+            if winner is hedge:
+                HTTP_HEDGES.inc(result="won")
+            for loser in [*succeeded[1:], *pending]:
+                loser.cancel()
+                loser.add_done_callback(_close_response)
+            return winner.result()
+        raise error
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def _close_response(task: "asyncio.Future[httpx.Response]") -> None:
+    # A loser that finished anyway still holds a pooled connection
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("HTTP2", "false").lower() != "true":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP2=true needs the h2 package (pip install httpx[http2]), using HTTP/1.1")
+        return False
+    return True
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60)),
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        float(os.getenv("HTTP_READ_TIMEOUT", 60)),
+        connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)),
+    )
+
+
+def _retry_policy() -> RetryPolicy:
+    return RetryPolicy(
+        retries=int(os.getenv("HTTP_RETRIES", 3)),
+        backoff=float(os.getenv("HTTP_RETRY_BACKOFF", 0.5)),
+    )
+
+
+def create_async_http_client(hedging: Optional[bool] = None) -> httpx.AsyncClient:
+    """
+    Build the async client shared by the LLM and the embedding model.
+
+    Args:
+        hedging: Hedge embedding requests, defaults to EMBED_HEDGING.
+    """
+    if hedging is None:
+        hedging = os.getenv("EMBED_HEDGING", "false").lower() == "true"
+    transport: httpx.AsyncBaseTransport = AsyncRetryTransport(
+        httpx.AsyncHTTPTransport(http2=_http2_enabled(), limits=_limits()),
+        _retry_policy(),
+    )
+    if hedging:
+        transport = HedgingTransport(
+            transport,
+            quantile=float(os.getenv("HEDGE_QUANTILE", 0.95)),
+            min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", 20)),
+        )
+    return httpx.AsyncClient(transport=transport, timeout=_timeout())
+
+
+def create_http_client() -> httpx.Client:
+    """Synchronous client with the same pool, timeouts and retries (without hedging)."""
+    return httpx.Client(
+        transport=RetryTransport(httpx.HTTPTransport(limits=_limits()), _retry_policy()),
+        timeout=_timeout(),
+    )
+
+
+_clients: dict = {}
+
+
+def get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """The process-wide sync and async clients, created on first use."""
+    pid = os.getpid()
+    # A forked worker must not reuse the parent's connections
+    if _clients.get("pid") != pid:
+        _clients.update(pid=pid, sync=create_http_client(), async_=create_async_http_client())
+    return _clients["sync"], _clients["async_"]
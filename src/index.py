@@ -1,4 +1,5 @@
 import logging
+import os
 from typing import Optional
 
 from llama_index.core.callbacks import CallbackManager
@@ -9,6 +10,8 @@ from src.vectordb import get_vector_store
 
 logger = logging.getLogger("uvicorn")
 
+GENERATION_FILE = "index_generation"
+
 
 class IndexConfig(BaseModel):
     callback_manager: Optional[CallbackManager] = Field(
@@ -28,4 +31,30 @@ def get_index(config: IndexConfig = None):
         store, callback_manager=config.callback_manager
     )
     logger.info("Finished load index from vector store.")
-    return index
\ No newline at end of file
+    return index
+
+
+def get_index_generation() -> int:
+    """
+    Return the generation counter of the index, bumped every time the data is re-indexed.
+    Answers computed for an older generation must not be reused.
+    """
+    path = os.path.join(os.getenv("STORAGE_DIR", "storage"), GENERATION_FILE)
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_index_generation() -> int:
+    """Increment the generation counter after the data has been re-indexed."""
+    storage_dir = os.getenv("STORAGE_DIR", "storage")
+    os.makedirs(storage_dir, exist_ok=True)
+    generation = get_index_generation() + 1
+    path = os.path.join(storage_dir, GENERATION_FILE)
+    # Write then rename, so readers never see a half-written file
+    with open(f"{path}.tmp", "w") as f:
+        f.write(str(generation))
+    os.replace(f"{path}.tmp", path)
+    return generation
@@ -0,0 +1,406 @@
+"""
+Background ingestion of uploaded documents.
+
+Jobs live in a SQLite table in STORAGE_DIR, so every server worker process can queue
+them and report their status. One process at a time (the holder of an exclusive lock
+on STORAGE_DIR/ingest_workers.lock) starts a child process running INGEST_WORKERS
+threads that take the queued jobs by priority, uploads before bulk re-indexing, and
+re-index their file with `reindex_files`. Reading, chunking and the docstore work hold
+the GIL of the child, never the one of a process serving requests. If the child exits
+it is restarted; if the server process exits, another one takes over the lock. Either
+way the jobs left running are requeued.
+"""
+import fcntl
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, List, Optional
+
+from dotenv import load_dotenv
+
+from src.admission import AdmissionRejected
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITY_UPLOAD = 0
+PRIORITY_BULK = 10
+
+JOBS_FILE = "ingest_jobs.sqlite"
+LOCK_FILE = "ingest_workers.lock"
+COLUMNS = ("id", "path", "priority", "status", "created", "started", "finished", "error", "changed")
+
+
+def resolve_upload_path(data_dir: str, name: str, extensions: List[str]) -> str:
+    """
+    Path in DATA_DIR of an uploaded file named `name` (subdirectories allowed).
+
+    Raises:
+        ValueError: The name leaves DATA_DIR, is hidden or has another extension.
+    """
+    parts = name.replace("\\", "/").split("/")
+    if not name or any(part in ("", ".", "..") or part.startswith(".") for part in parts):
+        raise ValueError(f"Invalid document name: {name}")
+    if os.path.splitext(name)[1].lower() not in extensions:
+        raise ValueError(f"Unsupported file type, expected one of {', '.join(extensions)}")
+    return os.path.join(os.path.abspath(data_dir), *parts)
+
+
+class JobStore:
+    """Ingestion jobs in SQLite (WAL), shared by the server processes."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Opened on first use in each process: the server imports the app before forking
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None, timeout=30
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, path TEXT NOT NULL, priority INTEGER NOT NULL, "
+                "status TEXT NOT NULL, created REAL NOT NULL, started REAL, finished REAL, "
+                "error TEXT, changed INTEGER)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs(status, priority, created)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _job(row) -> Optional[dict]:
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,))
+        return self._job(rows[0] if rows else None)
+
+    def counts(self) -> dict:
+        return dict(self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+    def waiting(self, priority: int) -> int:
+        """Jobs waiting with this priority or a higher one."""
+        return self._execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND priority <= ?", (priority,)
+        )[0][0]
+
+    def average_duration(self) -> float:
+        rows = self._execute(
+            "SELECT AVG(finished - started) FROM (SELECT started, finished FROM jobs "
+            "WHERE status = 'done' ORDER BY finished DESC LIMIT 20)"
+        )
+        return rows[0][0] or 5.0
+
+    def enqueue(self, path: str, priority: int, max_queued: Optional[int] = None) -> dict:
+        """
+        Queue a job for the file, or return the one already queued for it (raising its
+        priority if needed): that job reads the file when it runs, so it covers both.
+
+        Raises:
+            AdmissionRejected: `max_queued` jobs of this priority or a higher one are
+                already waiting.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM jobs "
+                    "WHERE path = ? AND status = 'queued'",
+                    (path,),
+                ).fetchone()
+                if row is not None:
+                    job = self._job(row)
+                    if priority < job["priority"]:
+                        self.conn.execute(
+                            "UPDATE jobs SET priority = ? WHERE id = ?", (priority, job["id"])
+                        )
+                        job["priority"] = priority
+                else:
+                    waiting = self.waiting(priority)
+                    if max_queued is not None and waiting >= max_queued:
+                        raise AdmissionRejected(429, "ingest_queue_full", self.retry_after(waiting))
+                    job = dict.fromkeys(COLUMNS)
+                    job.update(
+                        id=uuid.uuid4().hex, path=path, priority=priority,
+                        status="queued", created=time.time(),
+                    )
+                    self.conn.execute(
+                        f"INSERT INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                        tuple(job[column] for column in COLUMNS),
+                    )
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+        return job
+
+    def retry_after(self, waiting: int) -> int:
+        workers = int(os.getenv("INGEST_WORKERS", 2)) or 1
+        return max(1, int(self.average_duration() * waiting / workers))
+
+    def claim(self) -> Optional[dict]:
+        """Mark the next queued job as running and return it, skipping files being indexed."""
+        rows = self._execute(
+            "UPDATE jobs SET status = 'running', started = ? WHERE id = ("
+            "SELECT id FROM jobs WHERE status = 'queued' AND path NOT IN "
+            "(SELECT path FROM jobs WHERE status = 'running') "
+            "ORDER BY priority, created LIMIT 1) "
+            f"RETURNING {', '.join(COLUMNS)}",
+            (time.time(),),
+        )
+        return self._job(rows[0] if rows else None)
+
+    def finish(self, job_id: str, changed: bool = False, error: Optional[str] = None) -> None:
+        self._execute(
+            "UPDATE jobs SET status = ?, finished = ?, changed = ?, error = ? WHERE id = ?",
+            ("failed" if error else "done", time.time(), int(changed), error, job_id),
+        )
+
+    def requeue_running(self) -> int:
+        """Requeue the jobs of a worker process that stopped while running them."""
+        with self._lock:
+            return self.conn.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'"
+            ).rowcount
+
+    def prune(self, max_age: float) -> None:
+        self._execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+            (time.time() - max_age,),
+        )
+
+
+def _run_workers(
+    storage_dir: str,
+    workers: int,
+    poll_interval: float,
+    stop,
+    wake,
+    parent_pid: int,
+) -> None:
+    """
+    Run the ingestion worker threads, in the child process started by the leader,
+    until `stop` is set or the server process exits.
+    """
+    from src.dedup import NearDuplicateFilter
+    from src.generate import IndexLock, reindex_files
+    from src.index import bump_index_generation
+    from src.settings import init_settings
+    from src.vectordb import get_vector_store
+
+    # Interrupting the server stops this process through `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_settings()
+    store = JobStore(os.path.join(storage_dir, JOBS_FILE))
+    # Shared by the threads, and with `generate` and `generate --watch` through its file
+    lock = IndexLock()
+    vector_store = get_vector_store()
+    dedup = None
+    if os.getenv("INGEST_DEDUP", "false").lower() == "true":
+        dedup = NearDuplicateFilter.from_env()
+
+    def work() -> None:
+        while not stop.is_set() and os.getppid() == parent_pid:
+            job = store.claim()
+            if job is None:
+                wake.wait(poll_interval)
+                wake.clear()
+                continue
+            try:
+                changed = reindex_files({job["path"]}, vector_store, dedup=dedup, lock=lock)
+                if changed:
+                    bump_index_generation()
+                store.finish(job["id"], changed=changed)
+            except Exception as e:
+                logger.exception(f"Ingestion job {job['id']} ({job['path']}) failed")
+                store.finish(job["id"], error=str(e) or type(e).__name__)
+
+    threads = [
+        threading.Thread(target=work, name=f"ingest-worker-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class IngestionQueue:
+    """
+    Queue of files to (re-)index and the worker threads that index them.
+
+    Args:
+        storage_dir: Where the job table and the worker lock live.
+        workers: Indexing threads of the child process started by the holder of the
+            worker lock (0: this process only queues jobs).
+        max_queued: Uploads waiting at once, beyond which uploads are rejected.
+        poll_interval: Seconds between checks for jobs queued by other processes.
+    """
+
+    def __init__(
+        self,
+        storage_dir: str,
+        workers: int = 2,
+        max_queued: int = 100,
+        poll_interval: float = 1.0,
+    ) -> None:
+        self.storage_dir = storage_dir
+        self.workers = workers
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self.store = JobStore(os.path.join(storage_dir, JOBS_FILE))
+        self.leader = False
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock_file = None
+        # Shared with the worker process, created by the leader (after the server forks)
+        self._context = multiprocessing.get_context("spawn")
+        self._process: Optional[multiprocessing.process.BaseProcess] = None
+        self._stop_workers: Optional[Any] = None
+        self._wake_workers: Optional[Any] = None
+
+    @classmethod
+    def from_env(cls) -> "IngestionQueue":
+        return cls(
+            storage_dir=os.getenv("STORAGE_DIR", "storage"),
+            workers=int(os.getenv("INGEST_WORKERS", 2)),
+            max_queued=int(os.getenv("INGEST_QUEUE_MAX", 100)),
+        )
+
+    def check_capacity(self) -> None:
+        """
+        Raises:
+            AdmissionRejected: Too many uploads are waiting, checked before receiving one.
+        """
+        waiting = self.store.waiting(PRIORITY_UPLOAD)
+        if waiting >= self.max_queued:
+            raise AdmissionRejected(429, "ingest_queue_full", self.store.retry_after(waiting))
+
+    def submit(self, path: str, priority: int = PRIORITY_UPLOAD, limit: bool = True) -> dict:
+        """
+        Queue the (re-)indexing of a file of DATA_DIR, added, modified or deleted.
+
+        Args:
+            limit: Reject uploads beyond `max_queued` (bulk jobs are never rejected).
+        """
+        max_queued = self.max_queued if limit and priority == PRIORITY_UPLOAD else None
+        job = self.store.enqueue(os.path.abspath(path), priority, max_queued=max_queued)
+        # Workers started by other processes find the job when they poll
+        if self._wake_workers is not None:
+            self._wake_workers.set()
+        return job
+
+    def submit_all(self, data_dir: str) -> int:
+        """Queue every file of DATA_DIR behind the uploads."""
+        count = 0
+        for root, dirs, names in os.walk(data_dir):
+            # Hidden files are not read, and uploads are written to DATA_DIR/.uploads first
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in names:
+                if not name.startswith("."):
+                    self.submit(os.path.join(root, name), priority=PRIORITY_BULK)
+                    count += 1
+        return count
+
+    def start(self) -> None:
+        if self.workers > 0:
+            thread = threading.Thread(target=self._lead, name="ingest-leader", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 30) -> None:
+        """Let the running jobs finish (up to `timeout`), jobs still queued stay queued."""
+        self._stop.set()
+        if self._stop_workers is not None:
+            self._stop_workers.set()
+            self._wake_workers.set()
+        deadline = time.monotonic() + timeout
+        process = self._process
+        if process is not None:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                # Its running jobs are requeued by the next leader
+                logger.warning("Ingestion workers still running, terminating them")
+                process.terminate()
+                process.join()
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+    def _acquire_leadership(self) -> bool:
+        os.makedirs(self.storage_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.storage_dir, LOCK_FILE), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _lead(self) -> None:
+        # Retry every few seconds, to take over when the worker process exits
+        while not self._acquire_leadership():
+            if self._stop.wait(self.poll_interval * 5):
+                return
+        self.leader = True
+        self.store.prune(max_age=7 * 24 * 3600)
+        self._stop_workers = self._context.Event()
+        self._wake_workers = self._context.Event()
+        logger.info(f"Running {self.workers} ingestion workers in a child process")
+        while not self._stop.is_set():
+            requeued = self.store.requeue_running()
+            if requeued:
+                logger.info(f"Requeued {requeued} interrupted ingestion jobs")
+            self._process = self._context.Process(
+                target=_run_workers,
+                args=(
+                    self.storage_dir,
+                    self.workers,
+                    self.poll_interval,
+                    self._stop_workers,
+                    self._wake_workers,
+                    os.getpid(),
+                ),
+                name="ingest-workers",
+            )
+            self._process.start()
+            self._process.join()
+            if not self._stop.is_set():
+                logger.error(
+                    f"Ingestion worker process exited with code {self._process.exitcode}, "
+                    "restarting it"
+                )
+                self._stop.wait(self.poll_interval * 5)
+
+    def snapshot(self) -> dict:
+        return {"leader": self.leader, "workers": self.workers, "jobs": self.store.counts()}
+
+
+_queue: Optional[IngestionQueue] = None
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    global _queue
+    if _queue is None:
+        _queue = IngestionQueue.from_env()
+    return _queue
@@ -0,0 +1,396 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+from llama_index.core.llms.llm import ToolSelection
+from pydantic_core import to_jsonable_python
+
+from src.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Parameters of the innermost LLM that change its output; other sampling options
+# (top_p, seed) are sent through additional_kwargs
+SAMPLING_PARAMS = ("model", "temperature", "max_tokens", "additional_kwargs")
+
+# Tool calls parsed from the original response, returned again on a cache hit
+TOOL_SELECTIONS_KEY = "cached_tool_selections"
+
+
+class DiskCache:
+    """
+    SQLite key-value store evicting the least recently read entries above `max_bytes`.
+
+    Safe to share between threads and between worker processes (WAL mode).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict) -> None:
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time()),
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(total)
+
+    def _evict(self, total: int) -> None:
+        # Free down to 90% so eviction does not run on every insert
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed"
+        ).fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info(f"LLM cache: evicted {evicted} entries")
+
+
+def _chat_to_dict(response: ChatResponse) -> dict:
+    return {
+        "message": to_jsonable_python(response.message.model_dump(), fallback=str),
+    }
+
+
+def _chat_from_dict(data: dict) -> ChatResponse:
+    return ChatResponse(message=ChatMessage.model_validate(data["message"]))
+
+
+def _innermost_llm(llm: Any) -> Any:
+    """Unwrap LLM wrappers (LimitedLLM, CachedLLM) down to the one calling the provider."""
+    while isinstance(getattr(llm, "llm", None), FunctionCallingLLM):
+        llm = llm.llm
+    return llm
+
+
+class CachedLLM(FunctionCallingLLM):
+    """
+    Replay completions of the wrapped LLM from a disk cache.
+
+    The key covers the model and its sampling parameters, the full message list or
+    prompt, and the call arguments (tool schemas, tool choice). Streamed responses
+    are stored with their chunks and replayed chunk by chunk. Only meant for
+    reproducible runs (evaluations, benchmarks), see LLM_CACHE.
+    """
+
+    llm: FunctionCallingLLM = Field(description="The LLM whose responses are cached.")
+
+    _cache: DiskCache = PrivateAttr()
+    _model_llm: Any = PrivateAttr()
+
+    def __init__(self, llm: FunctionCallingLLM, cache: DiskCache, **kwargs: Any) -> None:
+        super().__init__(llm=llm, callback_manager=llm.callback_manager, **kwargs)
+        self._cache = cache
+        self._model_llm = _innermost_llm(llm)
+        missing = [name for name in SAMPLING_PARAMS if not hasattr(self._model_llm, name)]
+        if missing:
+            raise ValueError(
+                f"Cannot cache {type(self._model_llm).__name__}: "
+                f"no {', '.join(missing)} to build the cache key from"
+            )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self.llm.metadata
+
+    def _key(self, kind: str, payload: Any, kwargs: Dict[str, Any]) -> str:
+        params = {name: getattr(self._model_llm, name) for name in SAMPLING_PARAMS}
+        data = json.dumps(
+            to_jsonable_python(
+                {"kind": kind, "llm": params, "payload": payload, "kwargs": kwargs},
+                fallback=str,
+            ),
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _chat_key(self, messages: Sequence[ChatMessage], kwargs: Dict[str, Any]) -> str:
+        return self._key("chat", [m.model_dump() for m in messages], kwargs)
+
+    def _lookup(self, key: str) -> Optional[dict]:
+        entry = self._cache.get(key)
+        CACHE_REQUESTS.inc(cache="llm", result="hit" if entry is not None else "miss")
+        return entry
+
+    def _store_chat(self, key: str, response: ChatResponse, deltas: List[str]) -> None:
+        entry = _chat_to_dict(response)
+        # Tool calls are stored parsed, the provider objects do not survive JSON
+        tool_selections = self.llm.get_tool_calls_from_response(
+            response, error_on_no_tool_call=False
+        ) if isinstance(self.llm, FunctionCallingLLM) else []
+        entry[TOOL_SELECTIONS_KEY] = [s.model_dump() for s in tool_selections]
+        entry["deltas"] = deltas
+        self._cache.set(key, entry)
+
+    def _replay_chat(self, entry: dict) -> ChatResponse:
+        response = _chat_from_dict(entry)
+        # On the response, not the message: message kwargs are sent back to the provider
+        response.additional_kwargs[TOOL_SELECTIONS_KEY] = entry[TOOL_SELECTIONS_KEY]
+        return response
+
+    def _replay_chat_chunks(self, entry: dict) -> List[ChatResponse]:
+        final = self._replay_chat(entry)
+        chunks, content = [], ""
+        for delta in entry["deltas"]:
+            content += delta
+            message = ChatMessage(role=final.message.role, content=content)
+            chunks.append(ChatResponse(message=message, delta=delta))
+        if chunks:
+            final.delta = chunks[-1].delta
+            chunks[-1] = final
+        else:
+            chunks.append(final)
+        return chunks
+
+    # Tool calling is prepared and parsed by the wrapped LLM
+
+    def _prepare_chat_with_tools(
+        self,
+        tools: Sequence[Any],
+        user_msg: Optional[Any] = None,
+        chat_history: Optional[List[ChatMessage]] = None,
+        verbose: bool = False,
+        allow_parallel_tool_calls: bool = False,
+        tool_required: bool = False,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        return self.llm._prepare_chat_with_tools_compat(
+            tools,
+            user_msg=user_msg,
+            chat_history=chat_history,
+            verbose=verbose,
+            allow_parallel_tool_calls=allow_parallel_tool_calls,
+            tool_required=tool_required,
+            **kwargs,
+        )
+
+    def _validate_chat_with_tools_response(
+        self,
+        response: ChatResponse,
+        tools: Sequence[Any],
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> ChatResponse:
+        return self.llm._validate_chat_with_tools_response(
+            response, tools, allow_parallel_tool_calls=allow_parallel_tool_calls, **kwargs
+        )
+
+    def get_tool_calls_from_response(
+        self, response: ChatResponse, error_on_no_tool_call: bool = True, **kwargs: Any
+    ) -> List[ToolSelection]:
+        cached = response.additional_kwargs.get(TOOL_SELECTIONS_KEY)
+        if cached is None:
+            return self.llm.get_tool_calls_from_response(
+                response, error_on_no_tool_call=error_on_no_tool_call, **kwargs
+            )
+        if not cached and error_on_no_tool_call:
+            raise ValueError("Expected at least one tool call, but got 0 tool calls.")
+        return [ToolSelection.model_validate(s) for s in cached]
+
+    # Chat
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        entry = self._lookup(key)
+        if entry is not None:
+            return self._replay_chat(entry)
+        response = self.llm.chat(messages, **kwargs)
+        self._store_chat(key, response, [])
+        return response
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        entry = await asyncio.to_thread(self._lookup, key)
+        if entry is not None:
+            return self._replay_chat(entry)
+        response = await self.llm.achat(messages, **kwargs)
+        await asyncio.to_thread(self._store_chat, key, response, [])
+        return response
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        key = self._chat_key(messages, kwargs)
+        entry = self._lookup(key)
+        if entry is not None:
+            return iter(self._replay_chat_chunks(entry))
+
+        def gen() -> ChatResponseGen:
+            deltas, last = [], None
+            for chunk in self.llm.stream_chat(messages, **kwargs):
+                deltas.append(chunk.delta or "")
+                last = chunk
+                yield chunk
+            # Only complete streams are cached
+            if last is not None:
+                self._store_chat(key, last, deltas)
+
+        return gen()
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        key = self._chat_key(messages, kwargs)
+        entry = await asyncio.to_thread(self._lookup, key)
+        if entry is not None:
+            chunks = self._replay_chat_chunks(entry)
+
+            async def replay() -> ChatResponseAsyncGen:
+                for chunk in chunks:
+                    yield chunk
+
+            return replay()
+
+        stream = await self.llm.astream_chat(messages, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            deltas, last = [], None
+            async for chunk in stream:
+                deltas.append(chunk.delta or "")
+                last = chunk
+                yield chunk
+            if last is not None:
+                await asyncio.to_thread(self._store_chat, key, last, deltas)
+
+        return gen()
+
+    # Completion
+
+    def _complete_key(self, prompt: str, formatted: bool, kwargs: Dict[str, Any]) -> str:
+        return self._key("complete", {"prompt": prompt, "formatted": formatted}, kwargs)
+
+    @staticmethod
+    def _replay_completion_chunks(entry: dict) -> List[CompletionResponse]:
+        chunks, text = [], ""
+        for delta in entry["deltas"] or [entry["text"]]:
+            text += delta
+            chunks.append(CompletionResponse(text=text, delta=delta))
+        return chunks
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._complete_key(prompt, formatted, kwargs)
+        entry = self._lookup(key)
+        if entry is not None:
+            return CompletionResponse(text=entry["text"])
+        response = self.llm.complete(prompt, formatted=formatted, **kwargs)
+        self._cache.set(key, {"text": response.text, "deltas": []})
+        return response
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        key = self._complete_key(prompt, formatted, kwargs)
+        entry = await asyncio.to_thread(self._lookup, key)
+        if entry is not None:
+            return CompletionResponse(text=entry["text"])
+        response = await self.llm.acomplete(prompt, formatted=formatted, **kwargs)
+        await asyncio.to_thread(self._cache.set, key, {"text": response.text, "deltas": []})
+        return response
+
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        key = self._complete_key(prompt, formatted, kwargs)
+        entry = self._lookup(key)
+        if entry is not None:
+            return iter(self._replay_completion_chunks(entry))
+
+        def gen() -> CompletionResponseGen:
+            deltas, text = [], None
+            for chunk in self.llm.stream_complete(prompt, formatted=formatted, **kwargs):
+                deltas.append(chunk.delta or "")
+                text = chunk.text
+                yield chunk
+            if text is not None:
+                self._cache.set(key, {"text": text, "deltas": deltas})
+
+        return gen()
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        key = self._complete_key(prompt, formatted, kwargs)
+        entry = await asyncio.to_thread(self._lookup, key)
+        if entry is not None:
+            chunks = self._replay_completion_chunks(entry)
+
+            async def replay() -> CompletionResponseAsyncGen:
+                for chunk in chunks:
+                    yield chunk
+
+            return replay()
+
+        stream = await self.llm.astream_complete(prompt, formatted=formatted, **kwargs)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            deltas, text = [], None
+            async for chunk in stream:
+                deltas.append(chunk.delta or "")
+                text = chunk.text
+                yield chunk
+            if text is not None:
+                await asyncio.to_thread(self._cache.set, key, {"text": text, "deltas": deltas})
+
+        return gen()
+
+
+def cached_llm_from_env(llm: FunctionCallingLLM) -> FunctionCallingLLM:
+    """Wrap `llm` in a CachedLLM when LLM_CACHE=true, otherwise return it unchanged."""
+    if os.getenv("LLM_CACHE", "false").lower() != "true":
+        return llm
+    path = os.path.join(os.getenv("STORAGE_DIR", "storage"), "llm_cache.sqlite")
+    max_bytes = int(os.getenv("LLM_CACHE_MAX_MB", 256)) * 1024 * 1024
+    logger.info(f"LLM responses are cached in {path}")
+    return CachedLLM(llm, DiskCache(path, max_bytes=max_bytes))
@@ -0,0 +1,374 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType, EventPayload
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatEndEvent,
+    LLMChatInProgressEvent,
+    LLMChatStartEvent,
+)
+
+# Bucket upper bounds in seconds, from 5ms to 2 minutes
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _HistogramValues:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # One extra slot for the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Dict[str, int]:
+        result = {}
+        total = 0
+        for bound, count in zip([*self.buckets, float("inf")], self.counts):
+            total += count
+            result["+Inf" if bound == float("inf") else repr(bound)] = total
+        return result
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets; observing a value is a bisect and two adds.
+
+    Observations are serialized by a lock, ingestion threads and the event loop share the metrics.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        labelnames: Sequence[str] = (),
+    ):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, _HistogramValues] = {}
+        self._lock = threading.Lock()
+
+    def _child(self, labels: Dict[str, str]) -> _HistogramValues:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        child = self._values.get(key)
+        if child is None:
+            child = self._values.setdefault(key, _HistogramValues(self.buckets))
+        return child
+
+    def observe(self, value: float, **labels: str) -> None:
+        child = self._child(labels)
+        with self._lock:
+            child.observe(value)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @property
+    def count(self) -> int:
+        return sum(v.count for v in self._values.values())
+
+    def snapshot(self) -> dict:
+        child = self._child({})
+        with self._lock:
+            return {
+                "count": child.count,
+                "sum": round(child.sum, 6),
+                "buckets": child.cumulative(),
+            }
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            values = [
+                (key, child.cumulative(), child.sum, child.count)
+                for key, child in self._values.items()
+            ]
+        for key, cumulative, total_sum, count in values:
+            for bound, total in cumulative.items():
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total_sum}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in values
+        ]
+
+
+class Gauge:
+    """Gauge read from a callback when the metrics are scraped."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        return [f"{self.name} {self.fn()}"]
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric: Any) -> Any:
+        # Re-registering a name replaces the metric, e.g. when a component is recreated
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, **kwargs: Any) -> Histogram:
+        return self.register(Histogram(name, help, **kwargs))
+
+    def counter(self, name: str, help: str, **kwargs: Any) -> Counter:
+        return self.register(Counter(name, help, **kwargs))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, help, fn))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+QUERY_EMBEDDING_SECONDS = REGISTRY.histogram(
+    "chateduca_query_embedding_seconds", "Latency of query embedding calls"
+)
+DENSE_SEARCH_SECONDS = REGISTRY.histogram(
+    "chateduca_dense_search_seconds", "Latency of HNSW vector searches"
+)
+BM25_SEARCH_SECONDS = REGISTRY.histogram(
+    "chateduca_bm25_search_seconds", "Latency of BM25 searches"
+)
+FUSION_SECONDS = REGISTRY.histogram(
+    "chateduca_fusion_seconds", "Time spent merging dense and BM25 results"
+)
+RETRIEVAL_SECONDS = REGISTRY.histogram(
+    "chateduca_retrieval_seconds", "Latency of a whole retrieval (embedding and search)"
+)
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    "chateduca_llm_call_seconds", "Latency of each LLM call", labelnames=("model",)
+)
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    "chateduca_llm_time_to_first_token_seconds",
+    "Time to the first streamed chunk of each LLM call",
+    labelnames=("model",),
+)
+LLM_TOKENS = REGISTRY.histogram(
+    "chateduca_llm_tokens",
+    "Tokens per LLM call",
+    buckets=TOKEN_BUCKETS,
+    labelnames=("kind",),
+)
+LLM_TOKENS_TOTAL = REGISTRY.counter(
+    "chateduca_llm_tokens_total", "Tokens sent to and received from the LLM",
+    labelnames=("kind",),
+)
+FAST_PATH_SAVED_SECONDS = REGISTRY.histogram(
+    "chateduca_fast_path_saved_seconds",
+    "Estimated time saved per fast-path answer, against the agent latency of eligible questions",
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "chateduca_request_seconds",
+    "Total request time, until the last byte of the response",
+    labelnames=("endpoint",),
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "chateduca_cache_requests_total",
+    "Lookups of the caches (speculative retrieval, request coalescing)",
+    labelnames=("cache", "result"),
+)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Feed the latency histograms from the callback events.
+
+    Only a start timestamp per open event is kept, so the cost per event
+    is a dict insert and a histogram observation.
+    """
+
+    _timed_events = {
+        CBEventType.EMBEDDING: QUERY_EMBEDDING_SECONDS,
+        CBEventType.RETRIEVE: RETRIEVAL_SECONDS,
+    }
+
+    def __init__(self) -> None:
+        ignored = [e for e in CBEventType if e not in self._timed_events]
+        super().__init__(event_starts_to_ignore=ignored, event_ends_to_ignore=ignored)
+        self._starts: Dict[str, float] = {}
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        self._starts[event_id] = time.perf_counter()
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        start = self._starts.pop(event_id, None)
+        if start is None:
+            return
+        if event_type == CBEventType.EMBEDDING and payload is not None:
+            # Ingestion embeds batches of chunks, only single queries are of interest here
+            if len(payload.get(EventPayload.CHUNKS, ())) != 1:
+                return
+        self._timed_events[event_type].observe(time.perf_counter() - start)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        pass
+
+
+def _usage(response: Any) -> Tuple[Optional[int], Optional[int]]:
+    raw = getattr(response, "raw", None)
+    usage = getattr(raw, "usage", None) or (
+        raw.get("usage") if isinstance(raw, dict) else None
+    )
+    if usage is None:
+        return None, None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+
+
+class LLMMetricsEventHandler(BaseEventHandler):
+    """Measure LLM call latency, time to first token and token usage from instrumentation events."""
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._calls: Dict[str, Tuple[float, bool, str]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LLMMetricsEventHandler"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> None:
+        span_id = event.span_id or ""
+        if isinstance(event, LLMChatStartEvent):
+            model = str(event.model_dict.get("model", ""))
+            with self._lock:
+                self._calls[span_id] = (time.perf_counter(), False, model)
+        elif isinstance(event, LLMChatInProgressEvent):
+            with self._lock:
+                call = self._calls.get(span_id)
+                if call is None or call[1]:
+                    return
+                self._calls[span_id] = (call[0], True, call[2])
+            LLM_TTFT_SECONDS.observe(time.perf_counter() - call[0], model=call[2])
+        elif isinstance(event, LLMChatEndEvent):
+            with self._lock:
+                call = self._calls.pop(span_id, None)
+            if call is None:
+                return
+            LLM_CALL_SECONDS.observe(time.perf_counter() - call[0], model=call[2])
+            prompt_tokens, completion_tokens = _usage(event.response)
+            for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+                if tokens is not None:
+                    LLM_TOKENS.observe(tokens, kind=kind)
+                    LLM_TOKENS_TOTAL.inc(tokens, kind=kind)
+
+
+class RequestTimingMiddleware:
+    """ASGI middleware observing the total time of each request, streaming ones included."""
+
+    def __init__(self, app: Any, paths: Sequence[str]) -> None:
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def timed_send(message: dict) -> None:
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=path)
+
+        await self.app(scope, receive, timed_send)
@@ -1,7 +1,7 @@
 import logging
 import re
 from typing import Any, Dict, List, Optional, Set, Tuple, Union, Callable
-from llama_index.core.vector_stores.types import MetadataFilters
+from llama_index.core.vector_stores.types import MetadataFilters, VectorStoreQuery
 
 import sqlalchemy
 from llama_index.core.bridge.pydantic import BaseModel, Field
@@ -11,8 +11,11 @@ from llama_index.vector_stores.postgres.base import (
     PGVectorStore,
     DBEmbeddingRow,
     PGType,
+    _dedup_results,
 )
 
+from src.metrics import BM25_SEARCH_SECONDS, DENSE_SEARCH_SECONDS, FUSION_SECONDS
+
 
 _logger = logging.getLogger(__name__)
 
@@ -351,11 +354,31 @@ class ParadeDBVectorStore(PGVectorStore, BaseModel):
                 _logger.warning(f"Failed to create BM25 index {table_fq}: {e}")
                 raise
 
+    def _create_metadata_indexes(self) -> None:
+        """
+        Create the indexed_metadata_keys indexes missing on an existing table.
+
+        The table is created with its indexes only once, so keys added later would
+        otherwise never be indexed. Building an index blocks writes to the table.
+        """
+        table = self._table_class.__table__
+        with self._engine.begin() as connection:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
     def _initialize(self) -> None:
         """Override to add BM25 index creation."""
         if not self._is_initialized:
             super()._initialize()
 
+            if self.perform_setup:
+                try:
+                    self._create_metadata_indexes()
+                except Exception as e:
+                    _logger.warning(f"PG Setup: Error creating metadata indexes: {e}")
+                    if self.initialization_fail_on_error:
+                        raise
+
             if self.use_bm25 and self.perform_setup:
                 try:
                     self._create_bm25_index()
@@ -399,6 +422,66 @@ class ParadeDBVectorStore(PGVectorStore, BaseModel):
             LIMIT :limit
         """).bindparams(query=query_str_clean, limit=limit)
 
+    def _query_with_score(
+        self,
+        embedding: Optional[List[float]],
+        limit: int = 10,
+        metadata_filters: Optional[MetadataFilters] = None,
+        **kwargs: Any,
+    ) -> List[DBEmbeddingRow]:
+        with DENSE_SEARCH_SECONDS.time():
+            return super()._query_with_score(embedding, limit, metadata_filters, **kwargs)
+
+    async def _aquery_with_score(
+        self,
+        embedding: Optional[List[float]],
+        limit: int = 10,
+        metadata_filters: Optional[MetadataFilters] = None,
+        **kwargs: Any,
+    ) -> List[DBEmbeddingRow]:
+        with DENSE_SEARCH_SECONDS.time():
+            return await super()._aquery_with_score(
+                embedding, limit, metadata_filters, **kwargs
+            )
+
+    def _hybrid_query(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> List[DBEmbeddingRow]:
+        """Override to time the merge of dense and sparse results separately."""
+        if query.alpha is not None:
+            _logger.warning("postgres hybrid search does not support alpha parameter.")
+
+        sparse_top_k = query.sparse_top_k or query.similarity_top_k
+        dense_results = self._query_with_score(
+            query.query_embedding, query.similarity_top_k, query.filters, **kwargs
+        )
+        sparse_results = self._sparse_query_with_rank(
+            query.query_str, sparse_top_k, query.filters
+        )
+        with FUSION_SECONDS.time():
+            return _dedup_results(dense_results + sparse_results)
+
+    async def _async_hybrid_query(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> List[DBEmbeddingRow]:
+        """Override to time the merge of dense and sparse results separately."""
+        if query.alpha is not None:
+            _logger.warning("postgres hybrid search does not support alpha parameter.")
+
+        import asyncio
+
+        sparse_top_k = query.sparse_top_k or query.similarity_top_k
+        dense_results, sparse_results = await asyncio.gather(
+            self._aquery_with_score(
+                query.query_embedding, query.similarity_top_k, query.filters, **kwargs
+            ),
+            self._async_sparse_query_with_rank(
+                query.query_str, sparse_top_k, query.filters
+            ),
+        )
+        with FUSION_SECONDS.time():
+            return _dedup_results(dense_results + sparse_results)
+
     def _sparse_query_with_rank(
         self,
         query_str: Optional[str] = None,
@@ -410,7 +493,7 @@ class ParadeDBVectorStore(PGVectorStore, BaseModel):
             return super()._sparse_query_with_rank(query_str, limit, metadata_filters)
 
         stmt = self._build_sparse_query(query_str, limit, metadata_filters)
-        with self._session() as session, session.begin():
+        with BM25_SEARCH_SECONDS.time(), self._session() as session, session.begin():
             res = session.execute(stmt)
             return [
                 DBEmbeddingRow(
@@ -440,19 +523,21 @@ class ParadeDBVectorStore(PGVectorStore, BaseModel):
             )
 
         stmt = self._build_sparse_query(query_str, limit, metadata_filters)
-        async with self._async_session() as session, session.begin():
-            res = await session.execute(stmt)
-            return [
-                DBEmbeddingRow(
-                    node_id=item.node_id,
-                    text=item.text,
-                    metadata=item.metadata_,
-                    custom_fields={
-                        key: val
-                        for key, val in item._asdict().items()
-                        if key not in ["id", "node_id", "text", "metadata_", "rank"]
-                    },
-                    similarity=item.rank,
-                )
-                for item in res.all()
-            ]
+        with BM25_SEARCH_SECONDS.time():
+            async with self._async_session() as session, session.begin():
+                res = await session.execute(stmt)
+                rows = res.all()
+        return [
+            DBEmbeddingRow(
+                node_id=item.node_id,
+                text=item.text,
+                metadata=item.metadata_,
+                custom_fields={
+                    key: val
+                    for key, val in item._asdict().items()
+                    if key not in ["id", "node_id", "text", "metadata_", "rank"]
+                },
+                similarity=item.rank,
+            )
+            for item in rows
+        ]
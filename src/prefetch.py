@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+import re
+import unicodedata
+from contextvars import ContextVar, Token
+from typing import List, Optional, Set
+
+from llama_index.core import QueryBundle
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+
+from src.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Retrieval started for the raw user message of the current request
+_current_prefetch: ContextVar[Optional["PrefetchedRetrieval"]] = ContextVar(
+    "current_prefetch", default=None
+)
+
+
+# Question words and prepositions the agent drops when it rephrases the user message
+_STOPWORDS = {
+    "qual", "quais", "quando", "onde", "quem", "quanto", "quanta", "quantos", "quantas",
+    "como", "que", "por", "porque", "dos", "das", "nos", "nas", "para", "com", "sem",
+    "uma", "umas", "uns", "sobre", "entre", "pelo", "pela", "pelos", "pelas", "sao",
+    "foi", "the", "what", "when", "where", "who", "which", "how", "and", "for", "about",
+}
+
+
+def _terms(text: str) -> Set[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    # Very short words are mostly articles and prepositions
+    return {t for t in re.findall(r"\w+", text) if len(t) > 2 and t not in _STOPWORDS}
+
+
+def query_similarity(a: str, b: str) -> float:
+    """
+    Jaccard similarity of the terms of two queries.
+
+    A query that only covers part of the other (a narrower tool query) scores low,
+    so it is not answered with the retrieval of the broader message.
+    """
+    terms_a, terms_b = _terms(a), _terms(b)
+    if not terms_a or not terms_b:
+        return 0.0
+    return len(terms_a & terms_b) / len(terms_a | terms_b)
+
+
+class PrefetchedRetrieval:
+    """A retrieval running in the background for the raw user message."""
+
+    def __init__(self, query_str: str, task: "asyncio.Task[List[NodeWithScore]]"):
+        self.query_str = query_str
+        self.task = task
+        self.used = False
+        self._token: Optional[Token] = None
+
+    def discard(self) -> None:
+        """Stop tracking the prefetch, cancelling it if no tool call used it."""
+        if self._token is not None:
+            _current_prefetch.reset(self._token)
+            self._token = None
+        if self.used:
+            return
+        if self.task.done():
+            if not self.task.cancelled():
+                # Consume a possible error, nobody is waiting for this result
+                self.task.exception()
+        else:
+            self.task.cancel()
+        logger.info("Speculative retrieval discarded")
+
+
+class PrefetchRetriever(BaseRetriever):
+    """
+    Wrap a retriever so that a retrieval started speculatively for the user message
+    is reused when the agent's tool query is close enough to it.
+    """
+
+    def __init__(
+        self, retriever: BaseRetriever, min_similarity: Optional[float] = None
+    ) -> None:
+        self._retriever = retriever
+        self._min_similarity = (
+            min_similarity
+            if min_similarity is not None
+            else float(os.getenv("PREFETCH_MIN_SIMILARITY", 0.6))
+        )
+        super().__init__(
+            callback_manager=retriever.callback_manager,
+            verbose=retriever._verbose,
+        )
+
+    def prefetch(self, query_str: str) -> PrefetchedRetrieval:
+        """Start retrieving for `query_str` in the background for the current context."""
+        task = asyncio.create_task(
+            self._retriever.aretrieve(QueryBundle(query_str=query_str))
+        )
+        prefetched = PrefetchedRetrieval(query_str, task)
+        prefetched._token = _current_prefetch.set(prefetched)
+        return prefetched
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._retriever.retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        prefetched = _current_prefetch.get()
+        if prefetched is not None and not prefetched.task.cancelled():
+            similarity = query_similarity(prefetched.query_str, query_bundle.query_str)
+            if similarity >= self._min_similarity:
+                prefetched.used = True
+                try:
+                    nodes = await prefetched.task
+                except Exception as e:
+                    logger.warning(f"Speculative retrieval failed, retrying: {e}")
+                else:
+                    CACHE_REQUESTS.inc(cache="prefetch", result="hit")
+                    logger.info(
+                        f"Speculative retrieval reused (similarity={similarity:.2f})"
+                    )
+                    # Copy the list, postprocessors may modify it in place
+                    return list(nodes)
+            else:
+                CACHE_REQUESTS.inc(cache="prefetch", result="miss")
+                logger.info(
+                    f"Speculative retrieval not reused (similarity={similarity:.2f})"
+                )
+        return await self._retriever.aretrieve(query_bundle)
@@ -1,29 +1,64 @@
 import os
 from typing import Any, Optional
 
-from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.indices.base import BaseIndex
+from llama_index.core.query_engine.retriever_query_engine import RetrieverQueryEngine
 from llama_index.core.tools.query_engine import QueryEngineTool
 
-def create_query_engine(index: BaseIndex, **kwargs: Any) -> BaseQueryEngine:
+from src.adaptive import AdaptiveTopKPostprocessor
+from src.admission import LimitedRetriever
+from src.dedup import DuplicateSourcesPostprocessor
+from src.prefetch import PrefetchRetriever
+
+
+def create_query_engine(index: BaseIndex, **kwargs: Any) -> RetrieverQueryEngine:
     """
     Create a query engine for the given index.
 
     Args:
         index: The index to create a query engine for.
         params (optional): Additional parameters for the query engine, e.g: similarity_top_k
+
+    With `TOP_K_MODE=adaptive`, `TOP_K_CANDIDATES` nodes are fetched in a single
+    query and the context is cut by `AdaptiveTopKPostprocessor` instead of using
+    the static `TOP_K`.
+    With `INGEST_DEDUP=true`, retrieved chunks list the documents of their skipped
+    near-duplicates, see `DuplicateSourcesPostprocessor`.
+    With `SPECULATIVE_PREFETCH=true` (default) the retriever can reuse a retrieval
+    started for the raw user message, see `PrefetchRetriever`.
     """
     top_k = int(os.getenv("TOP_K", 2))
+    if os.getenv("TOP_K_MODE", "static").lower() == "adaptive":
+        top_k = int(os.getenv("TOP_K_CANDIDATES", 10))
+        kwargs["node_postprocessors"] = [
+            *kwargs.get("node_postprocessors", []),
+            AdaptiveTopKPostprocessor.from_env(
+                query_mode=kwargs.get("vector_store_query_mode", "default")
+            ),
+        ]
+    if os.getenv("INGEST_DEDUP", "false").lower() == "true":
+        # Chunks indexed once for several documents cite all of them
+        kwargs["node_postprocessors"] = [
+            *kwargs.get("node_postprocessors", []),
+            DuplicateSourcesPostprocessor(),
+        ]
     if top_k != 0 and kwargs.get("filters") is None:
         kwargs["similarity_top_k"] = top_k
 
-    return index.as_query_engine(**kwargs)
+    # Retrievals share the MAX_CONCURRENT_RETRIEVALS limit of the server
+    retriever: BaseRetriever = LimitedRetriever(index.as_retriever(**kwargs))
+    if os.getenv("SPECULATIVE_PREFETCH", "true").lower() == "true":
+        retriever = PrefetchRetriever(retriever)
+    # Same engine as index.as_query_engine, built around the wrapped retriever
+    return RetrieverQueryEngine.from_args(retriever, **kwargs)
 
 
 def get_query_engine_tool(
     index: BaseIndex,
     name: Optional[str] = None,
     description: Optional[str] = None,
+    query_engine: Optional[RetrieverQueryEngine] = None,
     **kwargs: Any,
 ) -> QueryEngineTool:
     """
@@ -33,12 +68,14 @@ def get_query_engine_tool(
         index: The index to create a query engine for.
         name (optional): The name of the tool.
         description (optional): The description of the tool.
+        query_engine (optional): Engine of the tool, defaults to `create_query_engine`.
     """
     if name is None:
         name = "query_index"
     if description is None:
         description = "Use this tool to retrieve information from a knowledge base. Provide a specific query and can call the tool multiple times if necessary."
-    query_engine = create_query_engine(index, **kwargs)
+    if query_engine is None:
+        query_engine = create_query_engine(index, **kwargs)
     tool = QueryEngineTool.from_defaults(
         query_engine=query_engine,
         name=name,
@@ -0,0 +1,221 @@
+import logging
+import os
+import random
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from llama_index.core import QueryBundle
+from llama_index.core.agent.workflow import AgentOutput, AgentWorkflow
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.llms import LLM
+from llama_index.core.memory import BaseMemory
+from llama_index.core.prompts import PromptTemplate
+from llama_index.core.query_engine.retriever_query_engine import RetrieverQueryEngine
+from llama_index.core.schema import MetadataMode
+
+from src.metrics import FAST_PATH_SAVED_SECONDS
+from src.prefetch import PrefetchRetriever
+
+logger = logging.getLogger(__name__)
+
+# Used as the user message of the single synthesis call of the fast path
+FAST_PATH_PROMPT = PromptTemplate(
+    "Context information is below.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Given the context information, answer the question.\n"
+    "Question: {query_str}\n"
+    "Answer: "
+)
+
+_GREETINGS = {
+    "oi", "ola", "bom dia", "boa tarde", "boa noite", "obrigado", "obrigada",
+    "valeu", "tchau", "ok", "certo", "entendi", "hello", "hi", "thanks",
+}
+# References to the previous turns of the conversation
+_FOLLOW_UP = re.compile(
+    r"\b(isso|disso|nisso|esse|essa|esses|essas|este|esta|ele|ela|eles|elas|"
+    r"anterior|acima|mesmo|mesma|tambem|continue|continua|de novo|novamente|"
+    r"explique melhor|e sobre|e quanto|that|it|above|again)\b"
+)
+# Questions that need several lookups or some reasoning over the results
+_MULTI_STEP = re.compile(
+    r"\b(compare|comparar|compara|comparacao|diferenca|diferencas|versus|vs|"
+    r"e depois|passo a passo|calcule|calcular|somar|some os|some as|ranking|"
+    r"todas as|todos os)\b"
+)
+_QUESTION_START = re.compile(
+    r"^(qual|quais|quando|onde|quem|quanto|quanta|quantos|quantas|como|o que|"
+    r"o qu|por que|porque|existe|existem|ha|tem|what|when|where|who|which|how)\b"
+)
+
+
+@dataclass
+class RouteDecision:
+    route: str  # "fast" or "agent"
+    reason: str
+
+
+def _normalize(message: str) -> str:
+    text = unicodedata.normalize("NFKD", message.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def classify_message(message: str, has_history: bool = False) -> RouteDecision:
+    """
+    Decide without any LLM call whether a message is a plain knowledge-base question.
+
+    Args:
+        message: The user message.
+        has_history: Whether the session already has previous turns.
+    """
+    text = _normalize(message)
+    if not text or text.strip("!.?") in _GREETINGS:
+        return RouteDecision("agent", "conversational")
+    if len(text.split()) > int(os.getenv("FAST_PATH_MAX_WORDS", 40)):
+        return RouteDecision("agent", "long_message")
+    if text.count("?") > 1:
+        return RouteDecision("agent", "multiple_questions")
+    if _MULTI_STEP.search(text):
+        return RouteDecision("agent", "multi_step")
+    if has_history and _FOLLOW_UP.search(text):
+        return RouteDecision("agent", "follow_up")
+    if _QUESTION_START.match(text) or text.endswith("?"):
+        return RouteDecision("fast", "retrieval_question")
+    return RouteDecision("agent", "default")
+
+
+class RoutedWorkflow:
+    """
+    Run plain retrieval questions as retrieval plus a single synthesis call,
+    and everything else through the agent loop.
+    """
+
+    def __init__(
+        self,
+        agent: AgentWorkflow,
+        query_engine: RetrieverQueryEngine,
+        llm: LLM,
+        system_prompt: Optional[str] = None,
+        enabled: bool = True,
+        baseline_rate: float = 0.05,
+        baseline_ms: Optional[float] = None,
+    ) -> None:
+        """
+        Args:
+            enabled: Route eligible questions to the fast path.
+            baseline_rate: Fraction of the eligible questions still sent through the
+                agent, to measure the latency the fast path saves.
+            baseline_ms: Initial agent latency of eligible questions, e.g. from a
+                previous deployment, until enough questions were sampled.
+        """
+        self.agent = agent
+        self.query_engine = query_engine
+        self.llm = llm
+        self.system_prompt = system_prompt
+        self.enabled = enabled
+        self.baseline_rate = baseline_rate
+        # Moving average of the agent latency of fast-path eligible questions,
+        # used to estimate the time saved
+        self._agent_latency_ms: Optional[float] = baseline_ms
+
+    async def run(
+        self,
+        user_msg: str,
+        memory: Optional[BaseMemory] = None,
+        **kwargs: Any,
+    ) -> AgentOutput:
+        start = time.perf_counter()
+        has_history = memory is not None and len(await memory.aget()) > 0
+        eligible = classify_message(user_msg, has_history)
+        if not self.enabled:
+            decision = RouteDecision("agent", "disabled")
+        elif eligible.route == "fast" and random.random() < self.baseline_rate:
+            decision = RouteDecision("agent", "baseline_sample")
+        else:
+            decision = eligible
+
+        if decision.route == "fast":
+            result = await self._run_fast_path(user_msg, memory)
+        else:
+            result = await self._run_agent(
+                user_msg,
+                memory,
+                # Greetings and thanks do not call the query tool
+                prefetch=eligible.reason != "conversational",
+                **kwargs,
+            )
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if decision.route == "fast":
+            saved = "unknown"
+            if self._agent_latency_ms is not None:
+                saved_ms = self._agent_latency_ms - elapsed_ms
+                FAST_PATH_SAVED_SECONDS.observe(saved_ms / 1000)
+                saved = f"{saved_ms:.0f}ms"
+            logger.info(
+                f"route=fast reason={decision.reason} elapsed={elapsed_ms:.0f}ms "
+                f"estimated_saved={saved}"
+            )
+        else:
+            if eligible.route == "fast":
+                # Greetings and multi-step questions would skew the comparison
+                self._agent_latency_ms = (
+                    elapsed_ms
+                    if self._agent_latency_ms is None
+                    else 0.8 * self._agent_latency_ms + 0.2 * elapsed_ms
+                )
+            logger.info(
+                f"route=agent reason={decision.reason} elapsed={elapsed_ms:.0f}ms"
+            )
+        return result
+
+    async def _run_agent(
+        self,
+        user_msg: str,
+        memory: Optional[BaseMemory],
+        prefetch: bool = True,
+        **kwargs: Any,
+    ) -> AgentOutput:
+        retriever = self.query_engine.retriever
+        if not prefetch or not isinstance(retriever, PrefetchRetriever):
+            return await self.agent.run(user_msg=user_msg, memory=memory, **kwargs)
+
+        # Almost every turn calls the query tool, so retrieve for the raw message
+        # while the agent's first LLM call decides what to ask
+        prefetched = retriever.prefetch(user_msg)
+        try:
+            return await self.agent.run(user_msg=user_msg, memory=memory, **kwargs)
+        finally:
+            prefetched.discard()
+
+    async def _run_fast_path(
+        self, user_msg: str, memory: Optional[BaseMemory]
+    ) -> AgentOutput:
+        nodes = await self.query_engine.aretrieve(QueryBundle(query_str=user_msg))
+        context_str = "\n\n".join(
+            n.node.get_content(metadata_mode=MetadataMode.LLM) for n in nodes
+        )
+        messages = [
+            ChatMessage(
+                role="user",
+                content=FAST_PATH_PROMPT.format(
+                    context_str=context_str, query_str=user_msg
+                ),
+            )
+        ]
+        if self.system_prompt:
+            messages.insert(0, ChatMessage(role="system", content=self.system_prompt))
+
+        response = await self.llm.achat(messages)
+        answer = ChatMessage(role="assistant", content=response.message.content)
+        if memory is not None:
+            await memory.aput_messages(
+                [ChatMessage(role="user", content=user_msg), answer]
+            )
+        return AgentOutput(response=answer, current_agent_name="FastPath", raw=nodes)
@@ -0,0 +1,196 @@
+"""
+Production server: N uvicorn workers forked from a parent that preloads the application.
+
+The parent imports the app and initializes the settings and the tokenizer; the workers
+reuse them (init_settings runs once per process) and share those pages copy-on-write.
+Nothing that holds connections is created before the fork: the HTTP clients and the
+database engines connect lazily, and the workflow (with its query engine) is built in
+each worker's lifespan. Workers that keep dying right after starting are restarted with
+backoff, and the server exits after MAX_FAILED_STARTS of them in a row. On SIGTERM/SIGINT every worker stops accepting
+connections and drains the in-flight requests, SSE streams included, for up to
+SERVE_GRACEFUL_TIMEOUT seconds.
+
+State that must be shared between workers lives outside the process: chat memory and
+sessions in Postgres (SESSION_STORE=postgres for src/server.py) and the index generation
+in STORAGE_DIR. Request coalescing and admission limits apply per worker.
+"""
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# A worker exiting sooner than this after starting counts as a failed start; failed starts
+# in a row are retried with exponential backoff, and the server gives up after
+# MAX_FAILED_STARTS of them (missing index, bad environment...)
+MIN_WORKER_UPTIME = 5.0
+MAX_FAILED_STARTS = 5
+MAX_RESTART_DELAY = 30.0
+
+
+def preload(app_path: str) -> None:
+    """Import the app and build the read-only state the workers can share."""
+    from llama_index.core.utils import get_tokenizer
+    from uvicorn.importer import import_from_string
+
+    from src.settings import init_settings
+
+    init_settings()
+    get_tokenizer()
+    import_from_string(app_path)
+
+
+def create_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app_path: str, sock: socket.socket, graceful_timeout: int) -> None:
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(
+        app_path,
+        log_level="info",
+        timeout_graceful_shutdown=graceful_timeout,
+    )
+    # uvicorn installs its own SIGTERM/SIGINT handlers and drains on exit
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Fork the workers, restart the ones that die and stop them all on shutdown."""
+
+    def __init__(
+        self, app_path: str, sock: socket.socket, workers: int, graceful_timeout: int
+    ) -> None:
+        self.app_path = app_path
+        self.sock = sock
+        self.num_workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+        self.failed_starts = 0
+        self.exit_code = 0
+        # Times at which the workers that exited are restarted
+        self.restarts: List[float] = []
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.app_path, self.sock, self.graceful_timeout)
+            finally:
+                os._exit(0)
+        self.workers[pid] = time.monotonic()
+        logger.info(f"Started worker {pid}")
+
+    def stop(self, signum: int, frame) -> None:
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info(f"Draining {len(self.workers)} workers...")
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def worker_exited(self, pid: int, status: int, started: float) -> None:
+        if time.monotonic() - started >= MIN_WORKER_UPTIME:
+            self.failed_starts = 0
+            logger.warning(f"Worker {pid} exited with status {status}, restarting")
+            self.restarts.append(time.monotonic())
+            return
+        self.failed_starts += 1
+        if self.failed_starts >= MAX_FAILED_STARTS:
+            logger.error(
+                f"{self.failed_starts} workers in a row exited right after starting, giving up"
+            )
+            self.exit_code = 1
+            self.stop(signal.SIGTERM, None)
+            return
+        delay = min(2 ** (self.failed_starts - 1), MAX_RESTART_DELAY)
+        logger.warning(
+            f"Worker {pid} exited with status {status} right after starting, "
+            f"restarting in {delay:.0f}s"
+        )
+        self.restarts.append(time.monotonic() + delay)
+
+    def run(self) -> int:
+        """Supervise the workers until they all stopped; returns the exit code."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.num_workers):
+            self.spawn()
+
+        deadline = None
+        while self.workers or (self.restarts and not self.stopping):
+            now = time.monotonic()
+            for due in [t for t in self.restarts if t <= now]:
+                self.restarts.remove(due)
+                if not self.stopping:
+                    self.spawn()
+            if self.stopping and deadline is None:
+                deadline = time.monotonic() + self.graceful_timeout + 5
+            if deadline is not None and time.monotonic() > deadline:
+                for pid in self.workers:
+                    logger.warning(f"Killing worker {pid} after the drain timeout")
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+
+            pid, status = os.waitpid(-1, os.WNOHANG) if self.workers else (0, 0)
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            started = self.workers.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            self.worker_exited(pid, status, started)
+        logger.info("All workers stopped")
+        return self.exit_code
+
+
+def main():
+    """Serve the API with SERVE_WORKERS processes"""
+    load_dotenv()
+    app_path = os.getenv("SERVE_APP", "src.dev:app")
+    host = os.getenv("SERVE_HOST", "0.0.0.0")
+    port = int(os.getenv("SERVE_PORT", 8000))
+    workers = int(os.getenv("SERVE_WORKERS") or os.cpu_count() or 1)
+    graceful_timeout = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", 30))
+
+    if workers > 1 and app_path.startswith("src.server") and (
+        os.getenv("SESSION_STORE", "memory") == "memory"
+    ):
+        logger.warning(
+            "SESSION_STORE=memory keeps a separate session history in each worker"
+        )
+
+    # Without preloading, workers start in seconds and load the app in the background
+    if os.getenv("SERVE_PRELOAD", "true").lower() == "true":
+        preload(app_path)
+    else:
+        app_path = "src.asgi:app"
+    sock = create_socket(host, port)
+    logger.info(f"Serving {app_path} on http://{host}:{port} with {workers} workers")
+    sys.exit(Supervisor(app_path, sock, workers, graceful_timeout).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,19 +3,29 @@ FastAPI server for the RAG workflow.
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional
+import asyncio
 import logging
+import os
 from contextlib import asynccontextmanager
 
-from src.workflow import workflow
+from src.metrics import REGISTRY, RequestTimingMiddleware
+from src.sessions import create_session_store
+from src.tracing import TracingMiddleware, get_recorder
+from src.warmup import warmup
+from src.workflow import create_workflow
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Store for sessions (in-memory for development)
-sessions: Dict[str, List[Dict[str, str]]] = {}
+# Chat history per session, bounded (SESSION_STORE=memory) or in Postgres
+sessions = create_session_store()
+
+# Store the workflow instance
+workflow = None
 
 
 class ChatMessage(BaseModel):
@@ -37,8 +47,12 @@ class ChatResponse(BaseModel):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler."""
+    global workflow
     logger.info("Starting RAG Workflow Server...")
+    workflow = await asyncio.to_thread(create_workflow)
     logger.info("Workflow loaded successfully")
+    if os.getenv("STARTUP_WARMUP", "true").lower() == "true":
+        await warmup(workflow)
     yield
     logger.info("Shutting down server...")
 
@@ -58,6 +72,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestTimingMiddleware, paths=["/chat"])
+app.add_middleware(TracingMiddleware, paths=["/chat"])
 
 
 @app.get("/")
@@ -80,6 +96,25 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency histograms and counters in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/traces")
+async def debug_traces(limit: int = 10):
+    """Slowest recent sampled requests, with the time spent in each stage."""
+    recorder = get_recorder()
+    return {"sample_rate": recorder.sample_rate, "traces": recorder.slowest(limit)}
+
+
+@app.get("/ready")
+async def readiness():
+    """Readiness check: the lifespan only completes once the workflow is warmed up."""
+    return {"status": "ready"}
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -94,15 +129,8 @@ async def chat(request: ChatRequest):
     try:
         session_id = request.session_id or "default"
         
-        # Get or create session history
-        if session_id not in sessions:
-            sessions[session_id] = []
-        
         # Add user message to history
-        sessions[session_id].append({
-            "role": "user",
-            "content": request.message
-        })
+        await sessions.append(session_id, "user", request.message)
         
         # Run the workflow
         logger.info(f"Processing message for session {session_id}: {request.message[:50]}...")
@@ -113,10 +141,7 @@ async def chat(request: ChatRequest):
         response_text = str(result)
         
         # Add assistant response to history
-        sessions[session_id].append({
-            "role": "assistant",
-            "content": response_text
-        })
+        await sessions.append(session_id, "assistant", response_text)
         
         logger.info(f"✓ Response generated for session {session_id}")
         
@@ -133,20 +158,16 @@ async def chat(request: ChatRequest):
 @app.get("/sessions/{session_id}/history")
 async def get_session_history(session_id: str):
     """Get chat history for a session."""
-    if session_id not in sessions:
-        return {"session_id": session_id, "history": []}
-    
     return {
         "session_id": session_id,
-        "history": sessions[session_id]
+        "history": await sessions.get_history(session_id)
     }
 
 
 @app.delete("/sessions/{session_id}")
 async def clear_session(session_id: str):
     """Clear chat history for a session."""
-    if session_id in sessions:
-        del sessions[session_id]
+    await sessions.clear(session_id)
     
     return {"message": f"Session {session_id} cleared"}
 
@@ -154,9 +175,11 @@ async def clear_session(session_id: str):
 @app.get("/sessions")
 async def list_sessions():
     """List all active sessions."""
+    session_ids = await sessions.list_sessions()
     return {
-        "sessions": list(sessions.keys()),
-        "count": len(sessions)
+        "sessions": session_ids,
+        "count": len(session_ids),
+        **sessions.stats()
     }
 
 
@@ -1,25 +1,85 @@
 import os
+from typing import Any, Dict
 
 from llama_index.core import Settings
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
-from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.callbacks import CallbackManager, LlamaDebugHandler
+from llama_index.core.instrumentation import get_dispatcher
+
+from src.admission import LimitedLLM
+from src.batching import BatchingEmbedding
+from src.chunking import CHUNK_OVERLAP, CHUNK_SIZE, get_node_parser
+from src.http_client import get_http_clients
+from src.llm_cache import cached_llm_from_env
+from src.metrics import LLMMetricsEventHandler, MetricsCallbackHandler
+from src.tracing import SampledTraceHandler
+
+_initialized = False
+
 
 def init_settings():
+    """
+    Configure the global llama_index Settings once per process.
+
+    Later calls return right away, so the workers forked by src.serve reuse the
+    settings (and the unopened HTTP clients) built by the preloading parent.
+    """
+    global _initialized
+    if _initialized:
+        return
     if os.getenv("OPENAI_API_KEY") is None:
         raise RuntimeError("OPENAI_API_KEY is missing in environment variables")
-    Settings.llm = OpenAI(model=os.getenv("MODEL") or "gpt-4o-mini")
+    # One keep-alive pool for the LLM and the embeddings; it retries with jittered
+    # backoff itself, so the SDK retries are turned off
+    client_kwargs: Dict[str, Any] = {}
+    if os.getenv("HTTP_SHARED_CLIENT", "true").lower() == "true":
+        http_client, async_http_client = get_http_clients()
+        client_kwargs = {
+            "http_client": http_client,
+            "async_http_client": async_http_client,
+            "max_retries": 0,
+        }
+    Settings.llm = OpenAI(
+        model=os.getenv("MODEL") or "gpt-4o-mini",
+        # Streamed responses only carry token usage (for the metrics) when asked for;
+        # the option is dropped from non-streamed requests
+        additional_kwargs={"stream_options": {"include_usage": True}},
+        **client_kwargs,
+    )
+    # Every async call (agent turns, syntheses of parallel tool calls) takes one of the
+    # MAX_CONCURRENT_LLM slots of the process
+    Settings.llm = LimitedLLM(Settings.llm)
+    # Replays identical prompts from disk when LLM_CACHE=true (benchmarks, evaluations)
+    Settings.llm = cached_llm_from_env(Settings.llm)
     
     embedding_dim = int(os.getenv("EMBEDDING_DIM") or "512")
     Settings.embed_model = OpenAIEmbedding(
         model=os.getenv("EMBEDDING_MODEL") or "text-embedding-3-small",
-        dimensions=embedding_dim
+        dimensions=embedding_dim,
+        **client_kwargs,
     )
+    # Concurrent query embeddings (e.g. parallel tool calls) share one request
+    batch_wait_ms = float(os.getenv("EMBED_BATCH_WAIT_MS") or "5")
+    if batch_wait_ms > 0:
+        Settings.embed_model = BatchingEmbedding(
+            Settings.embed_model, max_wait_ms=batch_wait_ms
+        )
 
-    Settings.chunk_size = embedding_dim
-    Settings.chunk_overlap = 20
-    Settings.node_parser = SentenceSplitter()
+    # Chunk length is a retrieval setting, not tied to the vector width
+    Settings.chunk_size = CHUNK_SIZE
+    Settings.chunk_overlap = CHUNK_OVERLAP
+    Settings.node_parser = get_node_parser()
 
     #observability
-    Settings.callback_manager = CallbackManager([LlamaDebugHandler()])
\ No newline at end of file
+    # Sampled traces in a bounded buffer; the debug handler keeps every event forever
+    handlers = [MetricsCallbackHandler(), SampledTraceHandler()]
+    if os.getenv("DEBUG", "false").lower() == "true":
+        handlers.append(LlamaDebugHandler())
+    Settings.callback_manager = CallbackManager(handlers)
+    # LLM latency and time to first token come from instrumentation events,
+    # callbacks are not emitted per streamed chunk
+    dispatcher = get_dispatcher()
+    if not any(isinstance(h, LLMMetricsEventHandler) for h in dispatcher.event_handlers):
+        dispatcher.add_event_handler(LLMMetricsEventHandler())
+    _initialized = True
\ No newline at end of file
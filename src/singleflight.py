@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from llama_index.core.base.llms.types import ChatMessage
+
+from src.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(
+    message: str,
+    generation: int,
+    history: Optional[Sequence[ChatMessage]] = None,
+    history_turns: int = 6,
+) -> str:
+    """
+    Build the coalescing key of a chat request.
+
+    Args:
+        message: The user message, normalized (NFKC, lower case, collapsed whitespace).
+        generation: The index generation, so answers from an older index are never shared.
+        history: The session memory. Only the last `history_turns` messages are hashed,
+            and only when there are any, so first questions of different sessions coalesce.
+    """
+    normalized = unicodedata.normalize("NFKC", message).lower()
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    parts = [normalized, str(generation)]
+    if history:
+        recent = [(str(m.role), m.content or "") for m in history[-history_turns:]]
+        parts.append(json.dumps(recent, ensure_ascii=False))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class _Broadcast:
+    """Items of one upstream stream, replayed to every subscriber."""
+
+    def __init__(self) -> None:
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, item: Any) -> None:
+        self.items.append(item)
+        self._notify()
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        position = 0
+        while True:
+            while position < len(self.items):
+                yield self.items[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Share one in-flight execution between concurrent identical requests.
+
+    Only requests that overlap in time are coalesced: the key is forgotten as soon as
+    the execution finishes, so nothing is cached.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, "asyncio.Future[Any]"] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._tasks: set = set()
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
+
+    async def do(
+        self, key: str, fn: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """
+        Run `fn` once per key at a time.
+
+        Returns:
+            The result and whether it was shared with an earlier request.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            CACHE_REQUESTS.inc(cache="singleflight", result="hit")
+            logger.info(f"Coalesced request {key[:12]} (total {self.coalesced})")
+            # Shield so a disconnecting client does not cancel the shared run
+            return await asyncio.shield(task), True
+
+        CACHE_REQUESTS.inc(cache="singleflight", result="miss")
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task), False
+
+    def is_streaming(self, key: str) -> bool:
+        return key in self._streams
+
+    def stream(
+        self, key: str, factory: Callable[[], AsyncIterator[Any]]
+    ) -> Tuple[AsyncIterator[Any], bool]:
+        """
+        Subscribe to the upstream stream of `key`, starting it if needed.
+
+        The upstream runs in its own task, so it keeps going for the other
+        subscribers when one of them disconnects.
+
+        Returns:
+            An iterator over all items of the stream (including those published
+            before subscribing) and whether the stream is shared.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is not None:
+            self.coalesced += 1
+            CACHE_REQUESTS.inc(cache="singleflight", result="hit")
+            logger.info(f"Coalesced stream {key[:12]} (total {self.coalesced})")
+            return broadcast.subscribe(), True
+
+        CACHE_REQUESTS.inc(cache="singleflight", result="miss")
+        broadcast = _Broadcast()
+        self._streams[key] = broadcast
+
+        async def pump() -> None:
+            try:
+                async for item in factory():
+                    broadcast.publish(item)
+            except asyncio.CancelledError:
+                # E.g. on shutdown: the subscribers must not wait for items forever,
+                # and a CancelledError raised in them would look like their own cancellation
+                broadcast.close(RuntimeError("The shared stream was cancelled"))
+                raise
+            except Exception as e:
+                broadcast.close(e)
+            else:
+                broadcast.close()
+            finally:
+                self._streams.pop(key, None)
+
+        task = asyncio.create_task(pump())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return broadcast.subscribe(), False
@@ -0,0 +1,369 @@
+"""
+Portable copy of the index: `uv run generate export <dir>` and `uv run generate import <dir>`.
+
+A snapshot holds the rows of the vector store table and the docstore, so another
+environment (or a test database) is bootstrapped without embedding the corpus again:
+
+    manifest.json   embedding model and dimension, row count, formats
+    rows.parquet    text, metadata (JSON) and node_id of each row, in table order
+                    (rows.jsonl when pyarrow is not installed)
+    vectors.npy     embeddings, one row per table row (float32, or float16 with --float16),
+                    readable with numpy.load(..., mmap_mode="r")
+    docstore.json   document hashes of STORAGE_DIR, so the next ingestion only embeds
+                    the files that changed
+
+Import refuses a snapshot made with another EMBEDDING_MODEL or EMBEDDING_DIM, replaces
+the rows of the table with COPY (secondary indexes dropped during the load and rebuilt
+afterwards, in one transaction) and bumps the index generation.
+"""
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Iterator, List, Optional, TextIO, Tuple
+
+import numpy as np
+import sqlalchemy
+from dotenv import load_dotenv
+
+from src.checkpoint import IngestionCheckpoint
+from src.index import bump_index_generation
+from src.vectordb import get_vector_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+DOCSTORE_FILE = "docstore.json"
+# Rows read from the table, or sent in one COPY, at a time
+SNAPSHOT_BATCH_ROWS = int(os.getenv("SNAPSHOT_BATCH_ROWS", 5000))
+# Memory for rebuilding the indexes after an import, e.g. 2GB (empty: server default);
+# an HNSW graph that fits in it is built much faster
+SNAPSHOT_MAINTENANCE_WORK_MEM = os.getenv("SNAPSHOT_MAINTENANCE_WORK_MEM", "")
+
+# Escapes of the COPY text format
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
+
+def _embedding_config() -> Tuple[str, int]:
+    """Embedding model and dimension of this environment, as in init_settings."""
+    model = os.getenv("EMBEDDING_MODEL") or "text-embedding-3-small"
+    return model, int(os.getenv("EMBEDDING_DIM") or "512")
+
+
+def _storage_dir() -> str:
+    return os.getenv("STORAGE_DIR", "storage")
+
+
+def _table_name(vector_store) -> str:
+    return f"{vector_store.schema_name}.{vector_store._table_class.__tablename__}"
+
+
+class _RowWriter:
+    """Rows file of a snapshot: Parquet when pyarrow is installed, JSON lines otherwise."""
+
+    def __init__(self, directory: str) -> None:
+        # Exactly one of the two is open; pyarrow is optional, so its writer is untyped
+        self._parquet: Any = None
+        self._jsonl: Optional[TextIO] = None
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            logger.warning(
+                "Writing the snapshot rows as JSON lines, Parquet needs the pyarrow "
+                "package (pip install pyarrow)"
+            )
+            self.format = "jsonl"
+            self.file_name = "rows.jsonl"
+            self._jsonl = open(os.path.join(directory, self.file_name), "w", encoding="utf-8")
+        else:
+            self.format = "parquet"
+            self.file_name = "rows.parquet"
+            self._pa = pa
+            self._schema = pa.schema(
+                [("text", pa.string()), ("metadata", pa.string()), ("node_id", pa.string())]
+            )
+            self._parquet = pq.ParquetWriter(
+                os.path.join(directory, self.file_name), self._schema, compression="zstd"
+            )
+
+    def write(self, texts: List[str], metadata: List[str], node_ids: List[str]) -> None:
+        if self._parquet is not None:
+            self._parquet.write_table(
+                self._pa.Table.from_pydict(
+                    {"text": texts, "metadata": metadata, "node_id": node_ids},
+                    schema=self._schema,
+                )
+            )
+        elif self._jsonl is not None:
+            for row in zip(texts, metadata, node_ids):
+                self._jsonl.write(
+                    json.dumps(
+                        dict(zip(("text", "metadata", "node_id"), row)), ensure_ascii=False
+                    )
+                )
+                self._jsonl.write("\n")
+
+    def close(self) -> None:
+        if self._parquet is not None:
+            self._parquet.close()
+        if self._jsonl is not None:
+            self._jsonl.close()
+
+
+def _read_rows(directory: str, manifest: dict) -> Iterator[Tuple[List, List, List]]:
+    """Batches of (texts, metadata, node_ids) of a snapshot, in table order."""
+    path = os.path.join(directory, manifest["rows_file"])
+    if manifest["rows_format"] == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError(
+                "The snapshot rows are in Parquet, reading them needs the pyarrow "
+                "package (pip install pyarrow)"
+            )
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=SNAPSHOT_BATCH_ROWS):
+            columns = batch.to_pydict()
+            yield columns["text"], columns["metadata"], columns["node_id"]
+        return
+    with open(path, encoding="utf-8") as f:
+        while True:
+            lines = list(itertools.islice(f, SNAPSHOT_BATCH_ROWS))
+            if not lines:
+                return
+            rows = [json.loads(line) for line in lines]
+            yield (
+                [row["text"] for row in rows],
+                [row["metadata"] for row in rows],
+                [row["node_id"] for row in rows],
+            )
+
+
+def export_snapshot(directory: str, float16: bool = False) -> dict:
+    """
+    Write the rows of the vector store table and the docstore to a new snapshot.
+
+    The table is read in one repeatable-read transaction, so the snapshot is consistent
+    while an ingestion writes to it. The snapshot is written next to `directory` and
+    renamed once complete.
+
+    Args:
+        directory: Snapshot directory, must not exist yet.
+        float16: Store the embeddings in half precision (half the size; cosine scores
+            change in the fourth decimal).
+
+    Returns:
+        The manifest of the snapshot.
+    """
+    if os.path.exists(directory):
+        raise FileExistsError(f"Snapshot directory {directory} already exists")
+    partial = f"{directory.rstrip(os.sep)}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    vector_store = get_vector_store()
+    vector_store._initialize()
+    table = vector_store._table_class.__table__
+    embedding_model, embedding_dim = _embedding_config()
+    dtype = np.float16 if float16 else np.float32
+    start = time.perf_counter()
+
+    engine = vector_store._engine.execution_options(isolation_level="REPEATABLE READ")
+    with engine.connect() as connection:
+        rows = connection.execute(
+            sqlalchemy.select(sqlalchemy.func.count()).select_from(table)
+        ).scalar_one()
+        vectors = np.lib.format.open_memmap(
+            os.path.join(partial, VECTORS_FILE),
+            mode="w+",
+            dtype=dtype,
+            shape=(rows, embedding_dim),
+        )
+        writer = _RowWriter(partial)
+        # Metadata stays the JSON text of the table, it is not decoded and encoded again
+        query = sqlalchemy.select(
+            table.c.text,
+            sqlalchemy.cast(table.c.metadata_, sqlalchemy.Text),
+            table.c.node_id,
+            table.c.embedding,
+        ).order_by(table.c.id)
+        result = connection.execution_options(
+            stream_results=True, yield_per=SNAPSHOT_BATCH_ROWS
+        ).execute(query)
+        offset = 0
+        try:
+            for batch in result.partitions():
+                texts, metadata, node_ids, embeddings = zip(*batch)
+                vectors[offset : offset + len(batch)] = np.asarray(embeddings, dtype=dtype)
+                writer.write(list(texts), list(metadata), list(node_ids))
+                offset += len(batch)
+        finally:
+            writer.close()
+        vectors.flush()
+        del vectors
+
+    docstore_path = os.path.join(_storage_dir(), DOCSTORE_FILE)
+    if os.path.exists(docstore_path):
+        shutil.copyfile(docstore_path, os.path.join(partial, DOCSTORE_FILE))
+    else:
+        logger.warning(f"No {docstore_path}, the snapshot has no docstore")
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "table": vector_store.table_name,
+        "embedding_model": embedding_model,
+        "embedding_dim": embedding_dim,
+        "rows": rows,
+        "rows_format": writer.format,
+        "rows_file": writer.file_name,
+        "vector_dtype": np.dtype(dtype).name,
+        "docstore": os.path.exists(os.path.join(partial, DOCSTORE_FILE)),
+    }
+    with open(os.path.join(partial, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(partial, directory)
+    logger.info(
+        f"Exported {rows} rows of {_table_name(vector_store)} to {directory} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    return manifest
+
+
+def load_manifest(directory: str) -> dict:
+    """
+    Manifest of a snapshot, checked against the embedding configuration.
+
+    Raises:
+        ValueError: The snapshot was made with another embedding model or dimension,
+            or its files do not match the manifest.
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest.get('version')}")
+    embedding_model, embedding_dim = _embedding_config()
+    if (manifest["embedding_model"], manifest["embedding_dim"]) != (embedding_model, embedding_dim):
+        raise ValueError(
+            f"Snapshot embeddings are {manifest['embedding_model']} with "
+            f"{manifest['embedding_dim']} dimensions, this environment uses "
+            f"{embedding_model} with {embedding_dim} (EMBEDDING_MODEL, EMBEDDING_DIM)"
+        )
+    vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+    if vectors.shape != (manifest["rows"], embedding_dim):
+        raise ValueError(
+            f"Snapshot vectors have shape {vectors.shape}, the manifest expects "
+            f"({manifest['rows']}, {embedding_dim})"
+        )
+    return manifest
+
+
+def _copy_lines(
+    texts: List[str],
+    metadata: List[Optional[str]],
+    node_ids: List[Optional[str]],
+    vectors: np.ndarray,
+) -> io.StringIO:
+    """Rows in the COPY text format, embeddings as pgvector literals."""
+    buffer = io.StringIO()
+    for text, meta, node_id, vector in zip(texts, metadata, node_ids, vectors.tolist()):
+        buffer.write(text.translate(_COPY_ESCAPES))
+        buffer.write("\t")
+        buffer.write("\\N" if meta is None else meta.translate(_COPY_ESCAPES))
+        buffer.write("\t")
+        buffer.write("\\N" if node_id is None else node_id.translate(_COPY_ESCAPES))
+        buffer.write("\t[")
+        buffer.write(",".join(map(repr, vector)))
+        buffer.write("]\n")
+    buffer.seek(0)
+    return buffer
+
+
+def import_snapshot(directory: str) -> int:
+    """
+    Replace the rows of the vector store table and the docstore with a snapshot.
+
+    The rows are loaded with COPY into the emptied table after dropping its secondary
+    indexes (HNSW, BM25, metadata), which are then rebuilt from their own definitions
+    once. Everything happens in one transaction: a failed import leaves the table as
+    it was. No ingestion may run meanwhile.
+
+    Args:
+        directory: Snapshot written by `export_snapshot`.
+
+    Returns:
+        The imported rows.
+    """
+    manifest = load_manifest(directory)
+    vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+    start = time.perf_counter()
+
+    vector_store = get_vector_store()
+    # Creates the schema, the extensions, the table and its indexes if missing
+    vector_store._initialize()
+    table_fq = _table_name(vector_store)
+
+    with vector_store._engine.begin() as connection:
+        indexes = connection.execute(
+            sqlalchemy.text(
+                """
+                SELECT i.relname, pg_get_indexdef(i.oid)
+                FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = CAST(:table AS regclass) AND NOT x.indisprimary
+                """
+            ),
+            {"table": table_fq},
+        ).all()
+        connection.execute(sqlalchemy.text(f"TRUNCATE {table_fq} RESTART IDENTITY"))
+        for name, _ in indexes:
+            connection.execute(
+                sqlalchemy.text(f'DROP INDEX {vector_store.schema_name}."{name}"')
+            )
+
+        cursor = connection.connection.cursor()
+        copy = f"COPY {table_fq} (text, metadata_, node_id, embedding) FROM STDIN"
+        offset = 0
+        for texts, metadata, node_ids in _read_rows(directory, manifest):
+            batch = vectors[offset : offset + len(texts)].astype(np.float32)
+            cursor.copy_expert(copy, _copy_lines(texts, metadata, node_ids, batch))
+            offset += len(texts)
+        if offset != manifest["rows"]:
+            raise ValueError(f"Snapshot has {offset} rows, the manifest expects {manifest['rows']}")
+        logger.info(f"Copied {offset} rows in {time.perf_counter() - start:.1f}s")
+
+        if SNAPSHOT_MAINTENANCE_WORK_MEM:
+            connection.execute(
+                sqlalchemy.text("SELECT set_config('maintenance_work_mem', :value, true)"),
+                {"value": SNAPSHOT_MAINTENANCE_WORK_MEM},
+            )
+        for name, definition in indexes:
+            index_start = time.perf_counter()
+            connection.execute(sqlalchemy.text(definition))
+            logger.info(f"Rebuilt index {name} in {time.perf_counter() - index_start:.1f}s")
+        connection.execute(sqlalchemy.text(f"ANALYZE {table_fq}"))
+
+    storage_dir = _storage_dir()
+    os.makedirs(storage_dir, exist_ok=True)
+    docstore_path = os.path.join(storage_dir, DOCSTORE_FILE)
+    if manifest["docstore"]:
+        # Write then rename, so readers never see a half-written docstore
+        shutil.copyfile(os.path.join(directory, DOCSTORE_FILE), f"{docstore_path}.tmp")
+        os.replace(f"{docstore_path}.tmp", docstore_path)
+    elif os.path.exists(docstore_path):
+        # Hashes of documents that are not in the table any more
+        os.remove(docstore_path)
+    # The checkpoint of an interrupted ingestion refers to the replaced rows
+    IngestionCheckpoint.load(storage_dir).clear()
+    generation = bump_index_generation()
+    logger.info(
+        f"Imported {offset} rows into {table_fq} in {time.perf_counter() - start:.1f}s "
+        f"(generation {generation})"
+    )
+    return offset
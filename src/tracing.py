@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType
+
+logger = logging.getLogger(__name__)
+
+# Trace of the request being served, None when the request was not sampled
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+@dataclass
+class Span:
+    stage: str
+    start: float
+    duration: float
+    parent_id: str = ""
+
+
+@dataclass
+class Trace:
+    name: str
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started_at: float = field(default_factory=time.time)
+    duration: float = 0.0
+    spans: List[Span] = field(default_factory=list)
+    _start: float = field(default_factory=time.perf_counter)
+    _open: Dict[str, Tuple[str, float, str]] = field(default_factory=dict)
+
+    def stages(self) -> Dict[str, float]:
+        """Seconds spent in each kind of event. Nested events are counted in both stages."""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.stage] = totals.get(span.stage, 0.0) + span.duration
+        return {stage: round(total, 4) for stage, total in totals.items()}
+
+    def summary(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": round(self.duration, 4),
+            "stages": self.stages(),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            **self.summary(),
+            "spans": [
+                {
+                    "stage": s.stage,
+                    "start": round(s.start, 4),
+                    "duration": round(s.duration, 4),
+                    "parent_id": s.parent_id,
+                }
+                for s in self.spans
+            ],
+        }
+
+
+class TraceRecorder:
+    """
+    Keep the last `buffer_size` sampled traces in memory.
+
+    Sampling is decided once per request (head-based), so unsampled requests only
+    pay for a context variable lookup per callback event.
+
+    Args:
+        sample_rate: Fraction of requests that are traced.
+        buffer_size: Number of finished traces kept for `/debug/traces`.
+        export_path: JSONL file receiving every finished trace, rotated at
+            `export_max_bytes` keeping `export_backups` old files. None disables export.
+            Traces are written by a background thread, never on the event loop;
+            when `export_queue_size` traces are waiting, new ones are not exported.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.1,
+        buffer_size: int = 200,
+        export_path: Optional[str] = None,
+        export_max_bytes: int = 10 * 1024 * 1024,
+        export_backups: int = 3,
+        export_queue_size: int = 1000,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.export_path = export_path
+        self.export_max_bytes = export_max_bytes
+        self.export_backups = export_backups
+        self._traces: Deque[Trace] = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._export_queue: "queue.Queue[Trace]" = queue.Queue(maxsize=export_queue_size)
+        self._exporter: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "TraceRecorder":
+        export_path = None
+        if os.getenv("TRACE_EXPORT", "false").lower() == "true":
+            export_path = os.path.join(os.getenv("STORAGE_DIR", "storage"), "traces.jsonl")
+        return cls(
+            sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 0.1)),
+            buffer_size=int(os.getenv("TRACE_BUFFER_SIZE", 200)),
+            export_path=export_path,
+            export_max_bytes=int(os.getenv("TRACE_EXPORT_MAX_MB", 10)) * 1024 * 1024,
+        )
+
+    def start(self, name: str) -> Optional[Trace]:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        trace = Trace(name=name)
+        _current_trace.set(trace)
+        return trace
+
+    def finish(self, trace: Trace) -> None:
+        trace.duration = time.perf_counter() - trace._start
+        trace._open.clear()
+        with self._lock:
+            self._traces.append(trace)
+            if self.export_path is None:
+                return
+            if self._exporter is None:
+                self._exporter = threading.Thread(
+                    target=self._export_loop, name="trace-export", daemon=True
+                )
+                self._exporter.start()
+        try:
+            self._export_queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning(f"Trace export is behind, trace {trace.trace_id} not exported")
+
+    def _export_loop(self) -> None:
+        while True:
+            trace = self._export_queue.get()
+            try:
+                self._export(trace)
+            except OSError as e:
+                logger.warning(f"Could not export trace {trace.trace_id}: {e}")
+            finally:
+                self._export_queue.task_done()
+
+    def _export(self, trace: Trace) -> None:
+        os.makedirs(os.path.dirname(self.export_path) or ".", exist_ok=True)
+        if (
+            os.path.exists(self.export_path)
+            and os.path.getsize(self.export_path) >= self.export_max_bytes
+        ):
+            for i in range(self.export_backups - 1, 0, -1):
+                older = f"{self.export_path}.{i}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.export_path}.{i + 1}")
+            os.replace(self.export_path, f"{self.export_path}.1")
+        with open(self.export_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+
+    def slowest(self, limit: int = 10) -> List[dict]:
+        with self._lock:
+            traces = list(self._traces)
+        traces.sort(key=lambda t: t.duration, reverse=True)
+        return [t.summary() for t in traces[:limit]]
+
+
+class SampledTraceHandler(BaseCallbackHandler):
+    """Record callback events into the trace of the current request, if it is sampled."""
+
+    def __init__(self) -> None:
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace._open[event_id] = (event_type.value, time.perf_counter(), parent_id)
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        started = trace._open.pop(event_id, None)
+        if started is None:
+            return
+        stage, start, parent_id = started
+        trace.spans.append(
+            Span(
+                stage=stage,
+                start=start - trace._start,
+                duration=time.perf_counter() - start,
+                parent_id=parent_id,
+            )
+        )
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        pass
+
+
+_recorder: Optional[TraceRecorder] = None
+
+
+def get_recorder() -> TraceRecorder:
+    global _recorder
+    if _recorder is None:
+        _recorder = TraceRecorder.from_env()
+    return _recorder
+
+
+class TracingMiddleware:
+    """ASGI middleware deciding per request whether it is traced."""
+
+    def __init__(self, app: Any, paths: Sequence[str]) -> None:
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        recorder = get_recorder()
+        trace = recorder.start(path)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if trace is not None:
+                _current_trace.set(None)
+                recorder.finish(trace)
@@ -0,0 +1,116 @@
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from llama_index.core.readers.base import BaseReader
+from llama_index.core.schema import Document
+from llama_index.core.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+# Row numbers are kept for filtering and ordering, the LLM sees `row_range`
+ROW_KEYS = ["row_start", "row_end"]
+
+
+class RowBlockExcelReader(BaseReader):
+    """
+    Read each sheet of a spreadsheet as blocks of rows that fit in one chunk.
+
+    Every block starts with the header line, followed by one line per row with the
+    values separated by `field_separator`, so a chunk can be read without the rest of
+    the sheet. Rows are formatted column by column with pandas and cut into blocks
+    from the cumulative token count, instead of one document per row. Each document
+    carries the `sheet_name` and the spreadsheet rows it holds (`row_start`, `row_end`
+    and `row_range`, e.g. "2-57").
+
+    Args:
+        block_tokens: Token budget of a block, header and metadata included
+            (0 keeps one document per row), defaults to the chunk size.
+        field_separator: Separator of the values of a row.
+    """
+
+    def __init__(self, block_tokens: Optional[int] = None, field_separator: str = "; ") -> None:
+        self.block_tokens = block_tokens
+        self.field_separator = field_separator
+
+    @classmethod
+    def from_env(cls) -> "RowBlockExcelReader":
+        block_tokens = os.getenv("EXCEL_BLOCK_TOKENS")
+        return cls(block_tokens=int(block_tokens) if block_tokens else None)
+
+    def _format_rows(self, df: pd.DataFrame) -> pd.Series:
+        values = df.fillna("").astype(str)
+        rows = values.iloc[:, 0]
+        for column in values.columns[1:]:
+            rows = rows + self.field_separator + values[column]
+        # Blank rows are skipped, the index keeps the position of the others
+        return rows[(values != "").any(axis=1)]
+
+    def _iter_blocks(
+        self, sheet_name: str, df: pd.DataFrame, extra_info: Dict
+    ) -> Iterator[Document]:
+        if df.empty:
+            return
+        header = self.field_separator.join(str(column) for column in df.columns)
+        rows = self._format_rows(df)
+        if rows.empty:
+            return
+        # Data starts on the second row of the sheet, below the header
+        row_numbers = rows.index.to_numpy() + 2
+        lines = rows.tolist()
+
+        budget = self.block_tokens if self.block_tokens is not None else Settings.chunk_size
+        if budget:
+            tokenizer = Settings.tokenizer
+            # Room for the header and the metadata the splitter adds to each chunk
+            last_row = row_numbers[-1]
+            metadata = {**extra_info, "sheet_name": sheet_name, "row_range": f"{last_row}-{last_row}"}
+            metadata_str = "\n".join(f"{key}: {value}" for key, value in metadata.items())
+            budget -= len(tokenizer(header)) + len(tokenizer(metadata_str)) + 1
+            counts = np.fromiter((len(tokenizer(line)) + 1 for line in lines), dtype=np.int64)
+            cumulative = np.concatenate(([0], np.cumsum(counts)))
+
+        start = 0
+        while start < len(lines):
+            if budget:
+                end = int(np.searchsorted(cumulative, cumulative[start] + budget, "right")) - 1
+                # A row longer than the budget is a block of its own
+                end = max(end, start + 1)
+            else:
+                end = start + 1
+            first, last = int(row_numbers[start]), int(row_numbers[end - 1])
+            yield Document(
+                text="\n".join([header, *lines[start:end]]),
+                metadata={
+                    **extra_info,
+                    "sheet_name": sheet_name,
+                    "row_start": first,
+                    "row_end": last,
+                    "row_range": str(first) if first == last else f"{first}-{last}",
+                },
+                excluded_embed_metadata_keys=list(ROW_KEYS),
+                excluded_llm_metadata_keys=list(ROW_KEYS),
+            )
+            start = end
+
+    def lazy_load_data(
+        self, file: Path, extra_info: Optional[Dict] = None, fs=None
+    ) -> Iterator[Document]:
+        # Cell values as they are, a blank cell does not turn the integers of its column
+        # into floats
+        if fs:
+            with fs.open(file) as f:
+                sheets = pd.read_excel(f, sheet_name=None, dtype=object)
+        else:
+            sheets = pd.read_excel(file, sheet_name=None, dtype=object)
+        for sheet_name, df in sheets.items():
+            yield from self._iter_blocks(str(sheet_name), df, extra_info or {})
+            logger.debug(f"Read {len(df)} rows from sheet {sheet_name} of {file}")
+
+    def load_data(
+        self, file: Path, extra_info: Optional[Dict] = None, fs=None
+    ) -> List[Document]:
+        return list(self.lazy_load_data(file, extra_info=extra_info, fs=fs))
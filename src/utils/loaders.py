@@ -1,8 +1,12 @@
 
 import logging
 import os
+from typing import Callable, Iterator, List, Optional
+
 from dotenv import load_dotenv
-from llama_index.readers.file import PDFReader, PandasExcelReader
+from llama_index.core.schema import Document
+from src.utils.excel import RowBlockExcelReader
+from src.utils.pdf import PagedPDFReader
 
 load_dotenv()
 
@@ -13,35 +17,67 @@ if DATA_DIR is None:
 
 logger = logging.getLogger(__name__)
 
-def get_file_documents():
+def get_file_reader():
     from llama_index.core.readers import SimpleDirectoryReader
 
-    try:
-        file_extractor = {
-            ".pdf": PDFReader(return_full_document = True),
-            ".xlsx": PandasExcelReader(concat_rows=False, field_separator="; "),
-            }
-        reader = SimpleDirectoryReader(
-            input_dir=DATA_DIR,
-            recursive=True,
-            filename_as_id=True,
-            raise_on_error=True,
-            file_extractor=file_extractor,
+    file_extractor = {
+        # Groups of pages with their page labels, extracted in parallel
+        ".pdf": PagedPDFReader.from_env(),
+        # Blocks of rows with the header, one chunk each
+        ".xlsx": RowBlockExcelReader.from_env(),
+        }
+    return SimpleDirectoryReader(
+        input_dir=DATA_DIR,
+        recursive=True,
+        filename_as_id=True,
+        raise_on_error=True,
+        file_extractor=file_extractor,
+    )
+
+
+def _is_empty_data_dir(e: Exception) -> bool:
+    import sys
+    import traceback
+
+    # Catch the error if the data dir is empty
+    # and return as empty document list
+    _, _, exc_traceback = sys.exc_info()
+    function_name = traceback.extract_tb(exc_traceback)[-1].name
+    if function_name == "_add_files":
+        logger.warning(
+            f"Failed to load file documents, error message: {e} . Return as empty document list."
         )
+        return True
+    return False
+
+
+def get_file_documents():
+    try:
+        reader = get_file_reader()
         return reader.load_data(show_progress=True)
     except Exception as e:
-        import sys
-        import traceback
-
-        # Catch the error if the data dir is empty
-        # and return as empty document list
-        _, _, exc_traceback = sys.exc_info()
-        function_name = traceback.extract_tb(exc_traceback)[-1].name
-        if function_name == "_add_files":
-            logger.warning(
-                f"Failed to load file documents, error message: {e} . Return as empty document list."
-            )
+        if _is_empty_data_dir(e):
             return []
-        else:
-            # Raise the error if it is not the case of empty data dir
-            raise e
\ No newline at end of file
+        # Raise the error if it is not the case of empty data dir
+        raise e
+
+
+def iter_file_documents(
+    skip: Optional[Callable[[str], bool]] = None,
+) -> Iterator[List[Document]]:
+    """
+    Read DATA_DIR one file at a time, yielding the documents of each file.
+    Only the file being read is held in memory.
+
+    Args:
+        skip: Called with each file path, files for which it returns True are not read.
+    """
+    try:
+        reader = get_file_reader()
+    except Exception as e:
+        if _is_empty_data_dir(e):
+            return
+        raise e
+    if skip is not None:
+        reader.input_files = [f for f in reader.input_files if not skip(str(f))]
+    yield from reader.iter_data(show_progress=True)
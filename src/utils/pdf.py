@@ -0,0 +1,118 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from llama_index.core.readers.base import BaseReader
+from llama_index.core.schema import Document
+from llama_index.core.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+def _extract_pages(path: str, start: int, end: int) -> List[Tuple[str, str]]:
+    """Text and label of pages [start, end) of a PDF, run in a worker process."""
+    import pypdf
+
+    reader = pypdf.PdfReader(path)
+    labels = reader.page_labels
+    return [(reader.pages[i].extract_text() or "", labels[i]) for i in range(start, end)]
+
+
+def _page_range(first: str, last: str) -> str:
+    return first if first == last else f"{first}-{last}"
+
+
+class PagedPDFReader(BaseReader):
+    """
+    Read a PDF as page-level documents, extracting large PDFs in parallel processes.
+
+    Consecutive pages are grouped into one document up to `group_tokens` tokens, so
+    short pages are not chunked on their own and long PDFs never become one huge
+    string. Each document carries the `page_label` of its first page and its
+    `page_range` (e.g. "3-5"), which citations can point to.
+
+    Args:
+        workers: Extraction processes for PDFs of at least `min_parallel_pages` pages.
+        pages_per_task: Pages extracted by one task.
+        group_tokens: Token budget of a group of pages (0 keeps one document per page),
+            defaults to the chunk size.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        min_parallel_pages: int = 32,
+        pages_per_task: int = 16,
+        group_tokens: Optional[int] = None,
+    ) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel_pages = min_parallel_pages
+        self.pages_per_task = pages_per_task
+        self.group_tokens = group_tokens
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "PagedPDFReader":
+        return cls(
+            workers=int(os.getenv("PDF_WORKERS") or 0) or None,
+            group_tokens=int(os.getenv("PDF_PAGE_GROUP_TOKENS") or 0) or None,
+        )
+
+    def _iter_pages(self, path: str) -> Iterator[Tuple[str, str]]:
+        import pypdf
+
+        num_pages = len(pypdf.PdfReader(path).pages)
+        if self.workers <= 1 or num_pages < self.min_parallel_pages:
+            yield from _extract_pages(path, 0, num_pages)
+            return
+        if self._executor is None:
+            # Kept for the next PDFs, so the processes start only once
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        starts = range(0, num_pages, self.pages_per_task)
+        ends = [min(start + self.pages_per_task, num_pages) for start in starts]
+        # map returns the results in page order as soon as each one is ready
+        for pages in self._executor.map(_extract_pages, [path] * len(ends), starts, ends):
+            yield from pages
+
+    def lazy_load_data(
+        self, file: Path, extra_info: Optional[Dict] = None, fs=None
+    ) -> Iterator[Document]:
+        path = str(file)
+        total_pages = 0
+        budget = self.group_tokens if self.group_tokens is not None else Settings.chunk_size
+        tokenizer = Settings.tokenizer
+        texts: List[str] = []
+        labels: List[str] = []
+        tokens = 0
+
+        def flush() -> Document:
+            metadata = {
+                "page_label": labels[0],
+                "page_range": _page_range(labels[0], labels[-1]),
+                **(extra_info or {}),
+            }
+            return Document(text="\n\n".join(texts), metadata=metadata)
+
+        for text, label in self._iter_pages(path):
+            total_pages += 1
+            page_tokens = len(tokenizer(text)) if budget else 0
+            if texts and (not budget or tokens + page_tokens > budget):
+                yield flush()
+                texts, labels, tokens = [], [], 0
+            texts.append(text)
+            labels.append(label)
+            tokens += page_tokens
+        if texts:
+            yield flush()
+        logger.debug(f"Read {total_pages} pages from {path}")
+
+    def load_data(
+        self, file: Path, extra_info: Optional[Dict] = None, fs=None
+    ) -> List[Document]:
+        return list(self.lazy_load_data(file, extra_info=extra_info, fs=fs))
+
+    def __del__(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
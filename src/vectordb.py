@@ -1,15 +1,23 @@
 import os
+from typing import Optional
+
 from src.paradedb import ParadeDBVectorStore
 from dotenv import load_dotenv
 from sqlalchemy import make_url
 
-def get_vector_store(table_name: str = "pgvector_boletins") -> ParadeDBVectorStore:
+def get_vector_store(
+    table_name: str = "pgvector_boletins",
+    database: Optional[str] = None,
+    hnsw_kwargs: Optional[dict] = None,
+) -> ParadeDBVectorStore:
     """
     Cria e retorna uma nova instância de PGVectorStore usando os parâmetros fornecidos.
     
     Args:
         table_name (str): Nome da tabela no banco de dados Postgres.
-        schema (str): Nome do esquema (schema) no banco de dados.
+        database (str, opcional): Banco de dados, padrão DB_DATABASE.
+        hnsw_kwargs (dict, opcional): Parâmetros do índice HNSW, padrão HNSW_M,
+            HNSW_EF_CONSTRUCTION e HNSW_EF_SEARCH.
 
     Returns:
         PGVectorStore: Nova instância configurada do vector store.
@@ -20,7 +28,7 @@ def get_vector_store(table_name: str = "pgvector_boletins") -> ParadeDBVectorSto
     port = os.getenv("DB_PORT")
     user = os.getenv("DB_USER")
     password = os.getenv("DB_PASSWORD")
-    database = os.getenv("DB_DATABASE")
+    database = database or os.getenv("DB_DATABASE")
 
     connection_string = f"postgresql://{user}:{password}@{host}:{port}"
     db_name = database
@@ -39,10 +47,18 @@ def get_vector_store(table_name: str = "pgvector_boletins") -> ParadeDBVectorSto
         hybrid_search=True,
         use_bm25=True,
         embed_dim=int(os.getenv("EMBEDDING_DIM")),
-        hnsw_kwargs={
-            "hnsw_m": 16,
-            "hnsw_ef_construction": 64,
-            "hnsw_ef_search": 40,
+        # Filter spreadsheet chunks by sheet and row (created on setup when missing)
+        indexed_metadata_keys={("sheet_name", "text"), ("row_start", "integer")},
+        # Parallel tool calls and concurrent requests each hold a connection
+        create_engine_kwargs={
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+            "max_overflow": int(os.getenv("DB_POOL_MAX_OVERFLOW", 10)),
+        },
+        # Tune with python -m src.benchmarks.retrieval
+        hnsw_kwargs=hnsw_kwargs or {
+            "hnsw_m": int(os.getenv("HNSW_M", 16)),
+            "hnsw_ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", 64)),
+            "hnsw_ef_search": int(os.getenv("HNSW_EF_SEARCH", 40)),
             "hnsw_dist_method": "vector_cosine_ops",
         },
     )
\ No newline at end of file
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Optional
+
+from llama_index.core.settings import Settings
+from sqlalchemy import text
+
+from src.paradedb import ParadeDBVectorStore
+
+logger = logging.getLogger(__name__)
+
+
+def find_vector_store(retriever: Any) -> Optional[ParadeDBVectorStore]:
+    """Unwrap the retriever wrappers (limit, prefetch) down to the index retriever's store."""
+    while retriever is not None:
+        store = getattr(retriever, "_vector_store", None)
+        if store is not None:
+            return store
+        retriever = getattr(retriever, "_retriever", None)
+    return None
+
+
+async def fill_pool(store: ParadeDBVectorStore, size: int) -> None:
+    """Open `size` connections at once so they are pooled before the first request."""
+    await asyncio.to_thread(store._initialize)
+
+    async def ping() -> None:
+        async with store._async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(size)))
+
+
+async def prewarm_indexes(store: ParadeDBVectorStore) -> None:
+    """Load the table and its HNSW and BM25 indexes into shared buffers with pg_prewarm."""
+    table = f"{store.schema_name}.{store._table_class.__tablename__}"
+    relations = [table, f"{table}_embedding_idx", f"{table}_bm25_idx"]
+    async with store._async_engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_prewarm"))
+    for relation in relations:
+        # One transaction per relation, a missing index must not abort the others
+        try:
+            async with store._async_engine.begin() as conn:
+                result = await conn.execute(
+                    text("SELECT pg_prewarm(CAST(:relation AS regclass))"),
+                    {"relation": relation},
+                )
+                logger.info(f"Prewarmed {relation}: {result.scalar()} blocks")
+        except Exception as e:
+            logger.warning(f"Could not prewarm {relation}: {e}")
+
+
+async def warmup(workflow: Any) -> None:
+    """
+    Pay the first-request costs before serving: database pool, TLS handshake with
+    the embedding API and cold index pages. Failures are logged, never raised,
+    and each phase gives up after WARMUP_TIMEOUT seconds.
+
+    Args:
+        workflow: The RoutedWorkflow whose query engine will serve the requests.
+    """
+    start = time.perf_counter()
+    timeout = float(os.getenv("WARMUP_TIMEOUT", 30))
+    store = find_vector_store(workflow.query_engine.retriever)
+    steps = {"embedding": Settings.embed_model.aget_query_embedding("warmup")}
+    if store is not None:
+        pool_size = int(os.getenv("DB_POOL_SIZE", 10))
+        steps["pool"] = fill_pool(store, pool_size)
+    tasks = [asyncio.ensure_future(step) for step in steps.values()]
+    await asyncio.wait(tasks, timeout=timeout)
+    for name, task in zip(steps, tasks):
+        if not task.done():
+            task.cancel()
+            logger.warning(f"Warmup step {name} timed out")
+            continue
+        error = task.exception()
+        if error is not None:
+            logger.warning(f"Warmup step {name} failed: {error}")
+
+    if store is not None and os.getenv("PG_PREWARM", "true").lower() == "true":
+        try:
+            await asyncio.wait_for(prewarm_indexes(store), timeout)
+        except Exception as e:
+            logger.warning(f"Warmup step prewarm failed: {e}")
+    logger.info(f"Warmup finished in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,196 @@
+"""
+Keep the index in sync with DATA_DIR: `uv run generate --watch`.
+
+After one streaming ingestion of DATA_DIR (which catches up with whatever changed while
+nothing was watching), file events are collected until DATA_DIR has been quiet for
+WATCH_DEBOUNCE_MS, then only the added, modified or deleted files are re-ingested and
+the index generation is bumped, so the chat servers stop reusing older answers.
+A file that keeps failing is retried with the next changes, up to WATCH_MAX_ATTEMPTS
+times, then dropped until it changes again.
+
+Events come from inotify (or the native API of the platform) through the optional
+watchfiles package; without it, or with WATCH_FORCE_POLLING=true, DATA_DIR is scanned
+every WATCH_POLL_INTERVAL seconds, which only stats the files.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from src.dedup import NearDuplicateFilter
+from src.generate import IndexLock, generate_index, reindex_files
+from src.index import bump_index_generation
+from src.utils.loaders import DATA_DIR
+from src.vectordb import get_vector_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WATCH_DEBOUNCE_MS = int(os.getenv("WATCH_DEBOUNCE_MS", 2000))
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", 2))
+WATCH_FORCE_POLLING = os.getenv("WATCH_FORCE_POLLING", "false").lower() == "true"
+WATCH_MAX_ATTEMPTS = int(os.getenv("WATCH_MAX_ATTEMPTS", 5))
+# Longest wait for a quiet DATA_DIR, so a file written forever cannot block the others
+MAX_DEBOUNCE_MS = 60_000
+
+
+def _scan(directory: str) -> Dict[str, Tuple[int, int]]:
+    """Size and modification time of every file below the directory."""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[os.path.abspath(path)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def poll_changes(
+    directory: str,
+    interval: float = WATCH_POLL_INTERVAL,
+    debounce_ms: int = WATCH_DEBOUNCE_MS,
+    stop: Optional[threading.Event] = None,
+) -> Iterator[Set[str]]:
+    """
+    Yield the paths that changed below the directory, once it stayed unchanged for
+    `debounce_ms`, by comparing a scan of the file sizes and times every `interval`.
+    """
+    stop = stop or threading.Event()
+    previous = _scan(directory)
+    changed: Set[str] = set()
+    first_change = last_change = 0.0
+    while not stop.wait(interval):
+        current = _scan(directory)
+        diff = {
+            path
+            for path in previous.keys() | current.keys()
+            if previous.get(path) != current.get(path)
+        }
+        previous = current
+        now = time.monotonic()
+        if diff:
+            if not changed:
+                first_change = now
+            changed |= diff
+            last_change = now
+        if changed and (
+            (now - last_change) * 1000 >= debounce_ms
+            or (now - first_change) * 1000 >= MAX_DEBOUNCE_MS
+        ):
+            yield changed
+            changed = set()
+
+
+def watch_changes(
+    directory: str,
+    debounce_ms: int = WATCH_DEBOUNCE_MS,
+    stop: Optional[threading.Event] = None,
+) -> Iterator[Set[str]]:
+    """Changed paths below the directory, from file events or else from polling."""
+    if not WATCH_FORCE_POLLING:
+        try:
+            import watchfiles
+        except ImportError:
+            logger.warning(
+                "Watching DATA_DIR needs the watchfiles package for file events "
+                "(pip install watchfiles), polling instead"
+            )
+        else:
+            logger.info(f"Watching {directory} for file events")
+            # `step` is the quiet period that ends a burst of events
+            for changes in watchfiles.watch(
+                directory,
+                step=debounce_ms,
+                debounce=max(debounce_ms, MAX_DEBOUNCE_MS),
+                stop_event=stop,
+            ):
+                yield {os.path.abspath(path) for _, path in changes}
+            return
+    logger.info(f"Polling {directory} every {WATCH_POLL_INTERVAL}s")
+    yield from poll_changes(directory, debounce_ms=debounce_ms, stop=stop)
+
+
+def _reindex_pending(
+    pending: Set[str],
+    failures: Dict[str, int],
+    lock: IndexLock,
+    vector_store,
+    dedup: Optional[NearDuplicateFilter],
+) -> Tuple[Set[str], bool]:
+    """
+    Re-index the pending files together, or one by one if that fails, so a broken
+    file does not hold back the others.
+
+    Args:
+        failures: Failed attempts per file, updated in place.
+
+    Returns:
+        The files to retry with the next changes, and whether the index changed.
+    """
+    try:
+        changed = reindex_files(pending, vector_store, dedup=dedup, lock=lock)
+    except Exception:
+        logger.warning(f"Failed to re-index {len(pending)} changed files, retrying one by one")
+    else:
+        for path in pending:
+            failures.pop(path, None)
+        return set(), changed
+    retry: Set[str] = set()
+    changed = False
+    for path in pending:
+        try:
+            changed |= reindex_files({path}, vector_store, dedup=dedup, lock=lock)
+        except Exception:
+            failures[path] = failures.get(path, 0) + 1
+            if failures[path] < WATCH_MAX_ATTEMPTS:
+                # e.g. a file still being copied
+                logger.warning(
+                    f"Failed to re-index {path} ({failures[path]} of "
+                    f"{WATCH_MAX_ATTEMPTS} attempts), retrying with the next changes",
+                    exc_info=True,
+                )
+                retry.add(path)
+            else:
+                logger.exception(
+                    f"Giving up on {path} after {failures[path]} attempts, "
+                    "it is re-indexed when it changes again"
+                )
+                del failures[path]
+        else:
+            failures.pop(path, None)
+    return retry, changed
+
+
+def watch_data_dir(stop: Optional[threading.Event] = None) -> None:
+    """
+    Index DATA_DIR, then re-index the files that change until `stop` is set
+    (or the process is interrupted).
+    """
+    generate_index(streaming=True)
+    lock = IndexLock()
+    vector_store = get_vector_store()
+    dedup = None
+    if os.getenv("INGEST_DEDUP", "false").lower() == "true":
+        dedup = NearDuplicateFilter.from_env()
+
+    pending: Set[str] = set()
+    failures: Dict[str, int] = {}
+    try:
+        for changed in watch_changes(DATA_DIR, stop=stop):
+            pending |= changed
+            pending, index_changed = _reindex_pending(
+                pending, failures, lock, vector_store, dedup
+            )
+            if index_changed:
+                generation = bump_index_generation()
+                logger.info(f"Index generation {generation}")
+    except KeyboardInterrupt:
+        pass
+    logger.info("Stopped watching DATA_DIR")
@@ -10,15 +10,34 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.info("Logger inicializado com sucesso.")
 
-from llama_index.core.agent.workflow import AgentWorkflow
+from llama_index.core.agent.workflow import AgentWorkflow, ToolCall, ToolCallResult
 from llama_index.core.settings import Settings
+from llama_index.core.workflow import Context, step
 
 from src.index import get_index
-from src.query import get_query_engine_tool
+from src.query import create_query_engine, get_query_engine_tool
+from src.router import RoutedWorkflow
 from src.settings import init_settings
+load_dotenv()
 
+# How many tool calls of the same agent step run at the same time
+TOOL_CALL_CONCURRENCY = int(os.getenv("TOOL_CALL_CONCURRENCY") or "8")
 
-def create_workflow() -> AgentWorkflow:
+
+class ParallelAgentWorkflow(AgentWorkflow):
+    """
+    AgentWorkflow whose call_tool step has TOOL_CALL_CONCURRENCY workers.
+
+    Workflow steps already run 4 workers by default, so tool calls of one step
+    overlapped before; this makes the count configurable (1 runs them in order).
+    """
+
+    @step(num_workers=TOOL_CALL_CONCURRENCY)
+    async def call_tool(self, ctx: Context, ev: ToolCall) -> ToolCallResult:
+        return await super().call_tool(ctx, ev)
+
+
+def create_workflow() -> RoutedWorkflow:
     load_dotenv()
     init_settings()
     index = get_index()
@@ -27,13 +46,26 @@ def create_workflow() -> AgentWorkflow:
             "Index not found! Please run `uv run generate` to index the data first."
         )
 
-    query_tool = get_query_engine_tool(index=index)
+    query_engine = create_query_engine(index)
+    query_tool = get_query_engine_tool(index=index, query_engine=query_engine)
     # Define the system prompt for the agent
     # Append the citation system prompt to the system prompt
     system_prompt = os.getenv("SYSTEM_PROMPT")
 
-    return AgentWorkflow.from_tools_or_functions(
+    agent = ParallelAgentWorkflow.from_tools_or_functions(
         tools_or_functions=[query_tool],
         llm=Settings.llm,
         system_prompt=system_prompt,
+    )
+
+    baseline_ms = os.getenv("FAST_PATH_BASELINE_MS")
+    # Plain knowledge-base questions skip the agent loop (set FAST_PATH_ROUTING=false to disable)
+    return RoutedWorkflow(
+        agent=agent,
+        query_engine=query_engine,
+        llm=Settings.llm,
+        system_prompt=system_prompt,
+        enabled=os.getenv("FAST_PATH_ROUTING", "true").lower() == "true",
+        baseline_rate=float(os.getenv("FAST_PATH_BASELINE_RATE", 0.05)),
+        baseline_ms=float(baseline_ms) if baseline_ms else None,
     )
\ No newline at end of file